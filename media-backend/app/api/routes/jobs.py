@@ -3,8 +3,12 @@ from fastapi.responses import FileResponse
 from typing import List, Dict, Any
 from ...models.schemas import CreateJobRequest, JobResponse
 from ...models.job_models import JobStatus
-from ...services.job_queue import enqueue_download_merge, enqueue_stream_download, get_task_status
+from ...services.job_queue import (
+    enqueue_download_merge, enqueue_stream_download, get_task_status, release_task, reuse_completed,
+)
+from ...core.executors import io_executor
 from ...core.logging import get_logger
+from ...services import extract_guard
 import os
 
 router = APIRouter(prefix="/media", tags=["jobs"])
@@ -54,7 +58,9 @@ def _task_to_response(task_status: Dict[str, Any]) -> JobResponse:
         "pending": "queued",
         "started": "running",
         "completed": "done",
-        "failed": "error"
+        "failed": "error",
+        "retry": "retrying",
+        "fallback": "downloading",  # piped merge failed, downloading again to temp files
     }
     
     raw_status = task_status.get("status", "pending")
@@ -68,39 +74,57 @@ def _task_to_response(task_status: Dict[str, Any]) -> JobResponse:
         fileName=task_status.get("file_name") if task_status.get("ready") else None,
         mime=task_status.get("mime") if task_status.get("ready") else None,
         sizeBytes=task_status.get("size_bytes") if task_status.get("ready") else None,
+        retries=task_status.get("retries"),
+        maxRetries=task_status.get("max_retries"),
     )
 
 
 
 @router.post("/tasks", response_model=JobResponse)
-def create_task(body: CreateJobRequest) -> JobResponse:
+async def create_task(body: CreateJobRequest) -> JobResponse:
     """
     Create a download task - automatically chooses best method
     """
     format_spec = body.format
     payload = body.model_dump()
     
+    # Known-bad URLs / open breaker: refuse before occupying a worker
+    await io_executor().run(extract_guard.check, body.url, False)
+    
+    # Same media and format finished earlier and still on disk: done already
+    done = await io_executor().run(reuse_completed, body.url, format_spec)
+    if done is not None:
+        return _task_to_response(done)
+    
     if "+" in format_spec:
         # Merge required
-        task = enqueue_download_merge(payload)
+        task = await io_executor().run(enqueue_download_merge, payload)
     else:
         # Progressive download
-        task = enqueue_stream_download(payload)
+        task = await io_executor().run(enqueue_stream_download, payload)
     
     return _task_to_response({"id": task.id, "status": "pending", "progress": 0.0})
 
 @router.get("/tasks/{task_id}", response_model=JobResponse)
-def get_task(task_id: str) -> JobResponse:
+async def get_task(task_id: str) -> JobResponse:
     """Get task status"""
-    task_status = get_task_status(task_id)
+    task_status = await io_executor().run(get_task_status, task_id)
     return _task_to_response(task_status)
 
+@router.delete("/tasks/{task_id}")
+async def cancel_task(task_id: str) -> Dict[str, Any]:
+    """
+    Stop waiting for a task. Identical requests share one job, so it is only
+    revoked when the last requester lets go.
+    """
+    return await io_executor().run(release_task, task_id)
+
 @router.get("/tasks/{task_id}/file")
-def get_task_file(task_id: str):
+async def get_task_file(task_id: str):
     """
     Serve the final file for a completed task
     """
-    task_status = get_task_status(task_id)
+    task_status = await io_executor().run(get_task_status, task_id)
     
     if task_status.get("status") not in ["success", "completed"]:
         raise HTTPException(status_code=409, detail="Task not completed")
@@ -124,24 +148,24 @@ def get_task_file(task_id: str):
 
 # Legacy endpoints for backward compatibility
 @router.post("/jobs", response_model=JobResponse) 
-def create_job_legacy(body: CreateJobRequest) -> JobResponse:
+async def create_job_legacy(body: CreateJobRequest) -> JobResponse:
     """Legacy endpoint - redirects to new task system"""
-    return create_task(body)
+    return await create_task(body)
 
 @router.get("/jobs/{job_id}", response_model=JobResponse)
-def get_job_legacy(job_id: str) -> JobResponse:
+async def get_job_legacy(job_id: str) -> JobResponse:
     """Legacy endpoint"""
-    return get_task(job_id)
+    return await get_task(job_id)
 
 @router.get("/jobs/{job_id}/file")
-def get_job_file_legacy(job_id: str):
+async def get_job_file_legacy(job_id: str):
     """Legacy endpoint"""
-    return get_task_file(job_id)
+    return await get_task_file(job_id)
 
 @router.get("/jobs/{job_id}/progress")
-def get_job_progress(job_id: str):
+async def get_job_progress(job_id: str):
     """Get detailed job progress for debugging"""
-    task_status = get_task_status(job_id)
+    task_status = await io_executor().run(get_task_status, job_id)
     return {
         "id": job_id,
         "raw_status": task_status,
@@ -16,7 +16,7 @@ async def ws_tasks_bus(websocket: WebSocket):
     try:
         last_ping = asyncio.get_event_loop().time()
         while True:
-            msg = pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            msg = pubsub.get_message(ignore_subscribe_messages=True, timeout=0.0)
             if msg and msg["type"] in ("message", "pmessage"):
                 try:
                     data = msg["data"].decode("utf-8")
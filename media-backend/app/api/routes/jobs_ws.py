@@ -3,6 +3,7 @@ from fastapi import APIRouter, WebSocket, WebSocketDisconnect
 import json, asyncio
 from ...services.redis_conn import get_redis
 from ...services.job_queue import get_task_status
+from ...core.executors import io_executor
 
 router = APIRouter()
 
@@ -34,7 +35,7 @@ async def ws_task_progress(websocket: WebSocket, task_id: str):
 
     # Send initial status
     try:
-        status = get_task_status(task_id)
+        status = await io_executor().run(get_task_status, task_id)
         # Convert backend format to frontend format
         if status:
             frontend_status = {
@@ -66,8 +67,8 @@ async def ws_task_progress(websocket: WebSocket, task_id: str):
         last_status_check = last_ping
         
         while True:
-            # Check for pub/sub messages
-            msg = pubsub.get_message(ignore_subscribe_messages=True, timeout=0.5)
+            # Check for pub/sub messages (non-blocking; the sleep below paces the loop)
+            msg = pubsub.get_message(ignore_subscribe_messages=True, timeout=0.0)
             if msg and msg["type"] == "message":
                 try:
                     data = json.loads(msg["data"].decode("utf-8"))
@@ -92,7 +93,7 @@ async def ws_task_progress(websocket: WebSocket, task_id: str):
             # Periodic status check (every 5 seconds) as fallback
             if now - last_status_check > 5.0:
                 try:
-                    status = get_task_status(task_id)
+                    status = await io_executor().run(get_task_status, task_id)
                     if status:
                         # Convert to frontend format
                         frontend_status = {
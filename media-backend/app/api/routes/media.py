@@ -1,8 +1,12 @@
 ﻿# app/api/routes/media.py
-from fastapi import APIRouter, HTTPException, Response, BackgroundTasks
+from fastapi import APIRouter, HTTPException, Request, Response, BackgroundTasks
 from fastapi.responses import StreamingResponse, FileResponse
+from starlette.background import BackgroundTask
 from typing import Any, Dict, List, Optional, Tuple
 from urllib.parse import quote
+import asyncio
+import hashlib
+import json
 import os
 import httpx
 import aiofiles
@@ -10,12 +14,24 @@ import aiofiles
 from ...models.schemas import (
     InfoRequest,          # { url: str }
     InfoResponse,         # { title: str, thumbnail: Optional[str], duration: Optional[int], formats: List[FormatOption] }
+    InfoBasic,            # { title: str, thumbnail: Optional[str], duration: Optional[int] }
     DirectUrlRequest,     # { url: str, format_id: str }
     DirectUrlResponse,    # { url: str, headers?: Dict[str,str], mime?: str, fileName?: str }
     FormatOption,         # { format_string: str, label: str, ext?: str, note?: str, sizeBytes?: Optional[int] }
 )
-from ...services.ytdlp_service import extract_info
-from ...services.job_queue import enqueue_stream_download, enqueue_download_merge, get_task_status
+from ...services.ytdlp_service import resolve_formats, snapshot_format
+from ...services.url_canon import canonicalize, cache_key
+from ...services.basic_info import fetch_basic_info
+from ...services import http_pool
+from ...services.segmented_fetch import SegmentedFetch
+from ...services import artifact_index, stream_cache, stream_merge
+from ...services.extract_guard import ExtractionBlocked
+from ...services.job_queue import (
+    enqueue_stream_download, enqueue_download_merge, get_task_status, fetch_info, reuse_completed,
+)
+from ...core.executors import ExecutorSaturated, extract_executor, io_executor
+from ...core import metrics
+from ...core.config import get_settings
 from ...core.logging import get_logger
 
 router = APIRouter(prefix="/media", tags=["media"])
@@ -117,6 +133,14 @@ def _get_mobile_optimized_headers(mime_type: str, filename: str) -> Dict[str, st
     }
 
 
+def _fallback_title(url: str) -> str:
+    """Title for jobs created without one: the media id rather than share-link junk."""
+    key = canonicalize(url)
+    if key.platform != "url":
+        return f"{key.platform}-{key.media_id}"
+    return url.rstrip("/").split("/")[-1].split("?")[0] or "download"
+
+
 def _family_from_ext(ext: Optional[str]) -> Optional[str]:
     if not ext:
         return None
@@ -236,62 +260,261 @@ def _ladder_from_info(info: Dict[str, Any]) -> List[FormatOption]:
     return out
 
 
+def _basic_from_info(data: Dict[str, Any]) -> InfoBasic:
+    """First-paint fields of a full extraction."""
+    # Pick largest thumbnail if present
+    thumb = None
+    thumbs = data.get("thumbnails") or []
+    if thumbs:
+        thumb = sorted(thumbs, key=lambda x: x.get("width") or 0)[-1].get("url")
+    return InfoBasic(
+        title=data.get("title") or "Untitled",
+        thumbnail=thumb or data.get("thumbnail"),
+        duration=_safe_int(data.get("duration")),
+    )
+
+
+def _ndjson(obj: Dict[str, Any]) -> bytes:
+    return (json.dumps(obj) + "\n").encode("utf-8")
+
+
 # ---------------------- Routes ----------------------
 
 @router.post("/info", response_model=InfoResponse)
-def info(body: InfoRequest) -> InfoResponse:
+async def info(body: InfoRequest) -> InfoResponse:
     """
     Return metadata + frontend-friendly formats (progressive + merge ladders).
+    Extraction runs on the extract queue; cached results return immediately.
     """
     try:
-        data = extract_info(body.url)
-        title: str = data.get("title") or "Untitled"
-        duration: Optional[int] = _safe_int(data.get("duration"))
-        # Pick largest thumbnail if present
-        thumb = None
-        thumbs = data.get("thumbnails") or []
-        if thumbs:
-            thumb = sorted(thumbs, key=lambda x: x.get("width") or 0)[-1].get("url")
-
+        data = await fetch_info(body.url)
+        basic = _basic_from_info(data)
         formats = _ladder_from_info(data)
         return InfoResponse(
-            title=title,
-            thumbnail=thumb,
-            duration=duration,
+            title=basic.title,
+            thumbnail=basic.thumbnail,
+            duration=basic.duration,
             formats=formats,
         )
+    except (ExecutorSaturated, ExtractionBlocked):
+        raise
+    except TimeoutError as e:
+        log.warning(f"info() timed out: {e}")
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
         log.exception("info() failed")
         raise HTTPException(status_code=400, detail=str(e))
 
 
-@router.post("/stream/{format_id}")
-async def stream_download_direct(format_id: str, body: DirectUrlRequest):
+@router.post("/info/stream")
+async def info_stream(body: InfoRequest):
     """
-    Stream download for progressive formats with mobile-optimized headers
-    Returns streaming response that Android can save directly
+    Two-phase /info as NDJSON: a {"type": "basic"} line with title/thumbnail/
+    duration as soon as the cache or a lightweight oEmbed pass has them, then
+    a {"type": "formats"} line once the full extraction finishes (or a
+    {"type": "error"} line if it fails).
     """
+    async def generate():
+        full = asyncio.create_task(fetch_info(body.url))
+        quick = asyncio.create_task(fetch_basic_info(body.url))
+        basic_sent = False
+        try:
+            await asyncio.wait({full, quick}, return_when=asyncio.FIRST_COMPLETED)
+            if not full.done() and quick.result():
+                yield _ndjson({"type": "basic", "partial": True, **quick.result()})
+                basic_sent = True
+
+            try:
+                data = await full
+            except Exception as e:
+                log.warning(f"info_stream() failed: {e}")
+                if isinstance(e, ExtractionBlocked):
+                    status = 503 if e.kind == "circuit_open" else 400
+                else:
+                    status = 503 if isinstance(e, ExecutorSaturated) else 504 if isinstance(e, TimeoutError) else 400
+                yield _ndjson({"type": "error", "status": status, "detail": str(e)})
+                return
+
+            if not basic_sent:
+                yield _ndjson({"type": "basic", "partial": False, **_basic_from_info(data).model_dump()})
+            formats = _ladder_from_info(data)
+            yield _ndjson({"type": "formats", "formats": [f.model_dump() for f in formats]})
+        finally:
+            for t in (full, quick):
+                t.cancel()
+
+    return StreamingResponse(
+        generate(),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def _parse_range(value: Optional[str]) -> Optional[Tuple[Optional[int], Optional[int]]]:
+    """Parse a single `bytes=` range into (start, end); end and start may be None (open / suffix)."""
+    if not value or not value.strip().lower().startswith("bytes="):
+        return None
+    spec = value.split("=", 1)[1].strip()
+    if "," in spec:
+        return None  # multipart ranges: serve the whole entity instead
+    first, _, last = spec.partition("-")
+    try:
+        start = int(first) if first.strip() else None
+        end = int(last) if last.strip() else None
+    except ValueError:
+        return None
+    if start is None and end is None:
+        return None
+    if start is not None and end is not None and end < start:
+        return None
+    return start, end
+
+
+def _etag_for(media_key: str, fmt: Dict[str, Any]) -> str:
+    seed = f"{media_key}:{fmt.get('format_id')}:{fmt.get('filesize')}"
+    return '"' + hashlib.sha1(seed.encode("utf-8")).hexdigest()[:20] + '"'
+
+
+def _range_headers(request: Request, etag: str) -> Dict[str, str]:
+    """Range / If-Range to forward upstream for this client request."""
+    rng = request.headers.get("range")
+    if _parse_range(rng) is None:
+        return {}
+    if_range = request.headers.get("if-range")
+    if not if_range:
+        return {"Range": rng}
+    if if_range.startswith('"') or if_range.startswith("W/"):
+        # Entity tags are ours: a stale one means the client gets the full body
+        return {"Range": rng} if if_range == etag else {}
+    # HTTP-date: upstream's Last-Modified is passed through, let it decide
+    return {"Range": rng, "If-Range": if_range}
+
+
+def _file_meta(info: Dict[str, Any], fmt: Dict[str, Any]) -> Tuple[str, str]:
+    """Download file name and MIME type for a progressive format."""
+    ext = fmt.get("ext") or "mp4"
+    title = (info.get("title") or "download").replace("/", "_").replace("\\", "_")
+    filename = f"{title}.{ext}"
+    mime_type = {
+        "mp4": "video/mp4",
+        "webm": "video/webm", 
+        "mkv": "video/x-matroska",
+        "m4a": "audio/mp4",
+        "mp3": "audio/mpeg"
+    }.get(ext, "application/octet-stream")
+    return filename, mime_type
+
+
+async def _serve_from_cache(entry: stream_cache.CacheEntry, request: Request, media_key: str,
+                            fmt: Dict[str, Any], info: Dict[str, Any]) -> Optional[Response]:
+    """Answer from the tee cache if the entry is complete, or attach to it while it fills."""
+    filename, mime_type = _file_meta(info, fmt)
+    headers = _get_mobile_optimized_headers(mime_type, filename)
+    headers["ETag"] = _etag_for(media_key, fmt)
+
+    meta = await io_executor().run(stream_cache.lookup, entry)
+    if meta is not None:
+        metrics.shared_incr("stream_cache.hits")
+        metrics.shared_incr("stream_cache.bytes_served", meta["total"])
+        if meta.get("last_modified"):
+            headers["Last-Modified"] = meta["last_modified"]
+        accel = stream_cache.accel_path(entry)
+        if accel:
+            # Nginx serves the file (and any Range) from an internal location
+            return Response(media_type=mime_type, headers={**headers, "X-Accel-Redirect": accel})
+        return FileResponse(entry.path, media_type=mime_type, headers=headers)
+
+    if request.headers.get("range"):
+        return None
+    meta = await io_executor().run(stream_cache.filling, entry)
+    if meta is None:
+        return None
+    metrics.shared_incr("stream_cache.attached")
+    headers["Content-Length"] = str(meta["total"])
+    return StreamingResponse(stream_cache.follow(entry, meta["total"], meta["part"]),
+                             media_type=mime_type, headers=headers)
+
+
+async def _live_merge(format_id: str, url: str) -> Optional[Response]:
+    """Mux a merge format on the fly; None when it cannot be streamed and a job should run instead."""
+    video_id, audio_id = format_id.split("+", 1)
+    media_key = cache_key(url)
+    done = await io_executor().run(artifact_index.lookup, media_key, format_id)
+    if done is not None:
+        return FileResponse(done["path"], media_type=done["mime"],
+                            headers=_get_mobile_optimized_headers(done["mime"], done["file_name"]))
+
+    try:
+        info, snaps = await extract_executor().run(resolve_formats, url, [video_id, audio_id], media_key)
+    except ExtractionBlocked:
+        raise  # the merge job would be refused the same way
+    except Exception as e:
+        log.warning(f"Live merge of {format_id} could not resolve formats, falling back to a merge job: {e}")
+        return None
+    if video_id not in snaps or audio_id not in snaps:
+        return None  # the merge job reports what is missing
+    merge = stream_merge.LiveMerge(snaps[video_id], snaps[audio_id])
+    try:
+        await merge.start()
+    except Exception as e:
+        await merge.aclose()
+        log.warning(f"Live merge of {format_id} unavailable, falling back to a merge job: {e}")
+        return None
+
+    ext = "mp4" if merge.container == stream_merge.FRAGMENTED_MP4 else "mkv"
+    filename, mime_type = _file_meta(info, {"ext": ext})
+    headers = _get_mobile_optimized_headers(mime_type, filename)
+    headers["Accept-Ranges"] = "none"  # produced on the fly: no length, no resume
+
+    async def generate():
+        try:
+            async for chunk in merge.iter_bytes():
+                yield chunk
+        except stream_merge.StreamMergeError as e:
+            log.warning(f"Live merge of {format_id} aborted after {merge.bytes_out} bytes: {e}")
+            raise  # truncate the chunked body so the client sees an incomplete download
+        finally:
+            # Runs on completion, failure and client disconnect (cancellation or generator close)
+            await merge.aclose()
+
+    return StreamingResponse(generate(), media_type=mime_type, headers=headers)
+
+
+async def _proxy_stream(format_id: str, url: str, request: Request):
     if "+" in format_id:
+        if get_settings().LIVE_MERGE_ENABLED:
+            live = await _live_merge(format_id, url)
+            if live is not None:
+                return live
         # For merge formats, use the job system instead
-        task = enqueue_download_merge({
-            "url": body.url,
+        done = await io_executor().run(reuse_completed, url, format_id)
+        if done is not None:
+            return {"task_id": done["id"], "message": "Already downloaded"}
+        task = await io_executor().run(enqueue_download_merge, {
+            "url": url,
             "format": format_id,
             "title": "video"
         })
         return {"task_id": task.id, "message": "Merge job started, use WebSocket to track progress"}
     
     try:
-        info = extract_info(body.url)
+        info = await fetch_info(url)  # warms the cache through the extract queue
+        media_key = cache_key(url)
+        entry = None
+        if get_settings().STREAM_CACHE_ENABLED:
+            # The snapshot the proxy path below uses too, so both hash the same ETag fields
+            fmt = snapshot_format(info, format_id)
+            if fmt and fmt["vcodec"] != "none" and fmt["acodec"] != "none":
+                entry = stream_cache.entry_for(media_key, format_id, fmt.get("ext") or "mp4")
+                cached = await _serve_from_cache(entry, request, media_key, fmt, info)
+                if cached is not None:
+                    return cached
+        info, snaps = await extract_executor().run(resolve_formats, url, [format_id], media_key)
         
         # Find progressive format
-        target_format = None
-        for fmt in info.get("formats", []):
-            if str(fmt.get("format_id")) == str(format_id):
-                vcodec = str(fmt.get("vcodec", "none"))
-                acodec = str(fmt.get("acodec", "none"))
-                if vcodec != "none" and acodec != "none":
-                    target_format = fmt
-                    break
+        target_format = snaps.get(format_id)
+        if target_format and (target_format["vcodec"] == "none" or target_format["acodec"] == "none"):
+            target_format = None
         
         if not target_format:
             raise HTTPException(status_code=404, detail="Progressive format not found")
@@ -299,43 +522,118 @@ async def stream_download_direct(format_id: str, body: DirectUrlRequest):
         direct_url = target_format.get("url")
         if not direct_url:
             raise HTTPException(status_code=400, detail="No direct URL available")
+        etag = _etag_for(media_key, target_format)
+        upstream_headers = target_format.get("http_headers") or {}
+        forwarded = _range_headers(request, etag)
         
         # Get file info
-        ext = target_format.get("ext", "mp4")
-        title = (info.get("title") or "download").replace("/", "_").replace("\\", "_")
-        filename = f"{title}.{ext}"
-        mime_type = {
-            "mp4": "video/mp4",
-            "webm": "video/webm", 
-            "mkv": "video/x-matroska",
-            "m4a": "audio/mp4",
-            "mp3": "audio/mpeg"
-        }.get(ext, "application/octet-stream")
-        
-        # Create streaming generator
-        async def generate():
-            async with httpx.AsyncClient(timeout=300.0) as client:
-                async with client.stream("GET", direct_url) as response:
-                    response.raise_for_status()
-                    async for chunk in response.aiter_bytes(chunk_size=1024*1024):
+        filename, mime_type = _file_meta(info, target_format)
+
+        # Large files are pulled over several connections; small ones are one GET on the shared client
+        filesize = target_format.get("filesize") or 0
+        small = 0 < filesize < get_settings().SEGMENT_MIN_FILE_SIZE
+        fetch = SegmentedFetch(
+            direct_url, upstream_headers, _parse_range(forwarded.get("Range")),
+            if_range=forwarded.get("If-Range"),
+            client=http_pool.get_client() if small else None,
+            connections=1 if small else None,
+        )
+        # Open upstream before answering so its status and length can be propagated
+        try:
+            await fetch.open()
+        except BaseException:
+            await fetch.aclose()
+            raise
+        tee = None
+        try:
+            headers = _get_mobile_optimized_headers(mime_type, filename)
+            headers["ETag"] = etag
+            if fetch.response_headers.get("last-modified"):
+                headers["Last-Modified"] = fetch.response_headers["last-modified"]
+
+            if fetch.status == 416:
+                await fetch.aclose()
+                size = fetch.total or filesize or "*"
+                return Response(status_code=416, headers={"Content-Range": f"bytes */{size}", "Accept-Ranges": "bytes"})
+            if fetch.status >= 400:
+                raise HTTPException(status_code=502, detail=f"Upstream returned {fetch.status}")
+
+            status_code = 200
+            if fetch.ranged and "Range" in forwarded:
+                if fetch.end is None and fetch.start > 0:
+                    # Size unknown upstream: no valid Content-Range can be sent for a partial body
+                    raise HTTPException(status_code=502, detail="Upstream did not report the size")
+                if fetch.end is not None:
+                    status_code = 206
+                    headers["Content-Range"] = f"bytes {fetch.start}-{fetch.end}/{fetch.total or '*'}"
+            if fetch.content_length is not None:
+                headers["Content-Length"] = str(fetch.content_length)
+
+            # Opt-in: keep a copy of full responses so repeat requests are served from disk
+            full = "Range" not in forwarded and fetch.total and fetch.start == 0 and fetch.content_length == fetch.total
+            if entry is not None and full:
+                validators = {"last_modified": fetch.response_headers.get("last-modified")}
+                token = await io_executor().run(stream_cache.claim_fill, entry, fetch.content_length, validators)
+                if token:
+                    tee = await stream_cache.TeeWriter.open(entry, fetch.content_length, token)
+                    metrics.shared_incr("stream_cache.misses")
+
+            async def cleanup():
+                if tee is not None:
+                    await tee.abort()  # no-op once committed
+                await fetch.aclose()
+
+            # Create streaming generator
+            async def generate():
+                try:
+                    async for chunk in fetch.iter_bytes():
+                        if tee is not None:
+                            await tee.write(chunk)
                         yield chunk
+                    if tee is not None:
+                        await tee.commit()
+                finally:
+                    await cleanup()
         
-        # Return streaming response with mobile-optimized headers
-        headers = _get_mobile_optimized_headers(mime_type, filename)
-        return StreamingResponse(
-            generate(),
-            media_type=mime_type,
-            headers=headers
-        )
+            # Return streaming response with mobile-optimized headers
+            return StreamingResponse(
+                generate(),
+                status_code=status_code,
+                media_type=mime_type,
+                headers=headers,
+                background=BackgroundTask(cleanup),  # client went away before the body finished
+            )
+        except BaseException:
+            # Nothing will stream: give back the upstream connection (and a started cache fill)
+            if tee is not None:
+                await tee.abort()
+            await fetch.aclose()
+            raise
         
-    except HTTPException:
+    except (HTTPException, ExecutorSaturated, ExtractionBlocked, http_pool.HostBusy):
         raise
     except Exception as e:
         log.exception("stream_download_direct failed")
         raise HTTPException(status_code=400, detail=str(e))
 
+
+@router.post("/stream/{format_id}")
+async def stream_download_direct(format_id: str, body: DirectUrlRequest, request: Request):
+    """
+    Stream download for progressive formats with mobile-optimized headers
+    Returns streaming response that Android can save directly.
+    Honors Range / If-Range, so interrupted downloads resume where they stopped.
+    """
+    return await _proxy_stream(format_id, body.url, request)
+
+
+@router.get("/stream/{format_id}")
+async def stream_download_direct_get(format_id: str, url: str, request: Request):
+    """GET form of /stream for download managers and players that resume or seek with plain GETs."""
+    return await _proxy_stream(format_id, url, request)
+
 @router.post("/download")
-def download_media(body: DirectUrlRequest):
+async def download_media(body: DirectUrlRequest):
     """
     Smart download endpoint that chooses the best method:
     - Progressive formats: Direct streaming 
@@ -343,12 +641,21 @@ def download_media(body: DirectUrlRequest):
     """
     format_id = body.format_id
     
+    done = await io_executor().run(reuse_completed, body.url, format_id)
+    if done is not None:
+        return {
+            "method": "cache",
+            "task_id": done["id"],
+            "websocket_url": f"/ws/tasks/{done['id']}",
+            "message": "Already downloaded"
+        }
+    
     if "+" in format_id:
         # Merge format - use background job
-        task = enqueue_download_merge({
+        task = await io_executor().run(enqueue_download_merge, {
             "url": body.url,
             "format": format_id,
-            "title": body.url.split("/")[-1]  # Simple title extraction
+            "title": _fallback_title(body.url)
         })
         return {
             "method": "job",
@@ -358,10 +665,10 @@ def download_media(body: DirectUrlRequest):
         }
     else:
         # Progressive format - use streaming task for better reliability
-        task = enqueue_stream_download({
+        task = await io_executor().run(enqueue_stream_download, {
             "url": body.url,
             "format_id": format_id,
-            "title": body.url.split("/")[-1]
+            "title": _fallback_title(body.url)
         })
         return {
             "method": "stream_job",
@@ -371,14 +678,14 @@ def download_media(body: DirectUrlRequest):
         }
 
 @router.get("/task/{task_id}")
-def get_download_status(task_id: str):
+async def get_download_status(task_id: str):
     """Get download task status"""
-    return get_task_status(task_id)
+    return await io_executor().run(get_task_status, task_id)
 
 @router.get("/download/{task_id}/file")
-def download_completed_file(task_id: str):
+async def download_completed_file(task_id: str):
     """Download completed file with mobile-optimized headers"""
-    task_info = get_task_status(task_id)
+    task_info = await io_executor().run(get_task_status, task_id)
     
     if task_info.get("status") != "completed":
         raise HTTPException(status_code=400, detail="Download not completed yet")
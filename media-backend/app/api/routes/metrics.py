@@ -0,0 +1,16 @@
+# app/api/routes/metrics.py
+from fastapi import APIRouter
+from ...core import metrics
+from ...core.executors import io_executor
+from ...services import progress  # noqa: F401  (registers the worker emit-rate collector)
+
+router = APIRouter(tags=["metrics"])
+
+
+@router.get("/metrics")
+async def get_metrics():
+    """Process-local metrics plus counters shared by all workers."""
+    return {
+        "process": await io_executor().run(metrics.snapshot),
+        "shared": await io_executor().run(metrics.shared_snapshot),
+    }
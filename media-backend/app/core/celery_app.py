@@ -1,4 +1,5 @@
 from celery import Celery
+from celery.signals import worker_process_init
 from .config import get_settings
 
 settings = get_settings()
@@ -7,7 +8,7 @@ celery_app = Celery(
     "media_downloader",
     broker=settings.REDIS_URL,
     backend=settings.REDIS_URL,
-    include=["app.workers.celery_tasks"]
+    include=["app.workers.celery_tasks", "app.workers.tasks.extract"]
 )
 
 celery_app.conf.update(
@@ -17,13 +18,23 @@ celery_app.conf.update(
     timezone="UTC",
     enable_utc=True,
     task_track_started=True,
+    # Progress lives in progress:<task id> (app.services.progress); the backend keeps final results only
+    result_expires=settings.CELERY_RESULT_EXPIRES,
     task_routes={
         "app.workers.celery_tasks.download_and_merge": {"queue": "downloads"},
         "app.workers.celery_tasks.stream_download": {"queue": "streams"},
+        "app.workers.tasks.extract.extract_metadata": {"queue": "extract"},
     },
     worker_prefetch_multiplier=1,
     task_acks_late=True,
     worker_max_tasks_per_child=50,
     task_time_limit=3600,  # 1 hour max
     task_soft_time_limit=3300,  # 55 minutes soft limit
-)
\ No newline at end of file
+)
+
+
+@worker_process_init.connect
+def _warm_up_ytdlp(**_):
+    """Preload extractors and the shared player cache in each new worker process."""
+    from ..services.ytdlp_cache import warm_up_in_background
+    warm_up_in_background()
@@ -25,6 +25,106 @@ class Settings(BaseModel):
     STORAGE_DIR: str = Field(default=os.getenv("STORAGE_DIR", "./storage"))
     TMP_DIR: str = Field(default=os.getenv("TMP_DIR", "./.tmp"))
 
+    # Metadata cache (in-process LRU in front of a shared Redis tier)
+    INFO_CACHE_MAX_ENTRIES: int = Field(default=int(os.getenv("INFO_CACHE_MAX_ENTRIES", "256")))
+    INFO_CACHE_DEFAULT_TTL: int = Field(default=int(os.getenv("INFO_CACHE_DEFAULT_TTL", "600")))  # no signed URLs
+    INFO_CACHE_MAX_TTL: int = Field(default=int(os.getenv("INFO_CACHE_MAX_TTL", "14400")))  # 4 hours
+    INFO_CACHE_EXPIRY_MARGIN: int = Field(default=int(os.getenv("INFO_CACHE_EXPIRY_MARGIN", "300")))
+
+    # Single-flight coalescing of identical extractions
+    SINGLEFLIGHT_LOCK_TTL: int = Field(default=int(os.getenv("SINGLEFLIGHT_LOCK_TTL", "90")))
+    SINGLEFLIGHT_WAIT_TIMEOUT: float = Field(default=float(os.getenv("SINGLEFLIGHT_WAIT_TIMEOUT", "120")))
+    SINGLEFLIGHT_POLL_INTERVAL: float = Field(default=float(os.getenv("SINGLEFLIGHT_POLL_INTERVAL", "0.2")))
+
+    # Extraction: "celery" runs it on the extract queue, "local" in the API process
+    EXTRACT_MODE: str = Field(default=os.getenv("EXTRACT_MODE", "celery"))
+    EXTRACT_TIMEOUT: float = Field(default=float(os.getenv("EXTRACT_TIMEOUT", "90")))
+    EXTRACT_CONCURRENCY: int = Field(default=int(os.getenv("EXTRACT_CONCURRENCY", "4")))  # extract worker processes
+
+    # Bounded executors for blocking work in async routes (workers + queued calls)
+    EXTRACT_EXECUTOR_WORKERS: int = Field(default=int(os.getenv("EXTRACT_EXECUTOR_WORKERS", "8")))
+    EXTRACT_EXECUTOR_QUEUE: int = Field(default=int(os.getenv("EXTRACT_EXECUTOR_QUEUE", "32")))
+    IO_EXECUTOR_WORKERS: int = Field(default=int(os.getenv("IO_EXECUTOR_WORKERS", "16")))
+    IO_EXECUTOR_QUEUE: int = Field(default=int(os.getenv("IO_EXECUTOR_QUEUE", "256")))
+
+    # Shared yt-dlp cache (player JS, signature solutions) and worker warm-up
+    YTDLP_CACHE_DIR: str = Field(default=os.getenv("YTDLP_CACHE_DIR", "./.cache/yt-dlp"))
+    YTDLP_WARMUP_URL: str = Field(default=os.getenv("YTDLP_WARMUP_URL", "https://www.youtube.com/watch?v=jNQXAC9IVRw"))
+    YTDLP_WARMUP_INTERVAL: int = Field(default=int(os.getenv("YTDLP_WARMUP_INTERVAL", "3600")))
+
+    # Per-process pool of pre-built YoutubeDL instances
+    YTDL_POOL_MAX_IDLE: int = Field(default=int(os.getenv("YTDL_POOL_MAX_IDLE", "4")))  # per profile/cookie file
+    YTDL_POOL_MAX_USES: int = Field(default=int(os.getenv("YTDL_POOL_MAX_USES", "200")))  # then rebuilt
+
+    # Extraction circuit breaker (per platform, error rate over a sliding window)
+    BREAKER_WINDOW: int = Field(default=int(os.getenv("BREAKER_WINDOW", "300")))
+    BREAKER_MIN_REQUESTS: int = Field(default=int(os.getenv("BREAKER_MIN_REQUESTS", "20")))
+    BREAKER_ERROR_RATE: float = Field(default=float(os.getenv("BREAKER_ERROR_RATE", "0.5")))
+    BREAKER_COOLDOWN: int = Field(default=int(os.getenv("BREAKER_COOLDOWN", "60")))
+
+    # Shared upstream HTTP client for proxied streams
+    UPSTREAM_HTTP2: bool = Field(default=os.getenv("UPSTREAM_HTTP2", "true").lower() in ("1", "true", "yes"))
+    UPSTREAM_MAX_CONNECTIONS: int = Field(default=int(os.getenv("UPSTREAM_MAX_CONNECTIONS", "200")))
+    UPSTREAM_MAX_KEEPALIVE: int = Field(default=int(os.getenv("UPSTREAM_MAX_KEEPALIVE", "50")))
+    UPSTREAM_KEEPALIVE_EXPIRY: float = Field(default=float(os.getenv("UPSTREAM_KEEPALIVE_EXPIRY", "60")))
+    UPSTREAM_HOST_STARTS: int = Field(default=int(os.getenv("UPSTREAM_HOST_STARTS", "16")))  # requests per origin awaiting headers
+    UPSTREAM_SLOT_WAIT: float = Field(default=float(os.getenv("UPSTREAM_SLOT_WAIT", "10")))  # then 503
+    UPSTREAM_CONNECT_TIMEOUT: float = Field(default=float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", "10")))
+    UPSTREAM_READ_TIMEOUT: float = Field(default=float(os.getenv("UPSTREAM_READ_TIMEOUT", "60")))
+    UPSTREAM_DNS_TTL: float = Field(default=float(os.getenv("UPSTREAM_DNS_TTL", "300")))
+
+    # Segmented multi-connection fetching of large upstream files
+    SEGMENT_CONNECTIONS: int = Field(default=int(os.getenv("SEGMENT_CONNECTIONS", "4")))  # per stream
+    SEGMENT_HOST_CONNECTIONS: str = Field(default=os.getenv("SEGMENT_HOST_CONNECTIONS", "googlevideo.com=6"))  # host=n,...
+    SEGMENT_INITIAL_SIZE: int = Field(default=int(os.getenv("SEGMENT_INITIAL_SIZE", str(1024 * 1024))))
+    SEGMENT_MIN_SIZE: int = Field(default=int(os.getenv("SEGMENT_MIN_SIZE", str(512 * 1024))))
+    SEGMENT_MAX_SIZE: int = Field(default=int(os.getenv("SEGMENT_MAX_SIZE", str(8 * 1024 * 1024))))
+    SEGMENT_TARGET_SECONDS: float = Field(default=float(os.getenv("SEGMENT_TARGET_SECONDS", "2")))
+    SEGMENT_WINDOW: int = Field(default=int(os.getenv("SEGMENT_WINDOW", "8")))  # segments buffered ahead of the reader
+    SEGMENT_RETRIES: int = Field(default=int(os.getenv("SEGMENT_RETRIES", "3")))
+    SEGMENT_MIN_FILE_SIZE: int = Field(default=int(os.getenv("SEGMENT_MIN_FILE_SIZE", str(8 * 1024 * 1024))))  # smaller: one GET
+
+    # Memory bounds for proxied streams
+    STREAM_MEMORY_BUDGET: int = Field(default=int(os.getenv("STREAM_MEMORY_BUDGET", str(512 * 1024 * 1024))))  # per process
+    STREAM_BUFFER_HIGH: int = Field(default=int(os.getenv("STREAM_BUFFER_HIGH", str(32 * 1024 * 1024))))  # per connection
+    STREAM_BUFFER_LOW: int = Field(default=int(os.getenv("STREAM_BUFFER_LOW", str(8 * 1024 * 1024))))
+    STREAM_CHUNK_SIZE: int = Field(default=int(os.getenv("STREAM_CHUNK_SIZE", str(256 * 1024))))
+
+    # Opt-in tee cache: proxied streams are kept under STORAGE_DIR/stream-cache
+    STREAM_CACHE_ENABLED: bool = Field(default=os.getenv("STREAM_CACHE_ENABLED", "false").lower() in ("1", "true", "yes"))
+    STREAM_CACHE_MAX_BYTES: int = Field(default=int(os.getenv("STREAM_CACHE_MAX_BYTES", str(20 * 1024 ** 3))))
+    STREAM_CACHE_FILL_TTL: int = Field(default=int(os.getenv("STREAM_CACHE_FILL_TTL", "60")))  # writer lease, refreshed
+    STREAM_CACHE_ACCEL_PREFIX: Optional[str] = Field(default=os.getenv("STREAM_CACHE_ACCEL_PREFIX"))  # e.g. /_stream_cache
+
+    # Index of completed downloads reused by create_task
+    ARTIFACT_INDEX_TTL: int = Field(default=int(os.getenv("ARTIFACT_INDEX_TTL", "604800")))  # 7 days
+
+    # Identical download requests share one in-flight task
+    INFLIGHT_TTL: int = Field(default=int(os.getenv("INFLIGHT_TTL", "7200")))  # upper bound on a job's slot
+
+    # "stream": pipe both formats of a merge into ffmpeg; "files": download to temp files first
+    MERGE_MODE: str = Field(default=os.getenv("MERGE_MODE", "stream"))
+    MERGE_TASK_CONNECTIONS: int = Field(default=int(os.getenv("MERGE_TASK_CONNECTIONS", "6")))  # shared by both legs
+
+    # /media/stream with a merge format muxes live instead of starting a job
+    LIVE_MERGE_ENABLED: bool = Field(default=os.getenv("LIVE_MERGE_ENABLED", "true").lower() in ("1", "true", "yes"))
+    LIVE_MERGE_FIRST_BYTE_TIMEOUT: float = Field(default=float(os.getenv("LIVE_MERGE_FIRST_BYTE_TIMEOUT", "30")))
+    LIVE_MERGE_MAX: int = Field(default=int(os.getenv("LIVE_MERGE_MAX", "4")))  # per API process; beyond: merge job
+
+    # Resumable downloads: per-job checkpoints of completed byte ranges
+    CHECKPOINT_TTL: int = Field(default=int(os.getenv("CHECKPOINT_TTL", "86400")))
+
+    # Download jobs reschedule transient failures instead of sleeping in the worker
+    TASK_MAX_RETRIES: int = Field(default=int(os.getenv("TASK_MAX_RETRIES", "5")))
+    RETRY_BACKOFF_MAX: float = Field(default=float(os.getenv("RETRY_BACKOFF_MAX", "300")))  # seconds
+
+    # Task progress: updates within the interval / below the delta are coalesced
+    PROGRESS_MIN_INTERVAL: float = Field(default=float(os.getenv("PROGRESS_MIN_INTERVAL", "0.5")))  # seconds
+    PROGRESS_MIN_DELTA: float = Field(default=float(os.getenv("PROGRESS_MIN_DELTA", "0.01")))  # fraction
+    PROGRESS_HEARTBEAT: float = Field(default=float(os.getenv("PROGRESS_HEARTBEAT", "5")))  # seconds
+    PROGRESS_TTL: int = Field(default=int(os.getenv("PROGRESS_TTL", "600")))  # seconds after the last update
+    CELERY_RESULT_EXPIRES: int = Field(default=int(os.getenv("CELERY_RESULT_EXPIRES", "86400")))  # final results
+
     # CORS
     CORS_ORIGINS: str = Field(default=os.getenv("CORS_ORIGINS", "*"))  # comma-separated
 
@@ -0,0 +1,85 @@
+# app/core/executors.py
+"""
+Dedicated, bounded thread pools for blocking work done by async routes.
+
+Extraction and Redis/Celery lookups get separate pools so a burst of slow
+extractions can never queue in front of a cheap status poll. Each pool
+admits at most `workers + queue_limit` calls; beyond that `run` raises
+ExecutorSaturated straight away, which the app turns into a 503.
+"""
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from .config import get_settings
+
+
+class ExecutorSaturated(RuntimeError):
+    """Raised when a bounded executor has no room for another call."""
+
+    def __init__(self, name: str):
+        super().__init__(f"{name} executor is saturated")
+        self.name = name
+
+
+class BoundedExecutor:
+    def __init__(self, name: str, workers: int, queue_limit: int):
+        self.name = name
+        self.workers = workers
+        self.limit = workers + queue_limit
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"{name}-exec")
+        self._lock = threading.Lock()
+        self._pending = 0
+        self.rejected = 0
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    async def run(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        with self._lock:
+            if self._pending >= self.limit:
+                self.rejected += 1
+                raise ExecutorSaturated(self.name)
+            self._pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._pool, functools.partial(fn, *args, **kwargs))
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def shutdown(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+_extract: Optional[BoundedExecutor] = None
+_io: Optional[BoundedExecutor] = None
+
+
+def extract_executor() -> BoundedExecutor:
+    """Pool for yt-dlp extraction and other CPU/network-heavy calls."""
+    global _extract
+    if _extract is None:
+        s = get_settings()
+        _extract = BoundedExecutor("extract", s.EXTRACT_EXECUTOR_WORKERS, s.EXTRACT_EXECUTOR_QUEUE)
+    return _extract
+
+
+def io_executor() -> BoundedExecutor:
+    """Pool for short blocking Redis / Celery result-backend calls."""
+    global _io
+    if _io is None:
+        s = get_settings()
+        _io = BoundedExecutor("io", s.IO_EXECUTOR_WORKERS, s.IO_EXECUTOR_QUEUE)
+    return _io
+
+
+def shutdown_executors() -> None:
+    global _extract, _io
+    for ex in (_extract, _io):
+        if ex is not None:
+            ex.shutdown()
+    _extract = _io = None
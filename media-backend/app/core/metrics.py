@@ -0,0 +1,75 @@
+# app/core/metrics.py
+"""
+Minimal metrics registry served at GET /metrics.
+
+Process-local counters / gauges live in memory; `shared_incr` counters are
+kept in a Redis hash so values produced by Celery workers are visible from
+the API. Components with richer state (pools, budgets) register a collector
+callable that is evaluated on every scrape.
+"""
+import threading
+from typing import Any, Callable, Dict
+
+from .logging import get_logger
+
+log = get_logger(__name__)
+
+SHARED_KEY = "metrics:shared"
+
+_lock = threading.Lock()
+_counters: Dict[str, float] = {}
+_gauges: Dict[str, float] = {}
+_collectors: Dict[str, Callable[[], Any]] = {}
+
+
+def incr(name: str, n: float = 1) -> None:
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + n
+
+
+def set_gauge(name: str, value: float) -> None:
+    with _lock:
+        _gauges[name] = value
+
+
+def register_collector(name: str, fn: Callable[[], Any]) -> None:
+    with _lock:
+        _collectors[name] = fn
+
+
+def shared_incr(name: str, n: float = 1) -> None:
+    """Counter aggregated across all processes (best effort)."""
+    try:
+        from ..services.redis_conn import get_redis
+        if isinstance(n, int):
+            get_redis().hincrby(SHARED_KEY, name, n)
+        else:
+            get_redis().hincrbyfloat(SHARED_KEY, name, n)
+    except Exception as e:
+        log.debug(f"shared metric {name} not recorded: {e}")
+
+
+def shared_snapshot() -> Dict[str, float]:
+    try:
+        from ..services.redis_conn import get_redis
+        raw = get_redis().hgetall(SHARED_KEY)
+    except Exception as e:
+        log.warning(f"shared metrics unavailable: {e}")
+        return {}
+    out: Dict[str, float] = {}
+    for k, v in raw.items():
+        v = float(v)
+        out[k.decode("utf-8")] = int(v) if v.is_integer() else v
+    return out
+
+
+def snapshot() -> Dict[str, Any]:
+    with _lock:
+        out: Dict[str, Any] = {"counters": dict(_counters), "gauges": dict(_gauges)}
+        collectors = dict(_collectors)
+    for name, fn in collectors.items():
+        try:
+            out[name] = fn()
+        except Exception as e:
+            out[name] = {"error": str(e)}
+    return out
@@ -1,14 +1,27 @@
-﻿from fastapi import FastAPI
+﻿from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from .core.config import get_settings
+from .core.executors import ExecutorSaturated, shutdown_executors
 from .api.routes.media import router as media_router
 from .api.routes.jobs import router as jobs_router
 from .api.routes.jobs_ws import router as jobs_ws_router  # NEW
 from .api.routes.jobs_bus import router as jobs_bus_router  # NEW
+from .api.routes.metrics import router as metrics_router
+from .services.extract_guard import ExtractionBlocked
+from .services import http_pool
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await http_pool.start()
+    yield
+    await http_pool.close()
+    shutdown_executors()
 
 def create_app() -> FastAPI:
     settings = get_settings()
-    app = FastAPI(title=settings.APP_NAME)
+    app = FastAPI(title=settings.APP_NAME, lifespan=lifespan)
 
     origins = [o.strip() for o in settings.CORS_ORIGINS.split(",") if o.strip()]
     app.add_middleware(
@@ -20,6 +33,22 @@ def create_app() -> FastAPI:
         max_age=86400,
     )
 
+    @app.exception_handler(ExecutorSaturated)
+    async def executor_saturated(request: Request, exc: ExecutorSaturated):
+        # Shed load fast instead of queueing behind slow work
+        return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": "1"})
+
+    @app.exception_handler(http_pool.HostBusy)
+    async def host_busy(request: Request, exc: http_pool.HostBusy):
+        return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": "1"})
+
+    @app.exception_handler(ExtractionBlocked)
+    async def extraction_blocked(request: Request, exc: ExtractionBlocked):
+        # Known-bad URLs keep their original 400; an open breaker is a 503
+        status = 503 if exc.kind == "circuit_open" else 400
+        return JSONResponse(status_code=status, content={"detail": str(exc), "reason": exc.kind},
+                            headers={"Retry-After": str(exc.retry_after)})
+
     @app.get("/health")
     def health():
         return {"ok": True}
@@ -28,6 +57,7 @@ def create_app() -> FastAPI:
     app.include_router(jobs_router)
     app.include_router(jobs_ws_router)  # NEW
     app.include_router(jobs_bus_router)  # NEW
+    app.include_router(metrics_router)
     return app
 
 app = create_app()
@@ -6,5 +6,6 @@ class JobStatus(str, Enum):
     merging = "merging"
     done = "done"
     error = "error"
+    retrying = "retrying"
     paused = "paused"
     canceled = "canceled"
@@ -13,6 +13,11 @@ class FormatOption(BaseModel):
     note: Optional[str] = None
     sizeBytes: Optional[int] = None  # number | null on RN side
 
+class InfoBasic(BaseModel):
+    title: str
+    thumbnail: Optional[str] = None
+    duration: Optional[int] = None
+
 class InfoResponse(BaseModel):
     title: str
     thumbnail: Optional[str] = None
@@ -45,6 +50,8 @@ class JobResponse(BaseModel):
     fileName: Optional[str] = None
     mime: Optional[str] = None
     sizeBytes: Optional[int] = None
+    retries: Optional[int] = None      # retries used so far
+    maxRetries: Optional[int] = None   # retry budget of the job
 
 
 class JobProgress(BaseModel):
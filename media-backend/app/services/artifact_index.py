@@ -0,0 +1,101 @@
+# app/services/artifact_index.py
+"""
+Index of completed downloads, keyed by (canonical media id, format spec,
+container), pointing at the finished file in STORAGE_DIR.
+
+Workers record every artifact they produce; create_task looks the key up
+first and, on a hit, hands back an already-completed task without
+touching the queue. Entries are verified against the file's size and
+mtime on every lookup: STORAGE_DIR names files by title, so an artifact
+can be replaced or deleted underneath the index.
+"""
+import os
+from typing import Any, Dict, Optional
+
+from ..core import metrics
+from ..core.config import get_settings
+from ..core.logging import get_logger
+from .redis_conn import get_redis
+
+log = get_logger(__name__)
+
+INDEX_PREFIX = "artifact:"
+MERGE_CONTAINER = "mkv"
+NATIVE_CONTAINER = "native"  # progressive formats keep the source container
+
+
+def container_for(format_spec: str) -> str:
+    return MERGE_CONTAINER if "+" in format_spec else NATIVE_CONTAINER
+
+
+def _key(media_key: str, format_spec: str) -> str:
+    return f"{INDEX_PREFIX}{media_key}|{format_spec}|{container_for(format_spec)}"
+
+
+def lookup(media_key: str, format_spec: str) -> Optional[Dict[str, Any]]:
+    """Task result of a still-present artifact, or None."""
+    key = _key(media_key, format_spec)
+    try:
+        r = get_redis()
+        raw = r.hgetall(key)
+        if not raw:
+            metrics.shared_incr("artifact_index.misses")
+            return None
+        entry = {k.decode(): v.decode("utf-8") for k, v in raw.items()}
+        try:
+            st = os.stat(entry["path"])
+            valid = st.st_size == int(entry["size_bytes"]) and int(st.st_mtime) == int(entry["mtime"])
+        except (OSError, KeyError, ValueError):
+            valid = False
+        if not valid:
+            r.delete(key)
+            metrics.shared_incr("artifact_index.stale")
+            metrics.shared_incr("artifact_index.misses")
+            return None
+        r.expire(key, get_settings().ARTIFACT_INDEX_TTL)
+    except Exception as e:
+        log.warning(f"artifact index unavailable: {e}")
+        return None
+    metrics.shared_incr("artifact_index.hits")
+    metrics.shared_incr("artifact_index.bytes_saved", st.st_size)
+    return {
+        "path": entry["path"],
+        "file_name": entry["file_name"],
+        "mime": entry["mime"],
+        "size_bytes": st.st_size,
+        "method": entry.get("method", "cache"),
+    }
+
+
+def record(media_key: str, format_spec: str, result: Dict[str, Any]) -> None:
+    """Remember a finished artifact (best effort; a miss only costs a re-download)."""
+    try:
+        st = os.stat(result["path"])
+        r = get_redis()
+        key = _key(media_key, format_spec)
+        pipe = r.pipeline()
+        pipe.hset(key, mapping={
+            "path": result["path"],
+            "file_name": result["file_name"],
+            "mime": result["mime"],
+            "size_bytes": st.st_size,
+            "mtime": int(st.st_mtime),
+            "method": result.get("method", ""),
+        })
+        pipe.expire(key, get_settings().ARTIFACT_INDEX_TTL)
+        pipe.execute()
+    except Exception as e:
+        log.warning(f"artifact for {media_key} {format_spec} not indexed: {e}")
+
+
+def index_stats() -> Dict[str, Any]:
+    hits, misses, saved = get_redis().hmget(metrics.SHARED_KEY, "artifact_index.hits", "artifact_index.misses",
+                                            "artifact_index.bytes_saved")
+    hits, misses = int(hits or 0), int(misses or 0)
+    return {
+        "hit_ratio": round(hits / (hits + misses), 4) if hits + misses else None,
+        "bytes_saved": int(saved or 0),
+    }
+
+
+metrics.register_collector("artifact_index", index_stats)
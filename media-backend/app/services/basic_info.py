@@ -0,0 +1,42 @@
+# app/services/basic_info.py
+"""
+Lightweight first-paint metadata (title / thumbnail / duration) via the
+platforms' public oEmbed endpoints. A single small JSON request, so it
+usually answers long before the full yt-dlp extraction does.
+"""
+from typing import Any, Dict, Optional
+
+from ..core.logging import get_logger
+from .http_pool import get_client
+from .url_canon import platform_for
+
+log = get_logger(__name__)
+
+OEMBED_TIMEOUT = 3.0
+
+_OEMBED_ENDPOINTS = {
+    "youtube": "https://www.youtube.com/oembed",
+    "vimeo": "https://vimeo.com/api/oembed.json",
+    "tiktok": "https://www.tiktok.com/oembed",
+}
+
+
+async def fetch_basic_info(url: str) -> Optional[Dict[str, Any]]:
+    """Return {title, thumbnail, duration} or None if the platform has no oEmbed."""
+    endpoint = _OEMBED_ENDPOINTS.get(platform_for(url) or "")
+    if not endpoint:
+        return None
+    try:
+        r = await get_client().get(endpoint, params={"url": url, "format": "json"}, timeout=OEMBED_TIMEOUT)
+        r.raise_for_status()
+        data = r.json()
+    except Exception as e:
+        log.info(f"oEmbed lookup failed for {url}: {e}")
+        return None
+    if not data.get("title"):
+        return None
+    return {
+        "title": data["title"],
+        "thumbnail": data.get("thumbnail_url"),
+        "duration": data.get("duration"),
+    }
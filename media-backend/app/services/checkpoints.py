@@ -0,0 +1,94 @@
+# app/services/checkpoints.py
+"""
+Durable progress of ranged downloads, so a redelivered task resumes.
+
+With task_acks_late a worker crash or a time-limit kill redelivers the
+task under the same id. Workers therefore derive their temp file names
+from the task id (stable_uid) and RangedDownload records, per file:
+
+    ckpt:<job key>:<leg>  ->  {path, url, total, validator,
+                               completed: JSON list of [start, end]}
+
+`completed` is rewritten after every finished segment. On redelivery the
+download reopens the same temp file and, if the validator still matches
+upstream (If-Range), fetches only the missing ranges. Entries expire after
+CHECKPOINT_TTL; workers clear them once the file is in storage.
+
+The URL is re-resolved by the task on every delivery (resolve_formats
+re-extracts when the signed URL is about to expire), so the checkpoint
+does not keep an expiry of its own. A piped merge (stream_merge) keeps no
+checkpoint: its output cannot be resumed, so only temp-file downloads are.
+"""
+import hashlib
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+from ..core.config import get_settings
+from ..core.logging import get_logger
+from .redis_conn import get_redis
+
+log = get_logger(__name__)
+
+CHECKPOINT_PREFIX = "ckpt:"
+
+
+def stable_uid(job_key: str) -> str:
+    """Temp-file tag that is the same on every delivery of a job."""
+    return hashlib.sha1(job_key.encode("utf-8")).hexdigest()[:12]
+
+
+def compact(ranges: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """Sort and merge overlapping or adjacent inclusive ranges."""
+    merged: List[Tuple[int, int]] = []
+    for a, b in sorted(ranges):
+        if merged and a <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], b))
+        else:
+            merged.append((a, b))
+    return merged
+
+
+class Checkpoint:
+    """Redis record of one file being downloaded by one job."""
+
+    def __init__(self, job_key: str, leg: str = "file"):
+        self.key = f"{CHECKPOINT_PREFIX}{job_key}:{leg}"
+
+    def load(self) -> Optional[Dict[str, Any]]:
+        try:
+            raw = get_redis().hgetall(self.key)
+        except Exception as e:
+            log.warning(f"checkpoint {self.key} unavailable: {e}")
+            return None
+        if not raw:
+            return None
+        entry = {k.decode(): v.decode("utf-8") for k, v in raw.items()}
+        try:
+            return {
+                "path": entry["path"],
+                "url": entry.get("url"),
+                "total": int(entry["total"]),
+                "validator": entry.get("validator") or None,
+                "completed": [tuple(r) for r in json.loads(entry.get("completed") or "[]")],
+            }
+        except (KeyError, ValueError):
+            return None
+
+    def save(self, **fields: Any) -> None:
+        """Best effort: a lost checkpoint only means re-downloading from byte 0."""
+        mapping = {k: ("" if v is None else v) for k, v in fields.items()}
+        if "completed" in mapping:
+            mapping["completed"] = json.dumps(compact(fields["completed"]))
+        try:
+            pipe = get_redis().pipeline()
+            pipe.hset(self.key, mapping=mapping)
+            pipe.expire(self.key, get_settings().CHECKPOINT_TTL)
+            pipe.execute()
+        except Exception as e:
+            log.warning(f"checkpoint {self.key} not saved: {e}")
+
+    def clear(self) -> None:
+        try:
+            get_redis().delete(self.key)
+        except Exception as e:
+            log.warning(f"checkpoint {self.key} not cleared: {e}")
@@ -0,0 +1,215 @@
+# app/services/extract_guard.py
+"""
+Fail-fast guards in front of extraction.
+
+* Negative cache: a failed extraction is remembered per canonical URL for a
+  TTL that depends on what went wrong (a deleted video stays deleted, a
+  timeout is worth retrying soon).
+* Circuit breaker: per platform, failures that point at the platform rather
+  than the video (429s, bot checks, network errors) are counted in one-minute
+  Redis buckets; when the error rate over the window crosses the threshold
+  the breaker opens for a cool-down and extractions fail immediately.
+  After the cool-down it is half-open: one probe extraction at a time is
+  let through; a success closes it (and clears the window's counts), a
+  platform failure opens it again for another cool-down.
+
+Both live in Redis so the API and every extract worker see the same state.
+"""
+import re
+import time
+from typing import List, NamedTuple, Pattern
+
+from ..core import metrics
+from ..core.config import get_settings
+from ..core.logging import get_logger
+from .redis_conn import get_redis
+from .url_canon import cache_key, platform_for
+
+log = get_logger(__name__)
+
+NEG_PREFIX = "neg:"
+OPEN_PREFIX = "cb:open:"
+HALF_OPEN_PREFIX = "cb:half:"
+PROBE_PREFIX = "cb:probe:"
+BUCKET_PREFIX = "cb:b:"
+BUCKET_SECONDS = 60
+
+
+class ErrorClass(NamedTuple):
+    kind: str
+    pattern: Pattern
+    ttl: int             # negative-cache seconds
+    platform_fault: bool  # counts towards the circuit breaker
+
+
+# First match wins, so specific messages go before generic ones
+ERROR_CLASSES: List[ErrorClass] = [
+    ErrorClass("unavailable", re.compile(r"private video|video unavailable|has been removed|"
+                                         r"no longer available|does not exist|account.*terminated|HTTP Error 404", re.I), 3600, False),
+    ErrorClass("geo_blocked", re.compile(r"not (?:made this video )?available in your country|geo.?restrict", re.I), 3600, False),
+    ErrorClass("unsupported", re.compile(r"unsupported url|no video formats found", re.I), 86400, False),
+    ErrorClass("rate_limited", re.compile(r"HTTP Error 429|too many requests|rate.?limit", re.I), 60, True),
+    ErrorClass("bot_check", re.compile(r"confirm you.re not a bot|sign in to confirm", re.I), 120, True),
+    ErrorClass("network", re.compile(r"timed? ?out|connection|temporary failure|network|HTTP Error 5\d\d", re.I), 15, True),
+]
+DEFAULT_CLASS = ErrorClass("error", re.compile(""), 30, True)
+
+
+class ExtractionBlocked(RuntimeError):
+    """Extraction refused without trying: negative-cached or breaker open."""
+
+    def __init__(self, message: str, kind: str, retry_after: int):
+        super().__init__(message)
+        self.kind = kind
+        self.retry_after = retry_after
+
+    def __reduce__(self):
+        return (self.__class__, (str(self), self.kind, self.retry_after))
+
+    # The JSON result backend cannot carry the fields of a raised exception, so
+    # the extract task returns a block as data and the API raises it again
+    def as_dict(self) -> dict:
+        return {"message": str(self), "kind": self.kind, "retry_after": self.retry_after}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "ExtractionBlocked":
+        return cls(data["message"], data["kind"], int(data["retry_after"]))
+
+
+def classify(error: BaseException) -> ErrorClass:
+    msg = str(error)
+    for cls in ERROR_CLASSES:
+        if cls.pattern.search(msg):
+            return cls
+    return DEFAULT_CLASS
+
+
+def check(url: str, probe: bool = True) -> None:
+    """
+    Raise ExtractionBlocked if this URL or its platform should not be tried now.
+    With a half-open breaker the caller becomes the probe if none is running;
+    `probe=False` only looks (for callers that hand the extraction to a worker).
+    """
+    key = cache_key(url)
+    platform = platform_for(url) or "other"
+    try:
+        r = get_redis()
+        pipe = r.pipeline()
+        pipe.hmget(NEG_PREFIX + key, "kind", "message")
+        pipe.ttl(NEG_PREFIX + key)
+        pipe.ttl(OPEN_PREFIX + platform)
+        pipe.exists(HALF_OPEN_PREFIX + platform)
+        pipe.ttl(PROBE_PREFIX + platform)
+        (kind, message), neg_ttl, open_ttl, half_open, probe_ttl = pipe.execute()
+        if half_open and not (open_ttl and open_ttl > 0) and probe:
+            if r.set(PROBE_PREFIX + platform, "1", nx=True, ex=int(get_settings().EXTRACT_TIMEOUT)):
+                metrics.shared_incr(f"extract_guard.breaker_probe.{platform}")
+                half_open = False  # we are the probe
+    except Exception as e:
+        log.warning(f"extract guard unavailable, allowing {key}: {e}")
+        return
+
+    if kind:
+        metrics.shared_incr("extract_guard.negative_hit")
+        raise ExtractionBlocked(message.decode("utf-8", "replace"), kind.decode(), max(1, neg_ttl))
+    if open_ttl and open_ttl > 0:
+        metrics.shared_incr(f"extract_guard.breaker_rejected.{platform}")
+        raise ExtractionBlocked(f"{platform} extraction temporarily disabled after repeated failures",
+                                "circuit_open", open_ttl)
+    if half_open and (probe or (probe_ttl and probe_ttl > 0)):
+        metrics.shared_incr(f"extract_guard.breaker_rejected.{platform}")
+        raise ExtractionBlocked(f"{platform} extraction is being re-tested after repeated failures",
+                                "circuit_open", 5)
+
+
+def _bucket_keys(platform: str, now: float) -> List[str]:
+    n = max(1, get_settings().BREAKER_WINDOW // BUCKET_SECONDS)
+    current = int(now // BUCKET_SECONDS)
+    return [f"{BUCKET_PREFIX}{platform}:{b}" for b in range(current - n + 1, current + 1)]
+
+
+def _open(r, platform: str, reason: str, nx: bool = True) -> None:
+    s = get_settings()
+    if not r.set(OPEN_PREFIX + platform, "1", nx=nx, ex=s.BREAKER_COOLDOWN):
+        return
+    pipe = r.pipeline()
+    # Half-open follows the cool-down; by the time the marker expires the window has no old counts
+    pipe.set(HALF_OPEN_PREFIX + platform, "1", ex=s.BREAKER_COOLDOWN + s.BREAKER_WINDOW)
+    pipe.delete(PROBE_PREFIX + platform)
+    pipe.execute()
+    metrics.shared_incr(f"extract_guard.breaker_opened.{platform}")
+    log.warning(f"circuit breaker opened for {platform}: {reason}")
+
+
+def _count(platform: str, field: str) -> None:
+    s = get_settings()
+    r = get_redis()
+    keys = _bucket_keys(platform, time.time())
+    pipe = r.pipeline()
+    pipe.hincrby(keys[-1], field, 1)
+    pipe.expire(keys[-1], s.BREAKER_WINDOW + BUCKET_SECONDS)
+    pipe.exists(HALF_OPEN_PREFIX + platform)
+    pipe.exists(OPEN_PREFIX + platform)
+    if field == "fail":
+        for k in keys:
+            pipe.hmget(k, "ok", "fail")
+    res = pipe.execute()
+    half_open, is_open = res[2], res[3]
+
+    if half_open and not is_open:
+        # Outcome of the probe
+        if field == "ok":
+            r.delete(HALF_OPEN_PREFIX + platform, PROBE_PREFIX + platform, *keys)
+            metrics.shared_incr(f"extract_guard.breaker_closed.{platform}")
+            log.info(f"circuit breaker closed for {platform}")
+        else:
+            _open(r, platform, "probe failed", nx=False)
+        return
+    if field != "fail":
+        return
+
+    ok = sum(int(o or 0) for o, _ in res[4:])
+    fail = sum(int(f or 0) for _, f in res[4:])
+    total = ok + fail
+    if total >= s.BREAKER_MIN_REQUESTS and fail / total >= s.BREAKER_ERROR_RATE:
+        _open(r, platform, f"{fail}/{total} failures")
+
+
+def record_success(url: str) -> None:
+    try:
+        _count(platform_for(url) or "other", "ok")
+    except Exception as e:
+        log.debug(f"extract guard: success not recorded: {e}")
+
+
+def record_failure(url: str, error: BaseException) -> ErrorClass:
+    """Negative-cache the failure and feed the platform breaker."""
+    cls = classify(error)
+    key = cache_key(url)
+    platform = platform_for(url) or "other"
+    try:
+        r = get_redis()
+        pipe = r.pipeline()
+        pipe.hset(NEG_PREFIX + key, mapping={"kind": cls.kind, "message": str(error)[:500]})
+        pipe.expire(NEG_PREFIX + key, cls.ttl)
+        if not cls.platform_fault:
+            pipe.delete(PROBE_PREFIX + platform)  # says nothing about the platform: let another probe go
+        pipe.execute()
+        metrics.shared_incr(f"extract_guard.negative_stored.{cls.kind}")
+        if cls.platform_fault:
+            _count(platform, "fail")
+    except Exception as e:
+        log.debug(f"extract guard: failure not recorded: {e}")
+    return cls
+
+
+def open_breakers() -> dict:
+    """Platforms whose breaker is currently open, with seconds remaining."""
+    r = get_redis()
+    out = {}
+    for k in r.scan_iter(match=OPEN_PREFIX + "*", count=100):
+        out[k.decode()[len(OPEN_PREFIX):]] = r.ttl(k)
+    return out
+
+
+metrics.register_collector("open_breakers", open_breakers)
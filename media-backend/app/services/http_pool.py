@@ -0,0 +1,276 @@
+# app/services/http_pool.py
+"""
+Shared upstream HTTP client for proxied media streams.
+
+One `httpx.AsyncClient` per process, opened and closed by the app lifespan,
+so requests to googlevideo & co. reuse warm keep-alive connections (and
+multiplex over HTTP/2 where the CDN offers it) instead of paying a fresh
+TCP + TLS handshake for every stream.
+
+On top of httpx's global limits:
+* a per-host semaphore caps how many requests to one origin may be
+  starting at once (UPSTREAM_HOST_STARTS): a slot covers connecting and
+  reading the response headers (or a bounded segment body) and is given
+  back before a body paced by a slow client is streamed, so it limits
+  bursts of new requests, not open responses (those are bounded by
+  UPSTREAM_MAX_CONNECTIONS). A request that cannot get a slot within
+  UPSTREAM_SLOT_WAIT fails with HostBusy (503);
+* resolved addresses are cached for UPSTREAM_DNS_TTL seconds, so a new
+  connection to a hot CDN host skips getaddrinfo. httpx has no option for
+  the network backend, so the httpcore pool is built here and handed the
+  caching backend through its constructor (httpcore is pinned to 1.x).
+
+Segmented fetches get a second, HTTP/1.1-only client: CDNs throttle per
+connection, and HTTP/2 would multiplex every segment onto a single one.
+
+Pool statistics are published through the metrics registry; they are
+gathered on the event loop that owns the clients.
+"""
+import asyncio
+import contextlib
+import socket
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import httpcore
+import httpx
+
+from ..core import metrics
+from ..core.config import get_settings
+from ..core.logging import get_logger
+
+try:
+    import h2  # noqa: F401  (httpx needs it for http2=True)
+    HAS_HTTP2 = True
+except ImportError:
+    HAS_HTTP2 = False
+
+log = get_logger(__name__)
+
+
+class HostBusy(RuntimeError):
+    """No per-host start slot became free within UPSTREAM_SLOT_WAIT."""
+
+    def __init__(self, host: str):
+        super().__init__(f"too many concurrent upstream requests to {host}")
+        self.host = host
+
+
+class CachingDNSBackend(httpcore.AsyncNetworkBackend):
+    """Network backend that resolves each host once per TTL.
+
+    Only the TCP connect target is rewritten; TLS still verifies and sends
+    SNI for the original hostname, which httpcore passes separately.
+    """
+
+    def __init__(self, inner: httpcore.AsyncNetworkBackend, ttl: float):
+        self._inner = inner
+        self._ttl = ttl
+        self._cache: Dict[Tuple[str, int], Tuple[float, List[str]]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def _resolve(self, host: str, port: int) -> List[str]:
+        entry = self._cache.get((host, port))
+        if entry and entry[0] > time.monotonic():
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        addrs = list(dict.fromkeys(info[4][0] for info in infos))
+        self._cache[(host, port)] = (time.monotonic() + self._ttl, addrs)
+        return addrs
+
+    async def connect_tcp(self, host, port, timeout=None, local_address=None, socket_options=None):
+        try:
+            addrs = await self._resolve(host, port)
+        except OSError:
+            addrs = [host]
+        last_exc: Optional[Exception] = None
+        for addr in addrs:
+            try:
+                return await self._inner.connect_tcp(addr, port, timeout=timeout, local_address=local_address,
+                                                      socket_options=socket_options)
+            except (httpcore.ConnectError, httpcore.ConnectTimeout) as e:
+                last_exc = e
+        # Every cached address failed: the record may be stale
+        self._cache.pop((host, port), None)
+        raise last_exc
+
+    async def connect_unix_socket(self, path, timeout=None, socket_options=None):
+        return await self._inner.connect_unix_socket(path, timeout=timeout, socket_options=socket_options)
+
+    async def sleep(self, seconds: float) -> None:
+        await self._inner.sleep(seconds)
+
+
+class UpstreamTransport(httpx.AsyncHTTPTransport):
+    """httpx transport over a connection pool built by create_client."""
+
+    def __init__(self, pool: httpcore.AsyncConnectionPool, dns: CachingDNSBackend):
+        # Not calling super().__init__: it would build (and leak) a default pool
+        self._pool = self.pool = pool
+        self.dns = dns
+
+
+_client: Optional[httpx.AsyncClient] = None
+_transport: Optional[UpstreamTransport] = None
+_segment_client: Optional[httpx.AsyncClient] = None
+_segment_transport: Optional[UpstreamTransport] = None
+_host_slots: Dict[str, asyncio.Semaphore] = {}
+_slots_in_use: Dict[str, int] = {}
+_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def create_client(http2: Optional[bool] = None) -> Tuple[httpx.AsyncClient, UpstreamTransport]:
+    """Build a tuned upstream client. Normally use get_client() instead."""
+    s = get_settings()
+    if http2 is None:
+        http2 = s.UPSTREAM_HTTP2
+    if http2 and not HAS_HTTP2:
+        log.warning("UPSTREAM_HTTP2 is on but the 'h2' package is missing; using HTTP/1.1")
+        http2 = False
+    dns = CachingDNSBackend(httpcore.AnyIOBackend(), s.UPSTREAM_DNS_TTL)
+    pool = httpcore.AsyncConnectionPool(
+        ssl_context=httpx.create_ssl_context(),
+        max_connections=s.UPSTREAM_MAX_CONNECTIONS,
+        max_keepalive_connections=s.UPSTREAM_MAX_KEEPALIVE,
+        keepalive_expiry=s.UPSTREAM_KEEPALIVE_EXPIRY,
+        http1=True,
+        http2=http2,
+        retries=1,  # connect-level only
+        network_backend=dns,
+        socket_options=[(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1), (socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)],
+    )
+    transport = UpstreamTransport(pool, dns)
+    client = httpx.AsyncClient(
+        transport=transport,
+        timeout=httpx.Timeout(s.UPSTREAM_READ_TIMEOUT, connect=s.UPSTREAM_CONNECT_TIMEOUT),
+        follow_redirects=True,
+    )
+    return client, transport
+
+
+async def start() -> None:
+    global _loop
+    _loop = asyncio.get_running_loop()
+    get_client()
+    get_segment_client()
+
+
+async def close() -> None:
+    global _client, _transport, _segment_client, _segment_transport, _loop
+    for client in (_client, _segment_client):
+        if client is not None:
+            await client.aclose()
+    _client = _transport = _segment_client = _segment_transport = _loop = None
+    _host_slots.clear()
+    _slots_in_use.clear()
+
+
+def get_client() -> httpx.AsyncClient:
+    """The process-wide client (created on first use if the lifespan did not)."""
+    global _client, _transport
+    if _client is None:
+        _client, _transport = create_client()
+    return _client
+
+
+def get_segment_client() -> httpx.AsyncClient:
+    """HTTP/1.1 client for segmented fetches (one TCP connection per segment stream)."""
+    global _segment_client, _segment_transport
+    if _segment_client is None:
+        _segment_client, _segment_transport = create_client(http2=False)
+    return _segment_client
+
+
+def _slot(host: str) -> asyncio.Semaphore:
+    sem = _host_slots.get(host)
+    if sem is None:
+        sem = _host_slots[host] = asyncio.Semaphore(get_settings().UPSTREAM_HOST_STARTS)
+    return sem
+
+
+@asynccontextmanager
+async def host_slot(url: str) -> AsyncIterator[None]:
+    """Hold one of the per-host start slots for `url`'s origin; raises HostBusy if none frees up in time.
+
+    Callers release it once the response headers are in, not when the body is done.
+    """
+    host = urlsplit(url).hostname or ""
+    sem = _slot(host)
+    if sem.locked():
+        metrics.incr("http_pool.host_waits")
+    try:
+        await asyncio.wait_for(sem.acquire(), get_settings().UPSTREAM_SLOT_WAIT)
+    except asyncio.TimeoutError:
+        metrics.incr("http_pool.host_busy")
+        raise HostBusy(host) from None
+    _slots_in_use[host] = _slots_in_use.get(host, 0) + 1
+    try:
+        yield
+    finally:
+        _slots_in_use[host] -= 1
+        if not _slots_in_use[host]:
+            del _slots_in_use[host]
+        sem.release()
+
+
+@asynccontextmanager
+async def stream(method: str, url: str, headers: Optional[Dict[str, str]] = None) -> AsyncIterator[httpx.Response]:
+    """`client.stream` on the shared client; the per-host slot is held until the headers are in."""
+    async with contextlib.AsyncExitStack() as stack:
+        async with host_slot(url):
+            metrics.incr("http_pool.requests")
+            response = await stack.enter_async_context(get_client().stream(method, url, headers=headers))
+        yield response
+
+
+def _client_stats(transport: Optional[UpstreamTransport]) -> Dict[str, Any]:
+    if transport is None:
+        return {"open": False}
+    pool, dns = transport.pool, transport.dns
+    origins: Dict[str, Dict[str, int]] = {}
+    for conn in pool.connections:
+        name = str(getattr(conn, "_origin", "?"))
+        o = origins.setdefault(name, {"connections": 0, "idle": 0, "http2": 0})
+        o["connections"] += 1
+        o["idle"] += int(conn.is_idle())
+        o["http2"] += int("HTTP/2" in conn.info())
+    return {
+        "open": True,
+        "connections": len(pool.connections),
+        "origins": origins,
+        "dns_cache": {"entries": len(dns._cache), "hits": dns.hits, "misses": dns.misses},
+    }
+
+
+def _stats() -> Dict[str, Any]:
+    return {
+        "http2": HAS_HTTP2 and get_settings().UPSTREAM_HTTP2,
+        "shared": _client_stats(_transport),
+        "segmented": _client_stats(_segment_transport),
+        "host_slots_in_use": dict(_slots_in_use),
+    }
+
+
+async def _stats_on_loop() -> Dict[str, Any]:
+    return _stats()
+
+
+def pool_stats() -> Dict[str, Any]:
+    """Pool statistics, read on the clients' event loop (metrics are collected from executor threads)."""
+    loop = _loop
+    if loop is None or not loop.is_running():
+        return _stats()
+    try:
+        if asyncio.get_running_loop() is loop:
+            return _stats()
+    except RuntimeError:
+        pass  # not on any loop: the usual case
+    return asyncio.run_coroutine_threadsafe(_stats_on_loop(), loop).result(timeout=2)
+
+
+metrics.register_collector("http_pool", pool_stats)
@@ -0,0 +1,113 @@
+# app/services/inflight.py
+"""
+Registry of download jobs in flight, so identical requests share one task.
+
+    inflight:<media key>|<format spec>   -> task id of the running job
+    inflight:task:<task id>              -> {refs: requesters attached, slot}
+
+The first request claims the slot (SET NX) and enqueues; everyone else
+asking for the same media and format gets the same task id back, so their
+WebSocket subscribes to the same `tasks:<id>` progress channel. The worker
+clears the slot when the job ends (after recording the artifact, so the
+next request is served from the artifact index instead). A requester that
+gives up releases its reference; the job is only revoked once nobody is
+left waiting for it.
+"""
+import uuid
+from typing import Callable, Optional, Tuple
+
+from celery.result import AsyncResult
+
+from ..core import metrics
+from ..core.config import get_settings
+from ..core.logging import get_logger
+from .redis_conn import get_redis
+
+log = get_logger(__name__)
+
+INFLIGHT_PREFIX = "inflight:"
+TASK_PREFIX = "inflight:task:"
+
+# Delete the slot only if it still names this task
+_RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+def slot_key(media_key: str, format_spec: str) -> str:
+    return f"{INFLIGHT_PREFIX}{media_key}|{format_spec}"
+
+
+def join_or_start(media_key: str, format_spec: str, start: Callable[[str, str], AsyncResult],
+                  make_result: Callable[[str], AsyncResult]) -> Tuple[AsyncResult, bool]:
+    """
+    Return (task, joined). `start(task_id, slot)` enqueues a new job under a
+    pre-allocated id; `make_result(task_id)` wraps an existing one.
+    """
+    ttl = get_settings().INFLIGHT_TTL
+    key = slot_key(media_key, format_spec)
+    r = get_redis()
+    for _ in range(3):
+        existing = r.get(key)
+        if existing is not None:
+            task = make_result(existing.decode())
+            if not task.ready():
+                r.hincrby(TASK_PREFIX + task.id, "refs", 1)
+                metrics.shared_incr("inflight.joined")
+                log.info(f"Joined in-flight task {task.id} for {media_key} {format_spec}")
+                return task, True
+            # Finished or died without clearing its slot
+            r.eval(_RELEASE_SCRIPT, 1, key, task.id)
+        task_id = str(uuid.uuid4())
+        if r.set(key, task_id, nx=True, ex=ttl):
+            pipe = r.pipeline()
+            pipe.hset(TASK_PREFIX + task_id, mapping={"refs": 1, "slot": key})
+            pipe.expire(TASK_PREFIX + task_id, ttl)
+            pipe.execute()
+            try:
+                task = start(task_id, key)
+            except Exception:
+                r.eval(_RELEASE_SCRIPT, 1, key, task_id)
+                raise
+            metrics.shared_incr("inflight.started")
+            return task, False
+    raise RuntimeError(f"could not claim or join in-flight slot {key}")
+
+
+def finish(slot: Optional[str], task_id: str) -> None:
+    """Called by the worker when its job ends, successfully or not."""
+    if not slot:
+        return
+    try:
+        r = get_redis()
+        r.eval(_RELEASE_SCRIPT, 1, slot, task_id)
+        r.delete(TASK_PREFIX + task_id)
+    except Exception as e:
+        log.warning(f"in-flight slot {slot} not cleared: {e}")
+
+
+def release(task: AsyncResult) -> Tuple[int, bool]:
+    """
+    Drop one requester's reference. Returns (remaining, cancelled): the job is
+    revoked only when the last reference goes and it has not finished.
+    """
+    r = get_redis()
+    meta_key = TASK_PREFIX + task.id
+    if not r.exists(meta_key):
+        return 0, False  # not (or no longer) tracked: finished, or reused from the index
+    remaining = r.hincrby(meta_key, "refs", -1)
+    if remaining > 0:
+        return remaining, False
+    slot = r.hget(meta_key, "slot")
+    r.delete(meta_key)
+    if task.ready():
+        return 0, False
+    task.revoke(terminate=True)
+    if slot:
+        r.eval(_RELEASE_SCRIPT, 1, slot.decode(), task.id)
+    metrics.shared_incr("inflight.cancelled")
+    log.info(f"Revoked task {task.id}: no requesters left")
+    return 0, True
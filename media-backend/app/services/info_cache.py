@@ -0,0 +1,146 @@
+# app/services/info_cache.py
+"""
+Two-tier cache for yt-dlp metadata.
+
+Tier 1 is a small in-process LRU, tier 2 is Redis so API nodes and workers
+share one extraction. Entries live until the earliest signed format URL in
+the info dict expires (minus a safety margin), so a hit always carries
+usable direct URLs.
+"""
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import urlparse, parse_qs
+
+from ..core.config import get_settings
+from ..core.logging import get_logger
+from .redis_conn import get_redis
+
+log = get_logger(__name__)
+
+REDIS_PREFIX = "info:"
+
+# Keys that dominate the size of a YouTube info dict but are never read
+_DROP_KEYS = ("automatic_captions", "subtitles", "heatmap", "_format_sort_fields")
+
+_lock = threading.Lock()
+_local: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+
+
+def url_expiry(url: Optional[str]) -> Optional[float]:
+    """Best-effort expiry (unix time) of a signed CDN URL, None if unknown."""
+    if not url:
+        return None
+    try:
+        qs = parse_qs(urlparse(url).query)
+    except Exception:
+        return None
+    # googlevideo & most CDNs: expire=<unix>, CloudFront: Expires=<unix>
+    for name in ("expire", "Expires", "expires"):
+        if name in qs:
+            try:
+                return float(qs[name][0])
+            except ValueError:
+                pass
+    # Facebook / Instagram CDN: oe=<hex unix>
+    if "oe" in qs:
+        try:
+            return float(int(qs["oe"][0], 16))
+        except ValueError:
+            pass
+    return None
+
+
+def info_expiry(info: Dict[str, Any]) -> Optional[float]:
+    """Earliest expiry across all format URLs of an info dict."""
+    expiries = [url_expiry(f.get("url")) for f in info.get("formats") or []]
+    expiries.append(url_expiry(info.get("url")))
+    known = [e for e in expiries if e]
+    return min(known) if known else None
+
+
+def ttl_for(info: Dict[str, Any]) -> int:
+    """Seconds an info dict may be cached for."""
+    s = get_settings()
+    expiry = info_expiry(info)
+    if expiry is None:
+        return s.INFO_CACHE_DEFAULT_TTL
+    ttl = int(expiry - time.time()) - s.INFO_CACHE_EXPIRY_MARGIN
+    return max(0, min(ttl, s.INFO_CACHE_MAX_TTL))
+
+
+def _local_get(key: str) -> Optional[Dict[str, Any]]:
+    with _lock:
+        hit = _local.get(key)
+        if not hit:
+            return None
+        expires_at, info = hit
+        if expires_at <= time.time():
+            del _local[key]
+            return None
+        _local.move_to_end(key)
+        return info
+
+
+def _local_put(key: str, info: Dict[str, Any], ttl: int) -> None:
+    max_entries = get_settings().INFO_CACHE_MAX_ENTRIES
+    with _lock:
+        _local[key] = (time.time() + ttl, info)
+        _local.move_to_end(key)
+        while len(_local) > max_entries:
+            _local.popitem(last=False)
+
+
+def get(key: str) -> Optional[Dict[str, Any]]:
+    """
+    Look up a cached info dict. The returned dict is shared with the
+    in-process tier, so callers must treat it as read-only.
+    """
+    info = _local_get(key)
+    if info is not None:
+        return info
+
+    try:
+        r = get_redis()
+        pipe = r.pipeline()
+        pipe.get(REDIS_PREFIX + key)
+        pipe.ttl(REDIS_PREFIX + key)
+        raw, ttl = pipe.execute()
+    except Exception as e:
+        log.warning(f"info cache: redis get failed for {key}: {e}")
+        return None
+    if not raw:
+        return None
+
+    try:
+        info = json.loads(raw)
+    except ValueError:
+        return None
+    if ttl and ttl > 0:
+        _local_put(key, info, ttl)
+    return info
+
+
+def put(key: str, info: Dict[str, Any]) -> None:
+    """Store an info dict (must already be JSON-safe) in both tiers."""
+    for k in _DROP_KEYS:
+        info.pop(k, None)
+    ttl = ttl_for(info)
+    if ttl <= 0:
+        return
+    _local_put(key, info, ttl)
+    try:
+        get_redis().setex(REDIS_PREFIX + key, ttl, json.dumps(info))
+    except Exception as e:
+        log.warning(f"info cache: redis put failed for {key}: {e}")
+
+
+def invalidate(key: str) -> None:
+    with _lock:
+        _local.pop(key, None)
+    try:
+        get_redis().delete(REDIS_PREFIX + key)
+    except Exception as e:
+        log.warning(f"info cache: redis delete failed for {key}: {e}")
@@ -1,46 +1,161 @@
 # app/services/job_queue.py
+import uuid
 from typing import Dict, Any, Optional
+from celery.exceptions import TimeoutError as CeleryTimeoutError
 from celery.result import AsyncResult
 from ..core.celery_app import celery_app
+from ..core.config import get_settings
+from ..core.executors import extract_executor, io_executor
 from ..core.logging import get_logger
+from . import artifact_index, extract_guard, inflight, info_cache, progress, retry_policy
+from .url_canon import cache_key
+from .ytdlp_service import extract_info
 
 log = get_logger(__name__)
 
+def _result(task_id: str) -> AsyncResult:
+    return AsyncResult(task_id, app=celery_app)
+
+def _enqueue_deduplicated(task_fn, payload: Dict[str, Any], format_spec: str) -> AsyncResult:
+    """Start `task_fn` for this payload, or join the identical job already running."""
+    def start(task_id: str, slot: str) -> AsyncResult:
+        payload["inflight_slot"] = slot
+        return task_fn.apply_async(args=[payload], task_id=task_id)
+    
+    task, joined = inflight.join_or_start(payload["media_key"], format_spec, start, _result)
+    if not joined:
+        log.info("Enqueued %s %s for %s", task_fn.name.rsplit(".", 1)[-1], task.id, payload["media_key"])
+    return task
+
 def enqueue_download_merge(payload: Dict[str, Any]) -> AsyncResult:
     """
     payload expects: { url, format, title?, ext? }
+    media_key is added as the handle of the cached /info extraction.
+    Identical requests in flight share one task.
     """
     from ..workers.celery_tasks import download_and_merge
     
-    task = download_and_merge.delay(payload)
-    log.info("Enqueued Celery task %s for %s", task.id, payload.get("url"))
-    return task
+    payload.setdefault("media_key", cache_key(payload["url"]))
+    return _enqueue_deduplicated(download_and_merge, payload, payload["format"])
 
 def enqueue_stream_download(payload: Dict[str, Any]) -> AsyncResult:
     """
     For progressive formats that can be streamed directly
     payload expects: { url, format_id, title?, ext? }
+    media_key is added as the handle of the cached /info extraction.
+    Identical requests in flight share one task.
     """
     from ..workers.celery_tasks import stream_download
     
-    task = stream_download.delay(payload)
-    log.info("Enqueued stream task %s for %s", task.id, payload.get("url"))
-    return task
+    payload.setdefault("media_key", cache_key(payload["url"]))
+    return _enqueue_deduplicated(stream_download, payload, str(payload["format_id"]))
+
+def release_task(task_id: str) -> Dict[str, Any]:
+    """A requester gives up on a task; the job is cancelled once nobody is left."""
+    remaining, cancelled = inflight.release(_result(task_id))
+    return {"id": task_id, "remaining": remaining, "cancelled": cancelled}
+
+def reuse_completed(url: str, format_spec: str) -> Optional[Dict[str, Any]]:
+    """
+    If this (media, format) was already downloaded and the file is still there,
+    register an already-successful task for it and return its status; else None.
+    """
+    artifact = artifact_index.lookup(cache_key(url), format_spec)
+    if artifact is None:
+        return None
+    task_id = uuid.uuid4().hex
+    result = {**artifact, "cached": True, "progress": 1.0}
+    celery_app.backend.store_result(task_id, result, "SUCCESS")
+    log.info("Reused completed artifact %s for %s as task %s", artifact["path"], format_spec, task_id)
+    return {"id": task_id, "status": "success", "ready": True, **result}
+
+def enqueue_extract(url: str) -> AsyncResult:
+    """Queue a metadata extraction on the dedicated extract queue."""
+    from ..workers.tasks.extract import extract_metadata
+    
+    # A request nobody waits for anymore is not worth extracting
+    return extract_metadata.apply_async(args=[url], expires=get_settings().EXTRACT_TIMEOUT)
+
+def _extract_and_wait(url: str, timeout: float) -> Dict[str, Any]:
+    """
+    Enqueue an extraction and wait for its result. The Redis result backend
+    is per thread and its result consumer is not thread-safe, so the task is
+    sent (which subscribes to its result) and awaited on the same thread.
+    """
+    task = enqueue_extract(url)
+    try:
+        result = task.get(timeout=timeout, propagate=True)
+    except CeleryTimeoutError:
+        task.revoke()
+        raise TimeoutError(f"extraction of {url} timed out")
+    task.forget()
+    return result
+
+async def fetch_info(url: str) -> Dict[str, Any]:
+    """
+    Metadata for a URL as seen from the API: cache hit fast path, otherwise
+    await an extract-queue task (or extract in-process when EXTRACT_MODE=local).
+    Raises TimeoutError if no extract worker answers within EXTRACT_TIMEOUT.
+    """
+    settings = get_settings()
+    io = io_executor()
+    key = cache_key(url)
+    cached = await io.run(info_cache.get, key)
+    if cached is not None:
+        return cached
+    # Only look: the extraction itself takes a half-open breaker's probe
+    await io.run(extract_guard.check, url, False)
+    
+    if settings.EXTRACT_MODE != "celery":
+        return await extract_executor().run(extract_info, url)
+    
+    # One blocking wait on the result (backend pubsub, no polling), parked on the
+    # extract pool so an /info burst never queues in front of status polls
+    result = await extract_executor().run(_extract_and_wait, url, settings.EXTRACT_TIMEOUT)
+    if result.get("blocked"):
+        raise extract_guard.ExtractionBlocked.from_dict(result["blocked"])
+    info = result.get("info") or await io.run(info_cache.get, result["key"])
+    if info is None:
+        # Evicted between the worker's write and our read
+        info = await extract_executor().run(extract_info, url)
+    return info
+
+_FINAL_STATES = {"SUCCESS": "completed", "FAILURE": "failed"}
 
 def get_task_status(task_id: str) -> Dict[str, Any]:
     """Get task status and metadata"""
+    # Running (or just finished) tasks: their compact progress record, one round trip
+    record = progress.read(task_id)
+    if record:
+        status = record.get("status", "pending")
+        result = {**record, "id": task_id, "status": status, "ready": status in ("completed", "failed")}
+        if status == "retrying":
+            # Waiting in the broker for its next attempt: show the retry budget
+            result.update(retry_policy.pending(task_id) or {})
+        return result
+    
+    # Queued, or the record expired: the result backend has the final result
     task = AsyncResult(task_id, app=celery_app)
     
     result = {
         "id": task_id,
-        "status": task.status.lower(),
+        # Same terminal states as the progress record, which callers such as /file check for
+        "status": _FINAL_STATES.get(task.status, task.status.lower()),
         "ready": task.ready(),
     }
     
     if hasattr(task, 'info') and task.info:
         if isinstance(task.info, dict):
             result.update(task.info)
-        elif task.status == "FAILURE":
+        elif task.status in ("FAILURE", "RETRY"):
             result["error"] = str(task.info)
+    if task.status == "SUCCESS":
+        result.update(progress=1.0, finished=True)
+    elif task.status == "FAILURE":
+        result["failed"] = True
+    
+    if task.status == "RETRY":
+        # Waiting in the broker for its next attempt: show the retry budget
+        result.update(retry_policy.pending(task_id) or {})
     
     return result
@@ -0,0 +1,97 @@
+# app/services/merge_legs.py
+"""
+Download the video and audio legs of a merge at the same time.
+
+Each leg runs in its own thread and reports (bytes done, total); the
+calling thread waits on them and publishes one combined, byte-weighted
+progress value through the task's ProgressEmitter (which writes the
+shared Redis progress hash), so legs never publish partial values of
+their own over each other. The first leg to fail cancels
+the others: their next progress report raises LegCancelled, which aborts
+yt-dlp and the ranged engine alike.
+
+A merge job gets MERGE_TASK_CONNECTIONS upstream connections in total,
+split between the legs by expected size (at least one each), so running
+both legs at once does not double a worker's footprint on the CDN.
+"""
+import threading
+from concurrent.futures import FIRST_EXCEPTION, Future, ThreadPoolExecutor, wait
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+from ..core.config import get_settings
+from ..core.logging import get_logger
+
+log = get_logger(__name__)
+
+PROGRESS_INTERVAL = 0.5  # seconds between combined progress callbacks
+
+ReportFn = Callable[[int, Optional[int]], None]
+
+
+class LegCancelled(Exception):
+    """Raised inside a leg once another leg of the same merge has failed."""
+
+
+class Leg(NamedTuple):
+    name: str
+    run: Callable[[ReportFn, int], str]  # (report, connections) -> downloaded file path
+    expected_bytes: Optional[int] = None
+
+
+class _LegState:
+    def __init__(self, leg: Leg):
+        self.done = 0
+        self.total = leg.expected_bytes or 0
+
+
+def split_connections(legs: List[Leg], budget: int) -> List[int]:
+    """Share `budget` connections between legs in proportion to their expected size."""
+    sizes = [max(leg.expected_bytes or 0, 1) for leg in legs]
+    spare = max(budget - len(legs), 0)
+    shares = [1 + int(spare * size / sum(sizes)) for size in sizes]
+    shares[sizes.index(max(sizes))] += max(budget, len(legs)) - sum(shares)  # rounding leftovers
+    return shares
+
+
+def download_legs(legs: List[Leg], on_progress: Optional[Callable[[float, int, int], None]] = None,
+                  connections: Optional[int] = None) -> Dict[str, str]:
+    """
+    Run all legs concurrently; returns {leg name: path}. `on_progress(fraction,
+    done_bytes, total_bytes)` is called from this thread. Raises the first
+    leg failure after the remaining legs have stopped.
+    """
+    shares = split_connections(legs, connections or get_settings().MERGE_TASK_CONNECTIONS)
+    states = [_LegState(leg) for leg in legs]
+    cancel = threading.Event()
+
+    def run(leg: Leg, state: _LegState, share: int) -> str:
+        def report(done: int, total: Optional[int]) -> None:
+            if cancel.is_set():
+                raise LegCancelled(f"{leg.name} stopped: another leg failed")
+            state.done = done
+            if total:
+                state.total = total
+        return leg.run(report, share)
+
+    def publish() -> None:
+        if on_progress is None:
+            return
+        done = sum(st.done for st in states)
+        total = sum(max(st.total, st.done) for st in states)
+        on_progress(done / total if total else 0.0, done, total)
+
+    with ThreadPoolExecutor(max_workers=len(legs), thread_name_prefix="merge-leg") as pool:
+        futures: List[Future] = [pool.submit(run, leg, st, n) for leg, st, n in zip(legs, states, shares)]
+        pending = set(futures)
+        while pending:
+            finished, pending = wait(pending, timeout=PROGRESS_INTERVAL, return_when=FIRST_EXCEPTION)
+            if any(f.exception() is not None for f in finished):
+                cancel.set()
+            publish()
+
+    errors = [f.exception() for f in futures if f.exception() is not None]
+    if errors:
+        first = next((e for e in errors if not isinstance(e, LegCancelled)), errors[0])
+        log.warning(f"Merge leg failed, {len(errors) - 1} other leg(s) cancelled: {first}")
+        raise first
+    return {leg.name: f.result() for leg, f in zip(legs, futures)}
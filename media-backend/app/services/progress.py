@@ -0,0 +1,170 @@
+# app/services/progress.py
+"""
+Coalescing progress emitter shared by every task progress path.
+
+yt-dlp hooks and download engines report many times per second; each
+report used to cost a result-backend write, a Redis publish and two log
+lines. A ProgressEmitter per task decides what is worth sending:
+
+* a status change or a terminal state is always sent at once (terminal
+  states also flush whatever was coalesced before them);
+* otherwise an update goes out only after PROGRESS_MIN_INTERVAL seconds
+  and only if progress moved by PROGRESS_MIN_DELTA, or PROGRESS_HEARTBEAT
+  seconds passed (so speed / ETA still refresh on a stalled bar);
+* skipped updates are merged, so the next write carries their latest
+  fields.
+
+Each write is a single pipelined round trip: the sink queues its commands
+(publish, meta save, ...) on the pipeline and the emitter adds its own
+counters (`progress.emitted`, `progress.coalesced` in the shared metrics
+hash) to it. Emitters are thread-safe, so download threads may report
+through the task's emitter directly.
+
+Celery task progress lives in its own record, `progress:<task id>`: a
+Redis hash (one JSON value per field) rewritten with HSET in that same
+pipeline and expiring PROGRESS_TTL seconds after the last update. The
+terminal record (completed / failed) is kept as long as the final result,
+CELERY_RESULT_EXPIRES, so a finished task reads the same until both are
+gone. Status polls read it with a single HGETALL; the Celery result
+backend only holds the final result.
+"""
+import json
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+from ..core import metrics
+from ..core.config import get_settings
+from ..core.logging import get_logger
+from .redis_conn import get_redis
+
+log = get_logger(__name__)
+
+PROGRESS_PREFIX = "progress:"
+
+# sink(pipeline, status, progress, fields, terminal) queues the actual writes
+Sink = Callable[[Any, str, Optional[float], Dict[str, Any], bool], None]
+
+
+class ProgressEmitter:
+    def __init__(self, name: str, sink: Sink, terminal_states=("completed", "failed", "finished")):
+        s = get_settings()
+        self.name = name
+        self.sink = sink
+        self.terminal_states = set(terminal_states)
+        self.min_interval = s.PROGRESS_MIN_INTERVAL
+        self.min_delta = s.PROGRESS_MIN_DELTA
+        self.heartbeat = s.PROGRESS_HEARTBEAT
+        self._lock = threading.Lock()
+        self._status: Optional[str] = None
+        self._progress: Optional[float] = None
+        self._sent_at = 0.0
+        self._pending: Dict[str, Any] = {}
+        self._coalesced = 0
+        self.closed = False
+
+    def emit(self, status: str, progress: Optional[float] = None, **fields: Any) -> bool:
+        """Report an update; returns True if it was written now, False if coalesced."""
+        if progress is not None:
+            progress = max(0.0, min(1.0, progress))
+        with self._lock:
+            if self.closed:
+                return False
+            self._pending.update(fields)
+            now = time.monotonic()
+            terminal = status in self.terminal_states
+            if not terminal and status == self._status and not self._due(progress, now):
+                self._coalesced += 1
+                if progress is not None:
+                    self._pending["_progress"] = progress
+                return False
+            if progress is None:
+                progress = self._pending.pop("_progress", None)
+            else:
+                self._pending.pop("_progress", None)
+            changed = status != self._status
+            payload, coalesced = self._pending, self._coalesced
+            self._pending, self._coalesced = {}, 0
+            self._status, self._sent_at = status, now
+            if progress is not None:
+                self._progress = progress
+            self.closed = terminal
+            self._write(status, progress, payload, terminal, coalesced)
+        if changed:
+            log.info(f"[{self.name}] {status} {progress if progress is not None else ''}".rstrip())
+        return True
+
+    def _due(self, progress: Optional[float], now: float) -> bool:
+        elapsed = now - self._sent_at
+        if elapsed < self.min_interval:
+            return False
+        if elapsed >= self.heartbeat or progress is None or self._progress is None:
+            return True
+        return abs(progress - self._progress) >= self.min_delta
+
+    def _write(self, status: str, progress: Optional[float], fields: Dict[str, Any], terminal: bool,
+               coalesced: int) -> None:
+        try:
+            pipe = get_redis().pipeline(transaction=False)
+            self.sink(pipe, status, progress, fields, terminal)
+            pipe.hincrby(metrics.SHARED_KEY, "progress.emitted", 1)
+            if coalesced:
+                pipe.hincrby(metrics.SHARED_KEY, "progress.coalesced", coalesced)
+            pipe.execute()
+        except Exception as e:
+            log.warning(f"[{self.name}] progress not written: {e}")
+
+
+def store(pipe, task_id: str, record: Dict[str, Any], reset: bool = False, final: bool = False) -> None:
+    """
+    Queue an update of the task's progress record on `pipe`; `reset` drops
+    fields of an earlier delivery, `final` keeps the record as long as the result.
+    """
+    key = PROGRESS_PREFIX + task_id
+    if reset:
+        pipe.delete(key)
+    pipe.hset(key, mapping={k: json.dumps(v, default=str) for k, v in record.items()})
+    s = get_settings()
+    pipe.expire(key, s.CELERY_RESULT_EXPIRES if final else s.PROGRESS_TTL)
+
+
+def read(task_id: str) -> Optional[Dict[str, Any]]:
+    """The task's progress record, or None if there is none (not started, expired, Redis down)."""
+    try:
+        raw = get_redis().hgetall(PROGRESS_PREFIX + task_id)
+    except Exception as e:
+        log.warning(f"progress of {task_id} unavailable: {e}")
+        return None
+    if not raw:
+        return None
+    try:
+        return {k.decode(): json.loads(v) for k, v in raw.items()}
+    except ValueError:
+        return None
+
+
+class _RateCollector:
+    """Emit rate across all workers, measured between two /metrics scrapes."""
+
+    def __init__(self):
+        self._last: Optional[tuple] = None
+
+    def __call__(self) -> Dict[str, Any]:
+        shared = metrics.shared_snapshot()
+        emitted = int(shared.get("progress.emitted", 0))
+        coalesced = int(shared.get("progress.coalesced", 0))
+        now = time.monotonic()
+        rate = None
+        if self._last is not None and now > self._last[0]:
+            rate = round((emitted - self._last[1]) / (now - self._last[0]), 2)
+        self._last = (now, emitted)
+        total = emitted + coalesced
+        return {
+            "emitted": emitted,
+            "coalesced": coalesced,
+            "coalesce_ratio": round(coalesced / total, 4) if total else None,
+            "emits_per_second": rate,
+        }
+
+
+metrics.register_collector("progress", _RateCollector())
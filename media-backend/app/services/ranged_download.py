@@ -0,0 +1,312 @@
+# app/services/ranged_download.py
+"""
+Parallel ranged downloads straight into a file.
+
+Unlike SegmentedFetch, which must hand bytes to a client in order, a file
+can be filled in any order: the output is preallocated to its full size
+and N connections each write their range at its offset with os.pwrite,
+so there is no reorder buffer and no second copy.
+
+* a probe GET for the first SEGMENT_INITIAL_SIZE bytes learns the size,
+  the validator (ETag / Last-Modified) and whether ranges work; its body is
+  written like any other segment;
+* the rest is split into segments of total / (connections * 4) bytes,
+  clamped to SEGMENT_MIN/MAX_SIZE, pulled from a shared queue by up to
+  `connections` workers (connections_for(url) by default);
+* a failed segment is retried on its own, from the last byte written,
+  up to SEGMENT_RETRIES times; later requests carry If-Range, so an entity
+  that changed mid-download fails the job instead of mixing two files;
+* a server that ignores Range (200 to the probe) is read sequentially from
+  the probe response;
+* with a Checkpoint, finished segments are recorded in Redis; a later run
+  for the same job reopens the file and fetches only the missing ranges,
+  starting over if the validator no longer matches upstream.
+
+Progress is reported as (bytes written, total) across all connections.
+"""
+import asyncio
+import contextlib
+import os
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+import httpx
+
+from ..core import metrics
+from ..core.config import get_settings
+from ..core.logging import get_logger
+from . import http_pool
+from .checkpoints import Checkpoint, compact
+from .segmented_fetch import SegmentError, connections_for, parse_content_range
+
+log = get_logger(__name__)
+
+ProgressCallback = Callable[[int, Optional[int]], None]
+
+
+class _Restart(Exception):
+    """A checkpoint cannot be resumed; download from scratch."""
+
+
+class EntityChanged(SegmentError):
+    """The upstream file changed between requests (If-Range was not satisfied)."""
+
+
+def is_plain_http(snap: Optional[Dict[str, Any]]) -> bool:
+    """True for a format snapshot that is one plain HTTP(S) file (not HLS/DASH fragments)."""
+    return bool(snap and snap.get("url")) and (snap.get("protocol") or "https") in ("http", "https")
+
+
+def _write_at(fd: int, data: bytes, offset: int) -> None:
+    if hasattr(os, "pwrite"):
+        os.pwrite(fd, data, offset)
+    else:  # single writer only (see RangedDownload.__init__)
+        os.lseek(fd, offset, os.SEEK_SET)
+        os.write(fd, data)
+
+
+def _preallocate(fd: int, size: int) -> None:
+    if size <= 0:
+        return
+    if hasattr(os, "posix_fallocate"):
+        try:
+            os.posix_fallocate(fd, 0, size)
+            return
+        except OSError:
+            pass  # e.g. not supported by the filesystem
+    os.ftruncate(fd, size)
+
+
+class RangedDownload:
+    """Download `url` into `path` over several ranged connections; call `run()` once."""
+
+    def __init__(self, url: str, headers: Optional[Dict[str, str]], path: str, *,
+                 client: httpx.AsyncClient, connections: Optional[int] = None,
+                 on_progress: Optional[ProgressCallback] = None,
+                 checkpoint: Optional[Checkpoint] = None):
+        self.url = url
+        self.headers = dict(headers or {})
+        self.headers["Accept-Encoding"] = "identity"
+        self.path = path
+        self.client = client
+        self.connections = connections or connections_for(url)
+        if not hasattr(os, "pwrite"):
+            self.connections = 1
+        self.on_progress = on_progress
+        self.checkpoint = checkpoint
+
+        self.total: Optional[int] = None
+        self.ranged = False
+        self.resumed = False
+        self.validator: Optional[str] = None
+        self.written = 0
+        self.completed: List[Tuple[int, int]] = []  # inclusive byte ranges on disk
+        self._fd: Optional[int] = None
+        self._queue: Deque[Tuple[int, int]] = deque()
+
+    async def run(self) -> int:
+        """Fill the file; returns its size. Raises SegmentError on failure."""
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT | getattr(os, "O_BINARY", 0), 0o644)
+        try:
+            if self._load_checkpoint():
+                try:
+                    return await self._download()
+                except _Restart as e:
+                    log.info(f"Not resuming {self.path}: {e}")
+                    metrics.incr("ranged_download.resume_discarded")
+                    self.total, self.validator, self.written, self.completed = None, None, 0, []
+                    self.resumed = False
+                    self._queue.clear()
+                    os.ftruncate(self._fd, 0)
+            return await self._download()
+        finally:
+            os.close(self._fd)
+            self._fd = None
+
+    def _load_checkpoint(self) -> bool:
+        """Pick up completed ranges from a previous delivery of the same job."""
+        state = self.checkpoint.load() if self.checkpoint else None
+        if not state or state["path"] != self.path or not state["validator"] or not state["completed"]:
+            return False
+        try:
+            if os.path.getsize(self.path) != state["total"]:
+                return False
+        except OSError:
+            return False
+        self.total = state["total"]
+        self.validator = state["validator"]
+        self.completed = compact(state["completed"])
+        self.written = sum(b - a + 1 for a, b in self.completed)
+        self.resumed = True
+        return True
+
+    def _missing(self) -> List[Tuple[int, int]]:
+        gaps, pos = [], 0
+        for a, b in compact(self.completed):
+            if a > pos:
+                gaps.append((pos, a - 1))
+            pos = b + 1
+        if pos < self.total:
+            gaps.append((pos, self.total - 1))
+        return gaps
+
+    async def _download(self) -> int:
+        initial = get_settings().SEGMENT_INITIAL_SIZE
+        headers = dict(self.headers)
+        if self.resumed:
+            gaps = self._missing()
+            if not gaps:
+                return self.total  # finished before the previous delivery died
+            start = gaps[0][0]
+            headers.update({"Range": f"bytes={start}-{min(gaps[0][1], start + initial - 1)}",
+                            "If-Range": self.validator})
+            log.info(f"Resuming {self.path}: {self.written} of {self.total} bytes already on disk")
+            metrics.incr("ranged_download.resumed")
+        else:
+            start = 0
+            headers["Range"] = f"bytes=0-{initial - 1}"
+        async with self.client.stream("GET", self.url, headers=headers) as r:
+            if r.status_code == 200:
+                if self.resumed:
+                    raise _Restart("upstream file changed")
+                return await self._single(r)
+            if r.status_code != 206:
+                raise SegmentError(f"upstream returned {r.status_code}")
+            parsed = parse_content_range(r.headers.get("content-range"))
+            if parsed is None or parsed[2] is None:
+                raise SegmentError("upstream sent a 206 without a usable Content-Range")
+            _, end, total = parsed
+            self.ranged = True
+            if self.resumed:
+                if total != self.total:
+                    raise _Restart(f"upstream size changed ({self.total} -> {total})")
+            else:
+                self.total = total
+                self.validator = self._validator_from(r.headers)
+                _preallocate(self._fd, self.total)
+                self._save_checkpoint()
+            self._plan(self._missing(), skip_to=end + 1)
+            workers = [asyncio.create_task(self._worker()) for _ in range(max(0, self.connections - 1))]
+            try:
+                await self._fetch_segment(start, end, first=r)
+                self._mark_done(start, end)
+                # The probe's connection joins the pool once its range is in
+                workers.append(asyncio.create_task(self._worker()))
+                await asyncio.gather(*workers)
+            finally:
+                for t in workers:
+                    t.cancel()
+                for t in workers:
+                    with contextlib.suppress(BaseException):
+                        await t
+        if self.written != self.total:
+            raise SegmentError(f"wrote {self.written} of {self.total} bytes")
+        return self.total
+
+    async def _single(self, r: httpx.Response) -> int:
+        """Server ignored Range: one sequential pass over the probe response."""
+        metrics.incr("ranged_download.single_connection")
+        length = r.headers.get("content-length")
+        self.total = int(length) if length and length.isdigit() else None
+        os.ftruncate(self._fd, 0)
+        _preallocate(self._fd, self.total or 0)
+        pos = 0
+        async for chunk in r.aiter_raw(chunk_size=get_settings().STREAM_CHUNK_SIZE):
+            _write_at(self._fd, chunk, pos)
+            pos += len(chunk)
+            self._advance(len(chunk))
+        if self.total is not None and pos != self.total:
+            raise SegmentError(f"got {pos} of {self.total} bytes")
+        os.ftruncate(self._fd, pos)
+        self.total = pos
+        return pos
+
+    @staticmethod
+    def _validator_from(headers: httpx.Headers) -> Optional[str]:
+        etag = headers.get("etag")
+        if etag and not etag.startswith("W/"):  # If-Range needs a strong validator
+            return etag
+        return headers.get("last-modified")
+
+    def _plan(self, gaps: List[Tuple[int, int]], skip_to: int = 0) -> None:
+        """Queue segments covering `gaps`, ignoring everything before `skip_to` (the probe's range)."""
+        gaps = [(max(a, skip_to), b) for a, b in gaps if b >= skip_to]
+        s = get_settings()
+        remaining = sum(b - a + 1 for a, b in gaps)
+        size = max(s.SEGMENT_MIN_SIZE, min(s.SEGMENT_MAX_SIZE, remaining // (self.connections * 4)))
+        for a, b in gaps:
+            for off in range(a, b + 1, size):
+                self._queue.append((off, min(off + size - 1, b)))
+
+    async def _worker(self) -> None:
+        while self._queue:
+            a, b = self._queue.popleft()
+            await self._fetch_segment(a, b)
+            self._mark_done(a, b)
+
+    async def _fetch_segment(self, a: int, b: int, first: Optional[httpx.Response] = None) -> None:
+        """Write bytes a..b at their offset; `first` is an already-open response for them."""
+        retries = get_settings().SEGMENT_RETRIES
+        chunk_size = get_settings().STREAM_CHUNK_SIZE
+        pos = a
+        for attempt in range(retries + 1):
+            if first is not None:
+                ctx, first = contextlib.nullcontext(first), None
+            else:
+                headers = dict(self.headers, Range=f"bytes={pos}-{b}")
+                if self.validator:
+                    headers["If-Range"] = self.validator
+                ctx = self.client.stream("GET", self.url, headers=headers)
+            try:
+                async with ctx as r:
+                    if r.status_code == 200 and self.validator:
+                        raise EntityChanged(f"{self.url} changed during the download")
+                    if r.status_code != 206:
+                        raise SegmentError(f"segment {pos}-{b}: upstream returned {r.status_code}")
+                    async for chunk in r.aiter_raw(chunk_size=chunk_size):
+                        chunk = chunk[:b - pos + 1]
+                        _write_at(self._fd, chunk, pos)
+                        pos += len(chunk)
+                        self._advance(len(chunk))
+                        if pos > b:
+                            break
+                if pos <= b:
+                    raise SegmentError(f"segment {a}-{b}: connection closed at {pos}")
+                return
+            except EntityChanged:
+                raise
+            except (httpx.HTTPError, SegmentError) as e:
+                metrics.incr("ranged_download.segment_retries")
+                if attempt == retries:
+                    raise SegmentError(str(e)) from e
+                log.debug(f"segment {a}-{b} failed at {pos} ({e}), retrying")
+                await asyncio.sleep(0.25 * 2 ** attempt)
+
+    def _advance(self, n: int) -> None:
+        self.written += n
+        if self.on_progress:
+            self.on_progress(self.written, self.total)
+
+    def _mark_done(self, a: int, b: int) -> None:
+        self.completed.append((a, b))
+        self._save_checkpoint()
+
+    def _save_checkpoint(self) -> None:
+        if self.checkpoint is not None:
+            self.checkpoint.save(path=self.path, url=self.url, total=self.total, validator=self.validator,
+                                 completed=self.completed)
+
+
+def download_to_file(url: str, headers: Optional[Dict[str, str]], path: str,
+                     on_progress: Optional[ProgressCallback] = None,
+                     connections: Optional[int] = None,
+                     checkpoint: Optional[Checkpoint] = None) -> int:
+    """Synchronous entry point for workers: own event loop and client; returns the file size."""
+
+    async def run() -> int:
+        client, _ = http_pool.create_client(http2=False)
+        async with client:
+            return await RangedDownload(url, headers, path, client=client, connections=connections,
+                                        on_progress=on_progress, checkpoint=checkpoint).run()
+
+    return asyncio.run(run())
@@ -0,0 +1,123 @@
+# app/services/retry_policy.py
+"""
+When and how soon a failed download job is tried again.
+
+Workers never sleep between attempts: a transient failure reschedules the
+task (Celery `self.retry(countdown=...)`, RQ `Retry` intervals) and frees
+the worker slot at once. Errors are classified by a first-match table;
+only the retryable kinds are rescheduled, each with its own base delay,
+doubled per attempt, capped at RETRY_BACKOFF_MAX and jittered so a burst
+of failures does not come back as a burst.
+
+The pending retry (attempt, budget, when) is kept in `retry:<task id>` so
+status polls can show it while the task waits in the broker.
+"""
+import errno
+import random
+import re
+import time
+from typing import Any, Dict, List, NamedTuple, Optional, Pattern
+
+import httpx
+
+from ..core import metrics
+from ..core.config import get_settings
+from ..core.logging import get_logger
+from .extract_guard import ExtractionBlocked
+from .redis_conn import get_redis
+
+log = get_logger(__name__)
+
+RETRY_PREFIX = "retry:"
+
+
+class RetryRule(NamedTuple):
+    kind: str
+    pattern: Pattern
+    retry: bool
+    base_delay: float  # seconds before the first retry
+
+
+# First match wins, so specific messages go before generic ones
+RETRY_RULES: List[RetryRule] = [
+    RetryRule("disk_full", re.compile(r"no space left on device", re.I), False, 0),
+    RetryRule("unavailable", re.compile(r"private video|video unavailable|has been removed|no longer available|"
+                                        r"does not exist|HTTP Error 404|returned 404", re.I), False, 0),
+    RetryRule("geo_blocked", re.compile(r"not (?:made this video )?available in your country|geo.?restrict", re.I),
+              False, 0),
+    RetryRule("unsupported", re.compile(r"unsupported url|no video formats found|requested format is not available|"
+                                        r"format .* not found", re.I), False, 0),
+    # Signed media URLs expire; the next attempt resolves fresh ones
+    RetryRule("expired_url", re.compile(r"HTTP Error 403|returned 403|forbidden|changed during the download", re.I),
+              True, 1),
+    RetryRule("rate_limited", re.compile(r"HTTP Error 429|returned 429|too many requests|rate.?limit", re.I), True, 30),
+    RetryRule("bot_check", re.compile(r"confirm you.re not a bot|sign in to confirm", re.I), True, 60),
+    RetryRule("upstream", re.compile(r"HTTP Error 5\d\d|returned 5\d\d", re.I), True, 5),
+    RetryRule("network", re.compile(r"timed? ?out|connection (?:reset|refused|aborted|closed)|reset by peer|"
+                                    r"broken pipe|temporary failure in name resolution|network is unreachable|"
+                                    r"peer closed connection|remote end closed|incomplete ?read|more expected|"
+                                    r"(?:wrote|got|fed) \d+ of \d+ bytes", re.I), True, 2),
+]
+NETWORK_RULE = RETRY_RULES[-1]
+DEFAULT_RULE = RetryRule("error", re.compile(""), False, 0)
+_BLOCKED_PERMANENT = {"unavailable", "geo_blocked", "unsupported"}
+
+
+def classify(error: BaseException) -> RetryRule:
+    if isinstance(error, ExtractionBlocked):
+        # Negative cache or open breaker: come back when it lifts
+        return RetryRule(error.kind, DEFAULT_RULE.pattern, error.kind not in _BLOCKED_PERMANENT, error.retry_after)
+    if isinstance(error, OSError) and error.errno == errno.ENOSPC:
+        return RETRY_RULES[0]
+    if isinstance(error, (httpx.TimeoutException, httpx.NetworkError, ConnectionError, TimeoutError)):
+        return NETWORK_RULE
+    msg = str(error)
+    for rule in RETRY_RULES:
+        if rule.pattern.search(msg):
+            return rule
+    return DEFAULT_RULE
+
+
+def backoff(attempt: int, rule: RetryRule) -> float:
+    """Seconds to wait before retry number `attempt + 1`: exponential, capped, equal jitter."""
+    delay = min(get_settings().RETRY_BACKOFF_MAX, max(rule.base_delay, 1) * 2 ** attempt)
+    return random.uniform(delay / 2, delay)
+
+
+def record(task_id: str, attempt: int, max_retries: int, countdown: float, rule: RetryRule,
+           error: BaseException) -> None:
+    """Remember a scheduled retry for status polls (best effort)."""
+    metrics.shared_incr(f"retries.{rule.kind}")
+    try:
+        r = get_redis()
+        key = RETRY_PREFIX + task_id
+        pipe = r.pipeline()
+        pipe.hset(key, mapping={
+            "retries": attempt,
+            "max_retries": max_retries,
+            "retry_at": round(time.time() + countdown, 1),
+            "error_class": rule.kind,
+            "message": f"{rule.kind}: retrying in {countdown:.0f}s ({attempt}/{max_retries}) - {error}"[:500],
+        })
+        pipe.expire(key, int(countdown) + get_settings().INFLIGHT_TTL)
+        pipe.execute()
+    except Exception as e:
+        log.warning(f"retry of {task_id} not recorded: {e}")
+
+
+def pending(task_id: str) -> Optional[Dict[str, Any]]:
+    try:
+        raw = get_redis().hgetall(RETRY_PREFIX + task_id)
+    except Exception:
+        return None
+    if not raw:
+        return None
+    entry = {k.decode(): v.decode("utf-8") for k, v in raw.items()}
+    return {
+        "retries": int(entry["retries"]),
+        "max_retries": int(entry["max_retries"]),
+        "retry_at": float(entry["retry_at"]),
+        "error_class": entry["error_class"],
+        "message": entry["message"],
+    }
+
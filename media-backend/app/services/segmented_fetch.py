@@ -0,0 +1,402 @@
+# app/services/segmented_fetch.py
+"""
+Segmented, multi-connection upstream fetching.
+
+CDNs such as googlevideo throttle each connection, so one long GET is
+capped well below what we can sustain. SegmentedFetch splits the target
+into byte ranges and keeps up to N of them in flight on separate HTTP/1.1
+connections, yielding the bytes strictly in order:
+
+* the first range is streamed as it arrives (time-to-first-byte is that of
+  a plain GET) and tells us the total size and whether ranges work at all;
+  a server that answers 200 is simply streamed through;
+* later ranges are fetched whole by worker tasks into a reorder buffer that
+  never runs more than `window` segments ahead of the reader;
+* segment size adapts to the measured per-connection throughput so each
+  request lasts ~SEGMENT_TARGET_SECONDS, between SEGMENT_MIN/MAX_SIZE;
+* if upstream does not know the total size (`bytes 0-N/*`) an open-ended
+  request continues sequentially with `bytes=<next>-` requests until
+  upstream has nothing more to send;
+* every follow-up request carries the first response's validator (strong
+  ETag, else Last-Modified) as If-Range, so an entity that changes
+  mid-stream answers 200 or with a different total and the stream aborts
+  instead of splicing two versions together;
+* memory is bounded: prefetching pauses above STREAM_BUFFER_HIGH bytes
+  buffered for the connection (resuming below STREAM_BUFFER_LOW) and every
+  held byte is charged to the process-wide budget in stream_budget, so a
+  slow client stalls its own upstream reads instead of growing RSS;
+* connections per stream are capped per host (SEGMENT_HOST_CONNECTIONS) and
+  every request still takes a shared per-host start slot from http_pool
+  (held until its headers arrive, or its bounded segment body is read).
+
+With connections=1 it degrades to a single plain GET (used for small
+files, which are not worth the extra requests).
+
+Workers that write to a file use ranged_download instead, which needs no
+ordering and writes each range at its offset.
+"""
+import asyncio
+import contextlib
+import re
+import time
+from typing import AsyncIterator, Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+import httpx
+
+from ..core import metrics
+from ..core.config import get_settings
+from ..core.logging import get_logger
+from . import http_pool, stream_budget
+
+log = get_logger(__name__)
+
+_CONTENT_RANGE = re.compile(r"bytes\s+(\d+)-(\d+)/(\d+|\*)")
+
+ByteRange = Tuple[Optional[int], Optional[int]]
+
+
+class SegmentError(RuntimeError):
+    """A segment could not be fetched after all retries."""
+
+
+class EntityChanged(SegmentError):
+    """Upstream now serves a different entity than the first response; not retried."""
+
+
+def parse_content_range(value: Optional[str]) -> Optional[Tuple[int, int, Optional[int]]]:
+    m = _CONTENT_RANGE.match(value or "")
+    if not m:
+        return None
+    total = None if m.group(3) == "*" else int(m.group(3))
+    return int(m.group(1)), int(m.group(2)), total
+
+
+def connections_for(url: str) -> int:
+    """Per-stream connection cap for this host (SEGMENT_HOST_CONNECTIONS overrides the default)."""
+    s = get_settings()
+    host = urlsplit(url).hostname or ""
+    for item in s.SEGMENT_HOST_CONNECTIONS.split(","):
+        suffix, _, n = item.strip().partition("=")
+        if suffix and n and (host == suffix or host.endswith("." + suffix)):
+            return max(1, int(n))
+    return max(1, s.SEGMENT_CONNECTIONS)
+
+
+class SegmentedFetch:
+    """One upstream entity (or byte range of it) fetched over several connections.
+
+    Call `open()` first; afterwards `status`, `total`, `start`, `end` and
+    `response_headers` describe what will be streamed by `iter_bytes()`.
+    Always finish with `aclose()`.
+    """
+
+    def __init__(self, url: str, headers: Optional[Dict[str, str]] = None, byte_range: Optional[ByteRange] = None,
+                 *, if_range: Optional[str] = None, client: Optional[httpx.AsyncClient] = None,
+                 connections: Optional[int] = None, use_host_slots: bool = True,
+                 budget: Optional[stream_budget.ByteBudget] = None):
+        s = get_settings()
+        self.url = url
+        self.headers = dict(headers or {})
+        self.headers["Accept-Encoding"] = "identity"
+        self.requested = byte_range
+        self.if_range = if_range
+        self.client = client or http_pool.get_segment_client()
+        self.connections = connections or connections_for(url)
+        self.window = max(self.connections, s.SEGMENT_WINDOW)
+        self.use_host_slots = use_host_slots
+        self.host = urlsplit(url).hostname or ""
+        self.budget = budget or stream_budget.get_budget()
+        self.high_watermark = s.STREAM_BUFFER_HIGH
+        self.low_watermark = s.STREAM_BUFFER_LOW
+        self.buffered = 0  # bytes held for this connection (charged to the budget)
+        self.paused = False
+
+        self.status: Optional[int] = None
+        self.total: Optional[int] = None
+        self.start = 0
+        self.end: Optional[int] = None  # inclusive
+        self.ranged = False  # upstream honored ranges
+        self.sequential = False  # unknown total: read on until upstream runs dry
+        self.response_headers: Dict[str, str] = {}
+
+        self._first: Optional[httpx.Response] = None
+        self._first_ctx = None
+        self._tasks = []
+        self._cond = asyncio.Condition()
+        self._buffer: Dict[int, bytes] = {}
+        self._next_idx = 1
+        self._next_off = 0
+        self._yield_idx = 1
+        self._error: Optional[BaseException] = None
+        self._closed = False
+        self._bps: Optional[float] = None  # per-connection throughput estimate
+        self._validator: Optional[str] = None  # If-Range for follow-up requests
+        stream_budget.track(self)
+
+    # ---- setup ----
+
+    def _slot(self):
+        return http_pool.host_slot(self.url) if self.use_host_slots else contextlib.nullcontext()
+
+    def _first_range(self) -> Optional[str]:
+        initial = get_settings().SEGMENT_INITIAL_SIZE
+        if self.connections == 1:
+            # Single-connection mode: one plain (possibly ranged) GET
+            if self.requested is None:
+                return None
+            start, end = self.requested
+            return f"bytes={'' if start is None else start}-{'' if end is None else end}"
+        if self.requested is None:
+            return f"bytes=0-{initial - 1}"
+        start, end = self.requested
+        if start is None:
+            return f"bytes=-{end}"  # suffix: the tail is fetched in one go
+        last = start + initial - 1 if end is None else min(end, start + initial - 1)
+        return f"bytes={start}-{last}"
+
+    def _segment_headers(self, rng: str) -> Dict[str, str]:
+        headers = dict(self.headers, Range=rng)
+        if self._validator:
+            headers["If-Range"] = self._validator
+        return headers
+
+    def _check_entity(self, r: httpx.Response, cr: Optional[Tuple[int, int, Optional[int]]]) -> None:
+        if r.status_code == 200:
+            raise EntityChanged(f"{self.url}: upstream ignored the range (entity changed?)")
+        if cr is not None and self.total is not None and cr[2] != self.total:
+            raise EntityChanged(f"{self.url}: total changed from {self.total} to {cr[2]}")
+
+    async def open(self) -> None:
+        headers = dict(self.headers)
+        first_range = self._first_range()
+        if first_range:
+            headers["Range"] = first_range
+        if self.if_range:
+            headers["If-Range"] = self.if_range
+        self._first_ctx = contextlib.AsyncExitStack()
+        self._t_first = time.monotonic()
+        # The host slot covers the request, not the body the client reads at its own pace
+        async with self._slot():
+            self._first = await self._first_ctx.enter_async_context(
+                self.client.stream("GET", self.url, headers=headers))
+        metrics.incr("segmented_fetch.streams")
+        self.status = self._first.status_code
+        self.response_headers = dict(self._first.headers)
+
+        cr = parse_content_range(self._first.headers.get("content-range"))
+        if self.status == 206 and cr:
+            first_start, first_end, self.total = cr
+            self.ranged = True
+            etag = self._first.headers.get("etag")
+            if etag and not etag.startswith("W/"):
+                self._validator = etag  # weak tags are not allowed in If-Range
+            else:
+                self._validator = self._first.headers.get("last-modified")
+            self.start = first_start
+            if self.requested and self.requested[0] is None:
+                self.end = first_end  # suffix range: done after the first response
+            elif self.requested and self.requested[1] is not None:
+                self.end = self.requested[1] if self.total is None else min(self.requested[1], self.total - 1)
+            elif self.total is None:
+                self.sequential = True  # end unknown until upstream stops
+            else:
+                self.end = self.total - 1
+            self._next_off = first_end + 1
+            if not self.sequential and self._next_off <= self.end:
+                for _ in range(self.connections - 1):
+                    self._tasks.append(asyncio.create_task(self._worker()))
+        elif self.status == 200:
+            length = self._first.headers.get("content-length")
+            self.total = int(length) if length else None
+            self.end = self.total - 1 if self.total else None
+        elif self.status == 416 and cr is None:
+            m = re.search(r"/(\d+)", self._first.headers.get("content-range", ""))
+            self.total = int(m.group(1)) if m else None
+
+    @property
+    def content_length(self) -> Optional[int]:
+        if self.end is None:
+            return None
+        return self.end - self.start + 1
+
+    # ---- workers ----
+
+    def _segment_size(self) -> int:
+        s = get_settings()
+        if self._bps is None:
+            return s.SEGMENT_INITIAL_SIZE
+        return int(min(s.SEGMENT_MAX_SIZE, max(s.SEGMENT_MIN_SIZE, self._bps * s.SEGMENT_TARGET_SECONDS)))
+
+    def _observe(self, nbytes: int, elapsed: float) -> None:
+        if elapsed <= 0:
+            return
+        bps = nbytes / elapsed
+        self._bps = bps if self._bps is None else 0.7 * self._bps + 0.3 * bps
+
+    async def _fetch_range(self, a: int, b: int) -> bytes:
+        retries = get_settings().SEGMENT_RETRIES
+        for attempt in range(retries + 1):
+            try:
+                t0 = time.monotonic()
+                async with self._slot():
+                    async with self.client.stream("GET", self.url, headers=self._segment_headers(f"bytes={a}-{b}")) as r:
+                        cr = parse_content_range(r.headers.get("content-range"))
+                        self._check_entity(r, cr)
+                        if r.status_code != 206 or cr is None or cr[:2] != (a, b):
+                            raise SegmentError(f"segment {a}-{b}: upstream returned {r.status_code}")
+                        data = await r.aread()
+                if len(data) != b - a + 1:
+                    raise SegmentError(f"segment {a}-{b}: got {len(data)} bytes")
+                self._observe(len(data), time.monotonic() - t0)
+                return data
+            except EntityChanged:
+                metrics.incr("segmented_fetch.entity_changed")
+                raise
+            except (httpx.HTTPError, SegmentError, http_pool.HostBusy) as e:
+                metrics.incr("segmented_fetch.segment_retries")
+                if attempt == retries:
+                    raise SegmentError(str(e)) from e
+                await asyncio.sleep(0.25 * 2 ** attempt)
+
+    async def _hold(self, n: int, force: bool = False) -> None:
+        await self.budget.acquire(n, force=force)
+        self.buffered += n
+        if self.buffered >= self.high_watermark:
+            self.paused = True
+
+    async def _release(self, n: int) -> None:
+        self.budget.release(n)
+        self.buffered -= n
+        if self.paused and self.buffered <= self.low_watermark:
+            self.paused = False
+            async with self._cond:
+                self._cond.notify_all()
+
+    async def _worker(self) -> None:
+        try:
+            while True:
+                async with self._cond:
+                    await self._cond.wait_for(
+                        lambda: self._closed or (not self.paused and self._next_idx - self._yield_idx < self.window))
+                    if self._closed or self._next_off > self.end:
+                        return
+                    size = min(self._segment_size(), self.end - self._next_off + 1)
+                # Budget is taken before a segment is assigned, so the reader never
+                # waits on a segment that is itself waiting for memory
+                await self._hold(size, force=self.buffered == 0)
+                async with self._cond:
+                    if self._closed or self._next_off > self.end:
+                        await self._release(size)
+                        return
+                    idx, a = self._next_idx, self._next_off
+                    b = min(a + size - 1, self.end)
+                    if b - a + 1 < size:
+                        await self._release(size - (b - a + 1))
+                    self._next_idx += 1
+                    self._next_off = b + 1
+                data = await self._fetch_range(a, b)
+                async with self._cond:
+                    self._buffer[idx] = data
+                    self._cond.notify_all()
+        except asyncio.CancelledError:
+            raise
+        except BaseException as e:
+            async with self._cond:
+                self._error = self._error or e
+                self._cond.notify_all()
+
+    # ---- reading ----
+
+    async def iter_bytes(self, chunk_size: Optional[int] = None) -> AsyncIterator[bytes]:
+        chunk_size = chunk_size or get_settings().STREAM_CHUNK_SIZE
+        t0, n = self._t_first, 0
+        async for chunk in self._first.aiter_raw(chunk_size=chunk_size):
+            n += len(chunk)
+            await self._hold(len(chunk), force=True)
+            yield chunk
+            await self._release(len(chunk))
+        await self._first_ctx.aclose()
+        self._first_ctx = None
+        self._observe(n, time.monotonic() - t0)
+        if not self.ranged:
+            return
+        if self.sequential:
+            async for chunk in self._iter_tail(chunk_size):
+                yield chunk
+            return
+        if self._next_off <= self.end and not self._closed:
+            # The first response's connection is free again: put it to work
+            self._tasks.append(asyncio.create_task(self._worker()))
+
+        while True:
+            async with self._cond:
+                await self._cond.wait_for(lambda: self._yield_idx in self._buffer or self._error is not None
+                                          or (self._yield_idx >= self._next_idx and self._next_off > self.end))
+                if self._yield_idx in self._buffer:
+                    data = self._buffer.pop(self._yield_idx)
+                    self._yield_idx += 1
+                    self._cond.notify_all()
+                elif self._error is not None:
+                    raise self._error
+                else:
+                    return
+            metrics.incr("segmented_fetch.bytes", len(data))
+            view = memoryview(data)
+            for i in range(0, len(data), chunk_size):
+                piece = view[i:i + chunk_size]
+                yield bytes(piece)
+                # Sent (or at least handed to a draining transport): no longer ours to hold
+                await self._release(len(piece))
+
+    async def _iter_tail(self, chunk_size: int) -> AsyncIterator[bytes]:
+        """Size unknown: stream `bytes=<next>-` responses until a 416 or an empty one."""
+        retries = get_settings().SEGMENT_RETRIES
+        failures = 0
+        while not self._closed:
+            start = self._next_off
+            try:
+                async with contextlib.AsyncExitStack() as stack:
+                    async with self._slot():
+                        r = await stack.enter_async_context(
+                            self.client.stream("GET", self.url, headers=self._segment_headers(f"bytes={start}-")))
+                    if r.status_code == 416:
+                        return
+                    cr = parse_content_range(r.headers.get("content-range"))
+                    self._check_entity(r, cr)
+                    if r.status_code != 206 or cr is None or cr[0] != start:
+                        raise SegmentError(f"tail from {start}: upstream returned {r.status_code}")
+                    async for chunk in r.aiter_raw(chunk_size=chunk_size):
+                        await self._hold(len(chunk), force=True)
+                        self._next_off += len(chunk)
+                        yield chunk
+                        await self._release(len(chunk))
+                    if self._next_off == start or (cr[2] is not None and self._next_off >= cr[2]):
+                        return
+                failures = 0
+            except EntityChanged:
+                metrics.incr("segmented_fetch.entity_changed")
+                raise
+            except (httpx.HTTPError, SegmentError, http_pool.HostBusy) as e:
+                metrics.incr("segmented_fetch.segment_retries")
+                failures = failures + 1 if self._next_off == start else 1
+                if failures > retries:
+                    raise SegmentError(str(e)) from e
+                await asyncio.sleep(0.25 * 2 ** (failures - 1))
+
+    async def aclose(self) -> None:
+        self._closed = True
+        for t in self._tasks:
+            t.cancel()
+        for t in self._tasks:
+            with contextlib.suppress(BaseException):
+                await t
+        self._tasks = []
+        self._buffer.clear()
+        if self.buffered:
+            self.budget.release(self.buffered)
+            self.buffered = 0
+        if self._first_ctx is not None:
+            await self._first_ctx.aclose()
+            self._first_ctx = None
+
@@ -0,0 +1,160 @@
+# app/services/singleflight.py
+"""
+Single-flight call coalescing.
+
+`do` makes concurrent callers of the same key inside one process share a
+single invocation. `do_shared` extends that across processes: the leader
+holds a Redis lock while it works and publishes its result somewhere the
+followers can `load` it from (for extraction that is the metadata cache).
+It also leaves the result (or its failure) under a short-lived marker of
+its own, so followers are released even when the result is not cacheable
+or the cache write failed.
+"""
+import json
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, Optional
+
+from ..core.config import get_settings
+from ..core.logging import get_logger
+from .redis_conn import get_redis
+
+log = get_logger(__name__)
+
+LOCK_PREFIX = "sf:lock:"
+ERROR_PREFIX = "sf:err:"
+RESULT_PREFIX = "sf:res:"
+ERROR_TTL = 5  # seconds followers keep seeing a leader's failure
+RESULT_TTL = 30  # seconds followers can pick up a leader's result
+
+# Delete the lock only if we still own it
+_RELEASE_LUA = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+class SingleFlightError(RuntimeError):
+    """The leader of a coalesced call failed or never produced a result."""
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+_lock = threading.Lock()
+_calls: Dict[str, _Call] = {}
+
+
+def do(key: str, fn: Callable[[], Any], timeout: Optional[float] = None) -> Any:
+    """Run fn once per key at a time; concurrent callers get the same result."""
+    with _lock:
+        call = _calls.get(key)
+        leader = call is None
+        if leader:
+            call = _Call()
+            _calls[key] = call
+
+    if not leader:
+        wait = timeout if timeout is not None else get_settings().SINGLEFLIGHT_WAIT_TIMEOUT
+        if not call.done.wait(wait):
+            raise SingleFlightError(f"timed out waiting for in-flight call {key}")
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    try:
+        call.result = fn()
+        return call.result
+    except BaseException as e:
+        call.error = e
+        raise
+    finally:
+        with _lock:
+            _calls.pop(key, None)
+        call.done.set()
+
+
+def do_shared(key: str, fn: Callable[[], Any], load: Callable[[], Optional[Any]]) -> Any:
+    """
+    Cross-process single flight. The caller that wins the Redis lock runs
+    fn (whose result must be JSON-safe); everyone else polls for the
+    leader's result marker or `load` until one has a value, the leader
+    fails, or the lock vanishes (leader crashed) in which case they compete
+    for the lock again. Redis errors degrade to running fn locally.
+    """
+    s = get_settings()
+    lock_key = LOCK_PREFIX + key
+    err_key = ERROR_PREFIX + key
+    res_key = RESULT_PREFIX + key
+    deadline = time.monotonic() + s.SINGLEFLIGHT_WAIT_TIMEOUT
+
+    try:
+        r = get_redis()
+        release = r.register_script(_RELEASE_LUA)
+    except Exception as e:
+        log.warning(f"singleflight: redis unavailable, running {key} uncoordinated: {e}")
+        return fn()
+
+    while True:
+        token = uuid.uuid4().hex
+        try:
+            acquired = r.set(lock_key, token, nx=True, ex=s.SINGLEFLIGHT_LOCK_TTL)
+        except Exception as e:
+            log.warning(f"singleflight: lock failed for {key}, running uncoordinated: {e}")
+            return fn()
+
+        if acquired:
+            try:
+                r.delete(err_key, res_key)
+                result = fn()
+                try:
+                    # Written before the lock goes, so followers always find one or the other
+                    r.setex(res_key, RESULT_TTL, json.dumps(result))
+                except Exception as e:
+                    log.warning(f"singleflight: result of {key} not shared: {e}")
+                return result
+            except Exception as e:
+                try:
+                    r.setex(err_key, ERROR_TTL, str(e) or e.__class__.__name__)
+                except Exception:
+                    pass
+                raise
+            finally:
+                try:
+                    release(keys=[lock_key], args=[token])
+                except Exception:
+                    pass
+
+        # Follower: wait for the leader's result
+        while True:
+            if time.monotonic() > deadline:
+                raise SingleFlightError(f"timed out waiting for in-flight call {key}")
+            time.sleep(s.SINGLEFLIGHT_POLL_INTERVAL)
+
+            try:
+                pipe = r.pipeline()
+                pipe.get(res_key)
+                pipe.get(err_key)
+                pipe.exists(lock_key)
+                raw, err, locked = pipe.execute()
+            except Exception as e:
+                log.warning(f"singleflight: redis failed while waiting for {key}, running locally: {e}")
+                return fn()
+            if raw is not None:
+                return json.loads(raw)
+            if err:
+                raise SingleFlightError(err.decode("utf-8", "replace"))
+            result = load()
+            if result is not None:
+                return result
+            if not locked:
+                break  # leader gone without a visible result, try to lead
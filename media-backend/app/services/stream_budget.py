@@ -0,0 +1,106 @@
+# app/services/stream_budget.py
+"""
+Global accounting of bytes buffered by proxied streams.
+
+Every byte a stream holds in memory (prefetched segments, the chunk being
+sent) is charged to one process-wide ByteBudget of STREAM_MEMORY_BUDGET
+bytes. When the budget is spent, prefetching waits until slower clients
+drain, so API memory stays flat however many slow readers are attached.
+A stream that holds nothing is always let through, so every connection
+keeps making progress.
+
+Per-connection high/low watermarks live in SegmentedFetch; this module
+only tracks active streams for the metrics collector (which runs on an
+executor thread, so the registry is only touched under a lock).
+"""
+import asyncio
+import threading
+import weakref
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from ..core import metrics
+from ..core.config import get_settings
+
+
+class ByteBudget:
+    """FIFO byte semaphore for a single event loop."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.used = 0
+        self.waits = 0
+        self._waiters: Deque[Tuple[int, asyncio.Future]] = deque()
+
+    async def acquire(self, n: int, force: bool = False) -> None:
+        if force or (not self._waiters and self.used + n <= self.limit):
+            self.used += n
+            return
+        self.waits += 1
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters.append((n, fut))
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                self.release(n)  # granted just as we were cancelled
+            else:
+                try:
+                    self._waiters.remove((n, fut))
+                except ValueError:
+                    pass
+            raise
+
+    def release(self, n: int) -> None:
+        self.used -= n
+        while self._waiters:
+            need, fut = self._waiters[0]
+            if fut.done():
+                self._waiters.popleft()
+                continue
+            if self.used + need > self.limit:
+                break
+            self._waiters.popleft()
+            self.used += need
+            fut.set_result(None)
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+
+_budget: Optional[ByteBudget] = None
+_streams: "weakref.WeakSet[Any]" = weakref.WeakSet()
+_streams_lock = threading.Lock()  # the metrics collector snapshots _streams from another thread
+
+
+def get_budget() -> ByteBudget:
+    global _budget
+    if _budget is None:
+        _budget = ByteBudget(get_settings().STREAM_MEMORY_BUDGET)
+    return _budget
+
+
+def track(stream: Any) -> None:
+    """Register an active stream (anything with `url`, `buffered` and `paused`)."""
+    with _streams_lock:
+        _streams.add(stream)
+
+
+def buffer_stats() -> Dict[str, Any]:
+    budget = get_budget()
+    with _streams_lock:
+        active: List[Any] = list(_streams)
+    top = sorted(active, key=lambda st: st.buffered, reverse=True)[:20]
+    return {
+        "budget_bytes": budget.limit,
+        "buffered_bytes": budget.used,
+        "budget_waits": budget.waits,
+        "waiting": budget.waiting,
+        "streams": len(active),
+        "paused_streams": sum(1 for st in active if st.paused),
+        "top_connections": [{"host": st.host, "buffered": st.buffered, "paused": st.paused} for st in top],
+    }
+
+
+metrics.register_collector("stream_buffers", buffer_stats)
@@ -0,0 +1,352 @@
+# app/services/stream_cache.py
+"""
+Opt-in tee cache for proxied streams (STREAM_CACHE_ENABLED).
+
+While a full (non-range) proxied stream is sent to the client, the same
+bytes are written to STORAGE_DIR/stream-cache/<sha1(media key, format)>.
+Layout per entry:
+
+    <sha>.<token>.<ext>.part   being filled by the writer holding <token>
+    <sha>.<token>.json         its total size, validators
+    <sha>.<ext>, <sha>.json    complete; renamed from the writer's files
+                               once every byte is on disk
+
+The writer holds `scache:fill:<sha>` in Redis, set to its token and
+refreshed by a timer while the writer lives, so only one request per
+entry talks to upstream. Concurrent requests attach to the growing .part
+file of the current lease holder and read behind it. A writer that lost
+its lease (stalled past STREAM_CACHE_FILL_TTL) keeps serving its client
+but never publishes: its files are its own, and commit() checks both the
+lease and the size on disk before the rename. Complete entries are served
+from disk with FileResponse (zero-copy where the server supports it) or
+handed to Nginx via X-Accel-Redirect.
+
+The directory is trimmed to STREAM_CACHE_MAX_BYTES, least recently used
+first, after every completed fill.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import time
+import uuid
+from typing import Any, AsyncIterator, Dict, NamedTuple, Optional, Tuple
+
+import aiofiles
+
+from ..core import metrics
+from ..core.config import get_settings
+from ..core.logging import get_logger
+from .redis_conn import get_redis
+
+log = get_logger(__name__)
+
+CACHE_SUBDIR = "stream-cache"
+FILL_PREFIX = "scache:fill:"
+FOLLOW_POLL = 0.1
+
+# Extend / drop the fill lease only while it is still ours
+_REFRESH_LUA = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('expire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+_RELEASE_LUA = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+class CacheEntry(NamedTuple):
+    sha: str
+    path: str
+    meta: str
+
+
+def cache_root() -> str:
+    path = os.path.join(get_settings().STORAGE_DIR, CACHE_SUBDIR)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def entry_for(media_key: str, format_id: str, ext: str) -> CacheEntry:
+    sha = hashlib.sha1(f"{media_key}|{format_id}".encode("utf-8")).hexdigest()
+    base = os.path.join(cache_root(), sha)
+    return CacheEntry(sha, f"{base}.{ext}", f"{base}.json")
+
+
+def _writer_files(entry: CacheEntry, token: str) -> Tuple[str, str]:
+    """The .part and metadata files of one writer of the entry."""
+    base, ext = os.path.splitext(entry.path)
+    return f"{base}.{token}{ext}.part", f"{base}.{token}.json"
+
+
+def _read_meta(path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(path) as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return None
+
+
+def lookup(entry: CacheEntry) -> Optional[Dict[str, Any]]:
+    """Metadata of a complete entry (and mark it recently used), else None."""
+    meta = _read_meta(entry.meta)
+    try:
+        if meta is None or os.path.getsize(entry.path) != meta["total"]:
+            return None
+        os.utime(entry.path)
+    except OSError:
+        return None
+    return meta
+
+
+def filling(entry: CacheEntry) -> Optional[Dict[str, Any]]:
+    """
+    Metadata of an entry another request is filling right now, else None.
+    Its "part" is the file to follow.
+    """
+    try:
+        token = get_redis().get(FILL_PREFIX + entry.sha)
+    except Exception:
+        return None
+    if not token:
+        return None
+    part, meta_path = _writer_files(entry, token.decode())
+    if not os.path.exists(part):
+        return None
+    meta = _read_meta(meta_path)
+    if meta is not None:
+        meta["part"] = part
+    return meta
+
+
+def accel_path(entry: CacheEntry) -> Optional[str]:
+    prefix = get_settings().STREAM_CACHE_ACCEL_PREFIX
+    if not prefix:
+        return None
+    return prefix.rstrip("/") + "/" + os.path.basename(entry.path)
+
+
+class TeeWriter:
+    """Appends a proxied stream to its own .part file of an entry; commit() publishes it."""
+
+    def __init__(self, entry: CacheEntry, total: int, token: str):
+        self.entry = entry
+        self.total = total
+        self.token = token
+        self.part, self.meta = _writer_files(entry, token)
+        self.written = 0
+        self._fh = None
+        self._lease: Optional[asyncio.Task] = None
+        self.lost = False
+        self.closed = False
+
+    @classmethod
+    async def open(cls, entry: CacheEntry, total: int, token: str) -> "TeeWriter":
+        """Start writing an entry claimed with claim_fill (which returned `token`)."""
+        writer = cls(entry, total, token)
+        try:
+            # Unbuffered, so followers see every chunk as soon as it is written
+            writer._fh = await aiofiles.open(writer.part, "xb", buffering=0)
+        except BaseException:
+            await asyncio.get_running_loop().run_in_executor(None, writer._discard)
+            raise
+        writer._lease = asyncio.create_task(writer._keep_lease())
+        return writer
+
+    async def write(self, chunk: bytes) -> None:
+        if self.closed:
+            return
+        if self.lost:
+            await self.abort()
+            return
+        await self._fh.write(chunk)
+        self.written += len(chunk)
+
+    async def _keep_lease(self) -> None:
+        """Refresh the fill lease on a timer, so a slow client does not cost it."""
+        loop = asyncio.get_running_loop()
+        while not self.closed:
+            await asyncio.sleep(get_settings().STREAM_CACHE_FILL_TTL / 3)
+            if not await loop.run_in_executor(None, self._refresh):
+                self.lost = True
+                log.warning(f"stream cache: fill lease of {self.entry.sha} lost, not caching")
+                return
+
+    def _refresh(self) -> bool:
+        """False only when the lease is known to belong to someone else now."""
+        try:
+            r = get_redis()
+            if not r.register_script(_REFRESH_LUA)(keys=[FILL_PREFIX + self.entry.sha],
+                                                   args=[self.token, get_settings().STREAM_CACHE_FILL_TTL]):
+                return False
+        except Exception as e:
+            log.debug(f"stream cache: fill lease not refreshed: {e}")
+        for path in (self.part, self.meta):
+            try:
+                os.utime(path)  # prune() takes writer files untouched for long as leftovers
+            except OSError:
+                pass
+        return True
+
+    def _release(self) -> Optional[bool]:
+        """Drop the lease if it is still ours; None when Redis cannot tell."""
+        try:
+            r = get_redis()
+            return bool(r.register_script(_RELEASE_LUA)(keys=[FILL_PREFIX + self.entry.sha], args=[self.token]))
+        except Exception as e:
+            log.debug(f"stream cache: fill lease not released: {e}")
+            return None
+
+    def _stop_lease(self) -> None:
+        if self._lease is not None:
+            self._lease.cancel()
+            self._lease = None
+
+    async def commit(self) -> bool:
+        self._stop_lease()
+        await self._fh.close()
+        self._fh = None
+        if self.lost or self.written != self.total:
+            await self.abort()
+            return False
+        if not await asyncio.get_running_loop().run_in_executor(None, self._publish):
+            await self.abort()
+            return False
+        self.closed = True
+        metrics.shared_incr("stream_cache.fills")
+        metrics.shared_incr("stream_cache.bytes_filled", self.total)
+        return True
+
+    def _publish(self) -> bool:
+        try:
+            size = os.path.getsize(self.part)
+        except OSError as e:
+            log.warning(f"stream cache: {self.entry.sha} not published: {e}")
+            return False
+        if size != self.total:
+            log.warning(f"stream cache: {self.entry.sha} has {size} of {self.total} bytes on disk, not published")
+            return False
+        if self._release() is False:
+            log.warning(f"stream cache: fill lease of {self.entry.sha} lost, not published")
+            return False
+        try:
+            os.replace(self.part, self.entry.path)
+            os.replace(self.meta, self.entry.meta)
+        except OSError as e:
+            log.warning(f"stream cache: {self.entry.sha} not published: {e}")
+            return False
+        prune()
+        return True
+
+    async def abort(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        self._stop_lease()
+        if self._fh is not None:
+            await self._fh.close()
+            self._fh = None
+        await asyncio.get_running_loop().run_in_executor(None, self._discard)
+
+    def _discard(self) -> None:
+        for path in (self.part, self.meta):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self._release()
+        metrics.incr("stream_cache.aborted_fills")
+
+
+def claim_fill(entry: CacheEntry, total: int, validators: Dict[str, Any]) -> Optional[str]:
+    """
+    Become the writer for this entry and get the token to open the TeeWriter
+    with; None if it is too big or already being filled.
+    """
+    s = get_settings()
+    if total <= 0 or total > s.STREAM_CACHE_MAX_BYTES // 4:
+        return None
+    token = uuid.uuid4().hex
+    try:
+        claimed = get_redis().set(FILL_PREFIX + entry.sha, token, nx=True, ex=s.STREAM_CACHE_FILL_TTL)
+    except Exception as e:
+        log.debug(f"stream cache: cannot claim {entry.sha}: {e}")
+        return None
+    if not claimed:
+        return None
+    with open(_writer_files(entry, token)[1], "w") as fh:
+        json.dump({"total": total, **validators}, fh)
+    return token
+
+
+async def follow(entry: CacheEntry, total: int, part: str,
+                 chunk_size: Optional[int] = None) -> AsyncIterator[bytes]:
+    """Read a growing entry from the start of the writer's `part`, behind it, until `total` bytes."""
+    s = get_settings()
+    chunk_size = chunk_size or s.STREAM_CHUNK_SIZE
+    sent = 0
+    idle_since = time.monotonic()
+    try:
+        fh = await aiofiles.open(part, "rb")
+    except FileNotFoundError:
+        fh = await aiofiles.open(entry.path, "rb")  # finished in the meantime
+    try:
+        while sent < total:
+            chunk = await fh.read(min(chunk_size, total - sent))
+            if chunk:
+                sent += len(chunk)
+                idle_since = time.monotonic()
+                yield chunk
+                continue
+            # Caught up with the writer: the .part may have been renamed (done) or dropped (aborted)
+            if time.monotonic() - idle_since > s.STREAM_CACHE_FILL_TTL:
+                raise IOError(f"stream cache writer for {entry.sha} stalled")
+            if not os.path.exists(part) and not os.path.exists(entry.path):
+                raise IOError(f"stream cache fill for {entry.sha} was aborted")
+            await asyncio.sleep(FOLLOW_POLL)
+    finally:
+        await fh.close()
+
+
+def prune() -> None:
+    """
+    Drop least recently used complete entries beyond STREAM_CACHE_MAX_BYTES,
+    and files of writers that died without cleaning up.
+    """
+    root = cache_root()
+    files = []
+    total = 0
+    stale = time.time() - 2 * get_settings().STREAM_CACHE_FILL_TTL
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        if name.endswith((".part", ".json")):
+            # <sha>.<token>.* belong to a writer, which touches them on every lease refresh
+            if name.count(".") > 1 and st.st_mtime < stale:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            continue
+        files.append((st.st_mtime, st.st_size, path))
+        total += st.st_size
+    limit = get_settings().STREAM_CACHE_MAX_BYTES
+    for _, size, path in sorted(files):
+        if total <= limit:
+            break
+        sha = os.path.basename(path).split(".", 1)[0]
+        for victim in (path, os.path.join(root, sha + ".json")):
+            try:
+                os.remove(victim)
+            except OSError:
+                pass
+        total -= size
+        metrics.incr("stream_cache.evictions")
@@ -0,0 +1,367 @@
+# app/services/stream_merge.py
+"""
+Merge a video-only and an audio-only format without temp files.
+
+ffmpeg reads both inputs from pipes (`-i pipe:<fd>`) that the segmented
+engine feeds straight from upstream, so the only bytes written to disk
+are the muxed output and muxing overlaps the download:
+
+    upstream video --SegmentedFetch--> pipe --\
+                                               ffmpeg -c copy --> output.mkv
+    upstream audio --SegmentedFetch--> pipe --/
+
+Pipes are not seekable, so inputs that need seeking to demux (mp4 with
+the moov atom at the end) make ffmpeg fail; callers catch StreamMergeError
+and fall back to download-then-merge. YouTube DASH formats are fragmented
+and stream fine.
+
+LiveMerge is the same pipeline run inside the API event loop with ffmpeg
+writing to stdout, for /media/stream with a merge format: the muxed
+output goes straight to the client. Every stage is a bounded pipe, so a
+slow client stalls ffmpeg, which stops draining its input pipes, which
+pauses the segmented fetches (their buffer high watermark) upstream.
+At most LIVE_MERGE_MAX run per process; start() refuses the next one with
+StreamMergeError so the caller falls back to a merge job.
+"""
+import asyncio
+import contextlib
+import os
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+
+from ..core import metrics
+from ..core.config import get_settings
+from ..core.logging import get_logger
+from . import http_pool, stream_budget
+from .ranged_download import is_plain_http
+from .segmented_fetch import SegmentedFetch, SegmentError
+
+log = get_logger(__name__)
+
+PROGRESS_INTERVAL = 0.5  # seconds between progress callbacks
+MATROSKA = "matroska"
+FRAGMENTED_MP4 = "mp4"
+
+
+class StreamMergeError(Exception):
+    """The piped merge failed; the output file must be discarded."""
+
+
+def supported() -> bool:
+    # pass_fds (extra inherited pipe fds) is POSIX-only
+    return os.name == "posix"
+
+
+def container_for(video: Dict[str, Any], audio: Dict[str, Any]) -> str:
+    """Fragmented MP4 when both inputs are MP4 family, Matroska for anything else (VP9, Opus)."""
+    if video.get("ext") == "mp4" and audio.get("ext") in ("m4a", "mp4"):
+        return FRAGMENTED_MP4
+    return MATROSKA
+
+
+def _ffmpeg_cmd(read_fds: List[int], container: str, output: str) -> List[str]:
+    cmd = ["ffmpeg", "-y", "-loglevel", "error", "-nostdin"]
+    for r in read_fds:
+        cmd += ["-i", f"pipe:{r}"]
+    cmd += [
+        "-map", "0:v:0", "-map", "1:a:0",
+        "-c", "copy",
+        "-avoid_negative_ts", "make_zero",
+        "-fflags", "+genpts",
+    ]
+    if container == FRAGMENTED_MP4:
+        # moov up front and self-contained fragments: playable while it is being written
+        cmd += ["-movflags", "frag_keyframe+empty_moov+default_base_moof"]
+    return cmd + ["-f", container, output]
+
+
+def _check_inputs(inputs: List[Dict[str, Any]]) -> None:
+    for snap in inputs:
+        if not is_plain_http(snap):
+            raise StreamMergeError(f"format {snap.get('format_id')} is not a plain HTTP download")
+
+
+def _write_all(fd: int, data: bytes) -> None:
+    view = memoryview(data)
+    while view:
+        n = os.write(fd, view)
+        view = view[n:]
+
+
+class _Progress:
+    """Bytes fed per input, reported as one 0..1 fraction."""
+
+    def __init__(self, inputs: List[Dict[str, Any]], callback: Optional[Callable[[float], None]]):
+        self.callback = callback
+        self.totals = [snap.get("filesize") or 0 for snap in inputs]
+        self.fed = [0] * len(inputs)
+        self._lock = threading.Lock()
+        self._reported = 0.0
+
+    def set_total(self, index: int, total: Optional[int]) -> None:
+        if total:
+            self.totals[index] = total
+
+    def add(self, index: int, n: int) -> None:
+        with self._lock:
+            self.fed[index] += n
+            now = time.monotonic()
+            if self.callback is None or now - self._reported < PROGRESS_INTERVAL:
+                return
+            self._reported = now
+            total = sum(self.totals)
+            fraction = min(sum(self.fed) / total, 1.0) if total else 0.0
+        self.callback(fraction)
+
+    @property
+    def bytes_fed(self) -> int:
+        return sum(self.fed)
+
+
+async def _feed(client, budget: stream_budget.ByteBudget, snap: Dict[str, Any], fd: int,
+                index: int, progress: _Progress) -> None:
+    fetch = None
+    loop = asyncio.get_running_loop()
+    try:
+        fetch = SegmentedFetch(snap["url"], snap.get("http_headers"), client=client,
+                               use_host_slots=False, budget=budget)
+        await fetch.open()
+        if fetch.status not in (200, 206):
+            raise SegmentError(f"upstream returned {fetch.status} for format {snap.get('format_id')}")
+        progress.set_total(index, fetch.total)
+        fed = 0
+        async for chunk in fetch.iter_bytes():
+            # Blocking pipe write off the loop: a full pipe only stalls this input
+            await loop.run_in_executor(None, _write_all, fd, chunk)
+            fed += len(chunk)
+            progress.add(index, len(chunk))
+        if fetch.total is not None and fed != fetch.total:
+            raise SegmentError(f"format {snap.get('format_id')}: fed {fed} of {fetch.total} bytes")
+    finally:
+        os.close(fd)  # EOF for ffmpeg, whatever happened
+        if fetch is not None:
+            await fetch.aclose()
+
+
+def _run_feeders(inputs: List[Dict[str, Any]], fds: List[int], progress: _Progress,
+                 errors: List[BaseException]) -> None:
+    async def run() -> None:
+        client, _ = http_pool.create_client(http2=False)
+        budget = stream_budget.ByteBudget(get_settings().STREAM_MEMORY_BUDGET)
+        async with client:
+            results = await asyncio.gather(
+                *(_feed(client, budget, snap, fd, i, progress) for i, (snap, fd) in enumerate(zip(inputs, fds))),
+                return_exceptions=True,
+            )
+        errors.extend(r for r in results if isinstance(r, BaseException))
+
+    try:
+        asyncio.run(run())
+    except BaseException as e:  # noqa: BLE001 - reported to the caller's thread
+        errors.append(e)
+
+
+def merge_streaming(video: Dict[str, Any], audio: Dict[str, Any], output_path: str,
+                    progress_callback: Optional[Callable[[float], None]] = None) -> int:
+    """
+    Fetch the two format snapshots (see ytdlp_service.snapshot_format) and
+    mux them into `output_path` (matroska). Returns the bytes read from
+    upstream; raises StreamMergeError and removes the output on any failure.
+    """
+    if not supported():
+        raise StreamMergeError("piped merge needs a POSIX platform")
+    inputs = [video, audio]
+    _check_inputs(inputs)
+
+    read_fds: List[int] = []
+    write_fds: List[int] = []
+    for _ in inputs:
+        r, w = os.pipe()
+        read_fds.append(r)
+        write_fds.append(w)
+
+    cmd = _ffmpeg_cmd(read_fds, MATROSKA, output_path)
+    log.info(f"Streaming merge -> {output_path}")
+    started = time.monotonic()
+    try:
+        proc = subprocess.Popen(cmd, pass_fds=read_fds, stdin=subprocess.DEVNULL,
+                                stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    except OSError as e:
+        for fd in read_fds + write_fds:
+            os.close(fd)
+        raise StreamMergeError(f"cannot start ffmpeg: {e}") from e
+    for r in read_fds:
+        os.close(r)  # ffmpeg holds its own copies; a dead ffmpeg now means EPIPE for the feeders
+
+    progress = _Progress(inputs, progress_callback)
+    errors: List[BaseException] = []
+    feeder = threading.Thread(target=_run_feeders, args=(inputs, write_fds, progress, errors),
+                              name="stream-merge-feed", daemon=True)
+    feeder.start()
+    _, stderr = proc.communicate()
+    feeder.join()
+
+    if errors or proc.returncode != 0:
+        try:
+            os.remove(output_path)
+        except OSError:
+            pass
+        metrics.incr("stream_merge.failed")
+        detail = stderr.decode("utf-8", "ignore").strip()[-500:]
+        reason = errors[0] if errors else f"ffmpeg exited with {proc.returncode}"
+        raise StreamMergeError(f"{reason}{': ' + detail if detail else ''}")
+
+    if progress_callback:
+        progress_callback(1.0)
+    metrics.incr("stream_merge.completed")
+    log.info(f"Streaming merge done in {time.monotonic() - started:.1f}s "
+             f"({progress.bytes_fed} bytes from upstream, no temp files)")
+    return progress.bytes_fed
+
+
+_live_slots: Optional[asyncio.Semaphore] = None
+_live_writers: Optional[ThreadPoolExecutor] = None
+
+
+def _live_pools():
+    global _live_slots, _live_writers
+    if _live_slots is None:
+        limit = get_settings().LIVE_MERGE_MAX
+        _live_slots = asyncio.Semaphore(limit)
+        # Pipe writes block while ffmpeg is behind: keep them off the loop's default executor
+        _live_writers = ThreadPoolExecutor(max_workers=2 * limit, thread_name_prefix="live-merge-feed")
+    return _live_slots, _live_writers
+
+
+class LiveMerge:
+    """Mux two upstream formats with ffmpeg and expose the output as an async byte stream."""
+
+    def __init__(self, video: Dict[str, Any], audio: Dict[str, Any], container: Optional[str] = None):
+        self.inputs = [video, audio]
+        self.container = container or container_for(video, audio)
+        self._fetches = [SegmentedFetch(snap["url"], snap.get("http_headers")) for snap in self.inputs]
+        self._proc: Optional[asyncio.subprocess.Process] = None
+        self._feeders: List[asyncio.Task] = []
+        self._first: bytes = b""
+        self._slot = False
+        self._closed = False
+        self.bytes_out = 0
+
+    async def start(self) -> None:
+        """
+        Open both upstreams, start ffmpeg and wait for its first output, so a
+        failure (upstream error, unpipeable input) is raised as StreamMergeError
+        before any response is committed.
+        """
+        if not supported():
+            raise StreamMergeError("piped merge needs a POSIX platform")
+        _check_inputs(self.inputs)
+        slots, _ = _live_pools()
+        if slots.locked():
+            metrics.incr("live_merge.rejected")
+            raise StreamMergeError(f"{get_settings().LIVE_MERGE_MAX} live merges already running")
+        await slots.acquire()  # free, so this does not wait
+        self._slot = True
+        await asyncio.gather(*(fetch.open() for fetch in self._fetches))
+        for snap, fetch in zip(self.inputs, self._fetches):
+            if fetch.status not in (200, 206):
+                raise StreamMergeError(f"upstream returned {fetch.status} for format {snap.get('format_id')}")
+
+        read_fds: List[int] = []
+        write_fds: List[int] = []
+        for _ in self.inputs:
+            r, w = os.pipe()
+            read_fds.append(r)
+            write_fds.append(w)
+        try:
+            self._proc = await asyncio.create_subprocess_exec(
+                *_ffmpeg_cmd(read_fds, self.container, "pipe:1"), pass_fds=read_fds,
+                stdin=asyncio.subprocess.DEVNULL, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+            )
+        except OSError as e:
+            for fd in write_fds:
+                os.close(fd)
+            raise StreamMergeError(f"cannot start ffmpeg: {e}") from e
+        finally:
+            for r in read_fds:
+                os.close(r)
+        self._feeders = [asyncio.create_task(self._feed(fetch, fd)) for fetch, fd in zip(self._fetches, write_fds)]
+
+        timeout = get_settings().LIVE_MERGE_FIRST_BYTE_TIMEOUT
+        try:
+            self._first = await asyncio.wait_for(self._proc.stdout.read(get_settings().STREAM_CHUNK_SIZE), timeout)
+        except asyncio.TimeoutError:
+            raise StreamMergeError(f"no output from ffmpeg after {timeout}s")
+        if not self._first:
+            await self._proc.wait()
+            raise StreamMergeError(await self._failure())
+        metrics.incr("live_merge.started")
+
+    async def _feed(self, fetch: SegmentedFetch, fd: int) -> None:
+        loop = asyncio.get_running_loop()
+        _, writers = _live_pools()
+        write = None
+        try:
+            async for chunk in fetch.iter_bytes():
+                # Blocking pipe write off the loop: a full pipe means ffmpeg (hence the client) is behind
+                write = loop.run_in_executor(writers, _write_all, fd, chunk)
+                await asyncio.shield(write)
+                write = None
+        finally:
+            if write is not None:
+                # Cancelled mid-write: the thread uses fd until the write returns (EPIPE once ffmpeg is gone)
+                await asyncio.wait([write])
+            os.close(fd)
+            await fetch.aclose()
+
+    async def _failure(self) -> str:
+        if self._proc.returncode:
+            detail = (await self._proc.stderr.read()).decode("utf-8", "ignore").strip()[-500:]
+            return f"ffmpeg exited with {self._proc.returncode}{': ' + detail if detail else ''}"
+        for task in self._feeders:
+            if task.done() and not task.cancelled() and task.exception() is not None:
+                return f"feeding ffmpeg failed: {task.exception()!r}"
+        return "ffmpeg produced no output"
+
+    async def iter_bytes(self) -> AsyncIterator[bytes]:
+        chunk_size = get_settings().STREAM_CHUNK_SIZE
+        chunk = self._first
+        self._first = b""
+        while chunk:
+            self.bytes_out += len(chunk)
+            yield chunk
+            chunk = await self._proc.stdout.read(chunk_size)
+        await self._proc.wait()
+        await asyncio.gather(*self._feeders, return_exceptions=True)
+        if self._proc.returncode != 0 or any(t.exception() for t in self._feeders if not t.cancelled()):
+            # Headers are gone already; cutting the body short tells the client it is incomplete
+            metrics.incr("live_merge.failed")
+            raise StreamMergeError(await self._failure())
+        metrics.incr("live_merge.completed")
+
+    async def aclose(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        # ffmpeg first: a feeder blocked on a full pipe only returns once the pipe breaks
+        if self._proc is not None:
+            if self._proc.returncode is None:
+                self._proc.kill()
+            # wait() also waits for EOF on the pipes; a paused stdout never sees it unless drained
+            for stream in (self._proc.stdout, self._proc.stderr):
+                while await stream.read(get_settings().STREAM_CHUNK_SIZE):
+                    pass
+            await self._proc.wait()
+        for task in self._feeders:
+            task.cancel()
+        for task in self._feeders:
+            with contextlib.suppress(BaseException):
+                await task
+        for fetch in self._fetches:
+            await fetch.aclose()
+        if self._slot:
+            self._slot = False
+            _live_slots.release()
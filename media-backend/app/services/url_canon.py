@@ -0,0 +1,163 @@
+# app/services/url_canon.py
+"""
+URL canonicalization: map any share link to a stable (platform, media id).
+
+Dispatch is two-step: the host is resolved to a platform by walking its
+labels from the most to the least specific against a suffix table (so
+`m.youtube.com` and `music.youtube.com` both land on `youtube.com`), then
+only that platform's path patterns are tried. Unknown hosts fall back to a
+normalized URL with tracking parameters removed. Recent mappings are kept
+in an LRU since the same links arrive over and over.
+"""
+import hashlib
+import re
+from functools import lru_cache
+from typing import Dict, List, NamedTuple, Optional, Pattern, Tuple
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+
+class MediaKey(NamedTuple):
+    platform: str
+    media_id: str
+
+    def __str__(self) -> str:
+        return f"{self.platform}:{self.media_id}"
+
+
+# host suffix -> platform
+_HOSTS: Dict[str, str] = {
+    "youtube.com": "youtube",
+    "youtube-nocookie.com": "youtube",
+    "youtu.be": "youtube",
+    "twitter.com": "twitter",
+    "x.com": "twitter",
+    "instagram.com": "instagram",
+    "facebook.com": "facebook",
+    "fb.watch": "facebook",
+    "tiktok.com": "tiktok",
+    "vimeo.com": "vimeo",
+}
+
+_YT_ID = r"(?P<id>[A-Za-z0-9_-]{11})"
+
+# platform -> patterns matched against "host/path" (host without "www.")
+_PATTERNS: Dict[str, List[Pattern]] = {
+    "youtube": [
+        re.compile(r"^youtu\.be/" + _YT_ID),
+        re.compile(r"/(?:shorts|embed|live|v|e)/" + _YT_ID),
+    ],
+    "twitter": [
+        re.compile(r"/status(?:es)?/(?P<id>\d+)"),
+    ],
+    "instagram": [
+        re.compile(r"/(?:p|reels?|tv)/(?P<id>[A-Za-z0-9_-]+)"),
+    ],
+    "facebook": [
+        re.compile(r"^fb\.watch/(?P<id>[A-Za-z0-9_-]+)"),
+        re.compile(r"/(?:videos|reel)/(?:[^/]+/)?(?P<id>\d+)"),
+    ],
+    "tiktok": [
+        re.compile(r"/video/(?P<id>\d+)"),
+        re.compile(r"^v[mt]\.tiktok\.com/(?P<id>[A-Za-z0-9]+)"),
+    ],
+    "vimeo": [
+        re.compile(r"^(?:player\.)?vimeo\.com/(?:video/)?(?P<id>\d+)"),
+    ],
+}
+
+# platform -> query parameter that carries the id (checked before paths)
+_ID_PARAMS: Dict[str, str] = {
+    "youtube": "v",
+    "facebook": "v",
+}
+
+# Canonical URL to hand to yt-dlp, only where it is unambiguous
+_CANONICAL_URLS: Dict[str, str] = {
+    "youtube": "https://www.youtube.com/watch?v={id}",
+    "twitter": "https://x.com/i/status/{id}",
+    "instagram": "https://www.instagram.com/p/{id}/",
+    "vimeo": "https://vimeo.com/{id}",
+}
+
+# Query parameters that never change which media a URL points to
+_TRACKING_PARAMS = {
+    "si", "feature", "pp", "fbclid", "gclid", "igshid", "igsh", "ref",
+    "ref_src", "ref_url", "mibextid", "_r", "_t", "is_from_webapp", "sender_device",
+}
+_TRACKING_PREFIXES = ("utm_",)
+
+
+def _split(url: str) -> Tuple[str, str, str]:
+    parts = urlsplit(url.strip() if "://" in url else "https://" + url.strip())
+    host = (parts.hostname or "").lower()
+    if host.startswith("www."):
+        host = host[4:]
+    return host, parts.path or "/", parts.query
+
+
+def _platform_for_host(host: str) -> Optional[str]:
+    labels = host.split(".")
+    for i in range(len(labels) - 1):
+        platform = _HOSTS.get(".".join(labels[i:]))
+        if platform:
+            return platform
+    return None
+
+
+def _is_tracking(name: str) -> bool:
+    return name in _TRACKING_PARAMS or name.startswith(_TRACKING_PREFIXES)
+
+
+def normalize_url(url: str) -> str:
+    """Lowercase host, drop www/fragment/tracking params and sort the query."""
+    parts = urlsplit(url.strip() if "://" in url else "https://" + url.strip())
+    host = (parts.hostname or "").lower()
+    if host.startswith("www."):
+        host = host[4:]
+    if parts.port:
+        host = f"{host}:{parts.port}"
+    query = sorted((k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if not _is_tracking(k))
+    path = parts.path.rstrip("/") or "/"
+    return urlunsplit(("https", host, path, urlencode(query), ""))
+
+
+@lru_cache(maxsize=4096)
+def canonicalize(url: str) -> MediaKey:
+    """Map a URL to its (platform, media id); unknown links become ("url", <hash>)."""
+    host, path, query = _split(url)
+    platform = _platform_for_host(host)
+    if platform:
+        param = _ID_PARAMS.get(platform)
+        if param:
+            for k, v in parse_qsl(query):
+                if k == param and v:
+                    return MediaKey(platform, v)
+        target = host + path
+        for pattern in _PATTERNS.get(platform, ()):
+            m = pattern.search(target)
+            if m:
+                return MediaKey(platform, m.group("id"))
+
+    digest = hashlib.sha1(normalize_url(url).encode("utf-8")).hexdigest()[:20]
+    return MediaKey("url", digest)
+
+
+def cache_key(url: str) -> str:
+    """String form of the canonical key, for cache / lock / dedup keys."""
+    return str(canonicalize(url))
+
+
+def platform_for(url: str) -> Optional[str]:
+    """Platform name for a URL, None for unknown sites."""
+    return _platform_for_host(_split(url)[0])
+
+
+def extraction_url(url: str) -> str:
+    """
+    URL to pass to yt-dlp: the canonical form where the platform has one
+    (e.g. drops `&list=` so a watch link never expands into a playlist),
+    otherwise the original URL.
+    """
+    key = canonicalize(url)
+    template = _CANONICAL_URLS.get(key.platform)
+    return template.format(id=key.media_id) if template else url.strip()
@@ -0,0 +1,96 @@
+# app/services/ytdlp_cache.py
+"""
+Node-wide persistent yt-dlp cache (player JS, signature / nsig solutions)
+and the worker warm-up that fills it.
+
+yt-dlp writes cache entries with an atomic rename, so any number of
+processes can share the directory. The warm-up itself is serialized with
+a file lock plus a freshness stamp, so when a pool of workers recycles at
+once only one of them actually talks to YouTube.
+"""
+import os
+import threading
+import time
+from typing import Any, Dict
+
+import yt_dlp
+
+from ..core.config import get_settings
+from ..core.logging import get_logger
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process warm-up lock, stamp still applies
+    fcntl = None
+
+log = get_logger(__name__)
+
+_STAMP = ".warmup-stamp"
+_LOCK = ".warmup.lock"
+
+
+def cache_dir() -> str:
+    path = os.path.abspath(get_settings().YTDLP_CACHE_DIR)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def apply_cache_opts(ydl_opts: Dict[str, Any]) -> Dict[str, Any]:
+    """Point a YoutubeDL options dict at the shared cache directory."""
+    ydl_opts["cachedir"] = cache_dir()
+    return ydl_opts
+
+
+def _stamp_fresh(path: str, max_age: int) -> bool:
+    try:
+        return time.time() - os.path.getmtime(path) < max_age
+    except OSError:
+        return False
+
+
+def _warm_player_cache() -> None:
+    s = get_settings()
+    root = cache_dir()
+    stamp = os.path.join(root, _STAMP)
+    if _stamp_fresh(stamp, s.YTDLP_WARMUP_INTERVAL):
+        return
+
+    with open(os.path.join(root, _LOCK), "a") as lock_fh:
+        if fcntl is not None:
+            fcntl.flock(lock_fh, fcntl.LOCK_EX)
+        try:
+            # Another process may have finished while we waited for the lock
+            if _stamp_fresh(stamp, s.YTDLP_WARMUP_INTERVAL):
+                return
+            t0 = time.time()
+            opts = apply_cache_opts({"quiet": True, "no_warnings": True, "skip_download": True})
+            with yt_dlp.YoutubeDL(opts) as ydl:
+                ydl.extract_info(s.YTDLP_WARMUP_URL, download=False)
+            with open(stamp, "w") as fh:
+                fh.write(str(time.time()))
+            log.info(f"yt-dlp player cache warmed in {time.time() - t0:.1f}s")
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_fh, fcntl.LOCK_UN)
+
+
+def warm_up() -> None:
+    """Import extractor classes and make sure the player cache is fresh."""
+    t0 = time.time()
+    yt_dlp.extractor.import_extractors()
+    list(yt_dlp.extractor.gen_extractor_classes())
+    log.info(f"yt-dlp extractors loaded in {time.time() - t0:.2f}s")
+
+    if not get_settings().YTDLP_WARMUP_URL:
+        return
+    try:
+        _warm_player_cache()
+    except Exception as e:
+        log.warning(f"yt-dlp warm-up extraction failed: {e}")
+
+
+def warm_up_in_background() -> threading.Thread:
+    """Run warm_up without blocking process init (Celery kills slow inits)."""
+    t = threading.Thread(target=warm_up, name="ytdlp-warmup", daemon=True)
+    t.start()
+    return t
@@ -4,44 +4,262 @@
 
 # app/services/ytdlp_service.py
 import os
+import threading
+import time
 import yt_dlp
-from typing import Dict, Any, List, Optional
+from contextlib import contextmanager
+from typing import Callable, Dict, Any, FrozenSet, Iterable, Iterator, List, Optional, Tuple
+from ..core import metrics
+from ..core.config import get_settings
+from ..core.logging import get_logger
+from . import extract_guard, info_cache, singleflight, url_canon
+from .ytdlp_cache import apply_cache_opts
+
+log = get_logger(__name__)
 
 COOKIES_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "..", "cookies")
 
+_COOKIE_FILES = {
+    "youtube": "youtube.txt",
+    "instagram": "instagram.txt",
+    "facebook": "facebook.txt",
+    "twitter": "twitter.txt",
+}
+
 
 def _cookies_for(url: str) -> Optional[str]:
     """Return cookie file path if one exists for the platform."""
-    u = url.lower()
-    mapping = {
-        "youtube.txt": ["youtube.com", "youtu.be"],
-        "instagram.txt": ["instagram.com"],
-        "facebook.txt": ["facebook.com"],
-        "twitter.txt": ["twitter.com", "x.com"],
-    }
-    for fname, hosts in mapping.items():
-        if any(h in u for h in hosts):
-            path = os.path.join(COOKIES_DIR, fname)
-            if os.path.exists(path):
-                return path
+    fname = _COOKIE_FILES.get(url_canon.platform_for(url) or "")
+    if fname:
+        path = os.path.join(COOKIES_DIR, fname)
+        if os.path.exists(path):
+            return path
     return None
 
 
-def extract_info(url: str) -> Dict[str, Any]:
+# ---------------- pooled YoutubeDL instances ----------------
+#
+# Building a YoutubeDL loads extractor classes, builds the request director
+# and parses the cookie file. Instances are kept per (profile, cookie file,
+# cookie mtime) and checked out by one thread at a time, so an edited cookie
+# file simply starts a new generation and the old one is closed. When a
+# checkout changed the jar (sites rotate session cookies), the jar is saved
+# as the instance goes back and it is re-keyed under the new mtime; the
+# other idle instances still hold the old cookies and retire with their
+# generation. close() never saves: an instance that is only being retired
+# must not overwrite a newer file.
+
+_INFO_OPTS: Dict[str, Any] = {
+    "quiet": True,
+    "no_warnings": True,
+    "skip_download": True,
+    "format": "bestvideo+bestaudio/best",
+}
+
+_PoolKey = Tuple[str, Optional[str], Optional[float]]
+
+_pool_lock = threading.Lock()
+_pool: Dict[_PoolKey, List[yt_dlp.YoutubeDL]] = {}
+_cookie_save_lock = threading.Lock()
+
+
+def _cookie_mtime(cookiefile: Optional[str]) -> Optional[float]:
+    if not cookiefile:
+        return None
+    try:
+        return os.path.getmtime(cookiefile)
+    except OSError:
+        return None
+
+
+def _jar_state(ydl: yt_dlp.YoutubeDL) -> FrozenSet[Tuple[Any, ...]]:
+    return frozenset((c.domain, c.path, c.name, c.value, c.expires) for c in ydl.cookiejar)
+
+
+def _save_cookies(ydl: yt_dlp.YoutubeDL, cookiefile: str) -> Optional[float]:
+    """Write the jar back to its file; returns the file's new mtime."""
+    with _cookie_save_lock:
+        try:
+            ydl.cookiejar.save()
+            metrics.incr("ytdlp_pool.cookie_saves")
+        except Exception as e:
+            log.warning(f"cookies not saved to {cookiefile}: {e}")
+        return _cookie_mtime(cookiefile)
+
+
+class _HookSlot:
+    """The one progress hook of a pooled instance; its target is set per checkout."""
+
+    def __init__(self):
+        self.target: Optional[Callable[[Dict[str, Any]], None]] = None
+
+    def __call__(self, d: Dict[str, Any]) -> None:
+        if self.target is not None:
+            self.target(d)
+
+
+def _close_quietly(ydl: yt_dlp.YoutubeDL) -> None:
+    ydl.params.pop("cookiefile", None)  # close() would save the jar into the cookie file
+    try:
+        ydl.close()
+    except Exception:
+        pass
+
+
+@contextmanager
+def pooled_ydl(profile: str, opts: Dict[str, Any], cookiefile: Optional[str] = None,
+               progress_hook: Optional[Callable[[Dict[str, Any]], None]] = None) -> Iterator[yt_dlp.YoutubeDL]:
+    """
+    Check out a pre-configured YoutubeDL for `profile`. `opts` is only used
+    when a new instance has to be built, so it must be the same for every
+    call with the same profile name. `progress_hook` receives this
+    checkout's download progress.
+    """
+    settings = get_settings()
+    key: _PoolKey = (profile, cookiefile, _cookie_mtime(cookiefile))
+
+    stale: List[yt_dlp.YoutubeDL] = []
+    ydl = None
+    with _pool_lock:
+        for other in [k for k in _pool if k[:2] == key[:2] and k != key]:
+            stale.extend(_pool.pop(other))  # cookie file changed on disk
+        idle = _pool.get(key)
+        if idle:
+            ydl = idle.pop()
+    for old in stale:
+        _close_quietly(old)
+
+    if ydl is None:
+        ydl_opts = apply_cache_opts(dict(opts))
+        if cookiefile:
+            ydl_opts["cookiefile"] = cookiefile
+        hook = _HookSlot()
+        ydl_opts["progress_hooks"] = [hook]
+        ydl = yt_dlp.YoutubeDL(ydl_opts)
+        ydl._pool_uses = 0
+        ydl._pool_hook = hook
+
+    ydl._pool_hook.target = progress_hook
+    jar_before = _jar_state(ydl) if cookiefile else None
+    try:
+        yield ydl
+    finally:
+        ydl._pool_hook.target = None
+        ydl._pool_uses += 1
+        if cookiefile and _jar_state(ydl) != jar_before:
+            key = (profile, cookiefile, _save_cookies(ydl, cookiefile))
+        keep = ydl._pool_uses < settings.YTDL_POOL_MAX_USES
+        if keep:
+            with _pool_lock:
+                idle = _pool.setdefault(key, [])
+                keep = len(idle) < settings.YTDL_POOL_MAX_IDLE
+                if keep:
+                    idle.append(ydl)
+        if not keep:
+            _close_quietly(ydl)
+
+
+def pool_stats() -> Dict[str, int]:
+    """Idle instances per profile."""
+    with _pool_lock:
+        out: Dict[str, int] = {}
+        for (profile, _, _), idle in _pool.items():
+            out[profile] = out.get(profile, 0) + len(idle)
+        return out
+
+
+metrics.register_collector("ytdlp_pool", pool_stats)
+
+
+def extract_info(url: str, use_cache: bool = True) -> Dict[str, Any]:
+    """
+    Run yt-dlp metadata extraction, served from the metadata cache when a
+    fresh entry exists. Concurrent misses for the same URL are coalesced so
+    only one extraction runs across all processes, and recently failed URLs
+    or platforms with an open breaker raise ExtractionBlocked right away.
+    The returned dict is JSON-safe and must be treated as read-only.
+    """
+    key = url_canon.cache_key(url)
+    if use_cache:
+        cached = info_cache.get(key)
+        if cached is not None:
+            return cached
+    else:
+        info_cache.invalidate(key)
+    extract_guard.check(url)
+
+    def leader() -> Dict[str, Any]:
+        try:
+            info = _extract_uncached(url)
+        except Exception as e:
+            extract_guard.record_failure(url, e)
+            raise
+        extract_guard.record_success(url)
+        info_cache.put(key, info)
+        return info
+
+    return singleflight.do(
+        key, lambda: singleflight.do_shared(key, leader, lambda: info_cache.get(key))
+    )
+
+
+def _extract_uncached(url: str) -> Dict[str, Any]:
     """Run yt-dlp metadata extraction."""
-    ydl_opts = {
-        "quiet": True,
-        "no_warnings": True,
-        "skip_download": True,
-        "format": "bestvideo+bestaudio/best",
-    }
-    cookies = _cookies_for(url)
-    if cookies:
-        ydl_opts["cookiefile"] = cookies
-
-    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-        info = ydl.extract_info(url, download=False)
-    return info
+    with pooled_ydl("info", _INFO_OPTS, _cookies_for(url)) as ydl:
+        info = ydl.extract_info(url_canon.extraction_url(url), download=False)
+        return ydl.sanitize_info(info)
+
+
+def snapshot_format(info: Dict[str, Any], format_id: str) -> Optional[Dict[str, Any]]:
+    """Everything a worker needs to fetch one format without yt-dlp."""
+    for f in info.get("formats") or []:
+        if str(f.get("format_id")) == str(format_id):
+            return {
+                "format_id": str(f.get("format_id")),
+                "url": f.get("url"),
+                "http_headers": f.get("http_headers") or {},
+                "protocol": f.get("protocol"),
+                "ext": f.get("ext"),
+                "vcodec": str(f.get("vcodec") or "none"),
+                "acodec": str(f.get("acodec") or "none"),
+                "filesize": f.get("filesize") or f.get("filesize_approx"),
+                "expires_at": info_cache.url_expiry(f.get("url")),
+            }
+    return None
+
+
+def _expired(snap: Dict[str, Any], margin: int) -> bool:
+    expires_at = snap.get("expires_at")
+    return bool(expires_at) and expires_at - margin <= time.time()
+
+
+def resolve_formats(url: str, format_ids: Iterable[str], info_key: Optional[str] = None,
+                    refresh: bool = False) -> Tuple[Dict[str, Any], Dict[str, Dict[str, Any]]]:
+    """
+    Resolve format snapshots for a job. `info_key` is the cache handle taken
+    at /info time; the cached extraction is reused as long as the chosen
+    formats' signed URLs are still valid, otherwise we re-extract once.
+    `refresh` re-extracts regardless (upstream refused URLs that looked valid).
+    Formats that do not exist are simply absent from the returned mapping.
+    """
+    ids = [str(i) for i in format_ids]
+    margin = 60  # leave time for the transfer to actually start
+
+    if refresh:
+        if info_key:
+            info_cache.invalidate(info_key)
+        info = extract_info(url, use_cache=False)
+        return info, {i: snap for i in ids if (snap := snapshot_format(info, i))}
+
+    info = info_cache.get(info_key) if info_key else None
+    if info is None:
+        info = extract_info(url)
+    snaps = {i: snap for i in ids if (snap := snapshot_format(info, i))}
+
+    if any(_expired(snap, margin) for snap in snaps.values()):
+        info = extract_info(url, use_cache=False)
+        snaps = {i: snap for i in ids if (snap := snapshot_format(info, i))}
+    return info, snaps
 
 
 def build_formats(info: Dict[str, Any]) -> List[Dict[str, Any]]:
@@ -1,91 +1,131 @@
+import json
 import os
-import uuid
 import time
 from typing import Dict, Any, Optional
 from celery import current_task
+from celery.signals import task_postrun
 
 from ..core.celery_app import celery_app
+from ..core.config import get_settings
 from ..core.logging import get_logger
 from ..services.storage_local import tmp_path, move_into_storage
 from ..services.ffmpeg_simple import merge_simple_reliable
-from ..services.ytdlp_service import extract_info
-from ..services.redis_conn import get_redis
-
-# Import httpx lazily to avoid import issues
-try:
-    import httpx
-except ImportError:
-    httpx = None
+from ..services.ytdlp_service import resolve_formats
+from ..services.url_canon import cache_key
+from ..services.progress import ProgressEmitter, store as progress_store
+from ..services.ranged_download import download_to_file, is_plain_http
+from ..services import artifact_index, checkpoints, inflight, merge_legs, retry_policy, stream_merge
 
 log = get_logger(__name__)
 
-def update_task_progress(status: str, progress: float = None, **extra):
-    """Update Celery task progress with Redis pub/sub"""
-    if not current_task:
-        return
-        
-    meta = {
+def _frontend_data(task_id: str, status: str, meta: Dict[str, Any]) -> Dict[str, Any]:
+    """Task meta in the shape the frontend expects on `tasks:<id>`."""
+    frontend_data = {
+        "id": task_id,  # Frontend expects 'id' not 'task_id'
         "status": status,
-        "timestamp": time.time(),
-        **extra
+        "timestamp": meta.get("timestamp"),
+        "message": meta.get("message", ""),
     }
     
-    if progress is not None:
-        meta["progress"] = max(0.0, min(1.0, progress))
-    
-    # Update Celery task state
-    current_task.update_state(state=status.upper(), meta=meta)
+    # Add progress as progress01 (0-1 range) if available
+    if "progress" in meta:
+        frontend_data["progress01"] = meta["progress"]
     
-    log.info(f"[{current_task.request.id}] Progress update: {status} {progress} - {extra}")
+    # Convert snake_case backend fields to camelCase frontend fields
+    if "downloaded_bytes" in meta:
+        frontend_data["downloadedBytes"] = meta["downloaded_bytes"]
+    if "total_bytes" in meta:
+        frontend_data["totalBytes"] = meta["total_bytes"] 
+    if "speed_mbps" in meta and meta["speed_mbps"]:
+        # Convert MB/s to bytes/s for frontend
+        frontend_data["speedBps"] = int(meta["speed_mbps"] * 1024 * 1024)
     
-    # Publish to Redis for real-time updates
-    try:
-        redis_client = get_redis()
-        channel = f"tasks:{current_task.request.id}"
-        import json
-        
-        # Convert backend fields to frontend-expected format
-        frontend_data = {
-            "id": current_task.request.id,  # Frontend expects 'id' not 'task_id'
+    # Copy other fields as-is
+    for key, value in meta.items():
+        if key not in ["downloaded_bytes", "total_bytes", "speed_mbps", "timestamp", "message"]:
+            frontend_data[key] = value
+            
+    # Add completion flags for frontend logic
+    if status.lower() in ["completed", "success"] or meta.get("finished"):
+        frontend_data["finished"] = True
+    elif status.lower() in ["failed", "error"] or meta.get("failed"):
+        frontend_data["failed"] = True
+    return frontend_data
+
+# Emitters of the tasks running in this process, by task id
+_emitters: Dict[str, ProgressEmitter] = {}
+
+def task_progress(task) -> ProgressEmitter:
+    """
+    The coalescing progress emitter of a running task. It is bound to the
+    task, not the thread, so download threads can report through it.
+    """
+    task_id = task.request.id
+    emitter = _emitters.get(task_id)
+    if emitter is not None and not emitter.closed:
+        return emitter
+
+    fresh = True
+
+    def sink(pipe, status: str, progress: Optional[float], fields: Dict[str, Any], terminal: bool) -> None:
+        nonlocal fresh
+        meta = {
             "status": status,
-            "timestamp": meta.get("timestamp"),
-            "message": meta.get("message", ""),
+            "timestamp": time.time(),
+            # Retry budget of this job: attempts used so far / allowed
+            "retries": task.request.retries,
+            "max_retries": task.max_retries,
+            **fields
         }
-        
-        # Add progress as progress01 (0-1 range) if available
         if progress is not None:
-            frontend_data["progress01"] = max(0.0, min(1.0, progress))
-        
-        # Convert snake_case backend fields to camelCase frontend fields
-        if "downloaded_bytes" in meta:
-            frontend_data["downloadedBytes"] = meta["downloaded_bytes"]
-        if "total_bytes" in meta:
-            frontend_data["totalBytes"] = meta["total_bytes"] 
-        if "speed_mbps" in meta and meta["speed_mbps"]:
-            # Convert MB/s to bytes/s for frontend
-            frontend_data["speedBps"] = int(meta["speed_mbps"] * 1024 * 1024)
-        
-        # Copy other fields as-is
-        for key, value in meta.items():
-            if key not in ["downloaded_bytes", "total_bytes", "speed_mbps", "timestamp", "message"]:
-                frontend_data[key] = value
-                
-        # Add completion flags for frontend logic
-        if status.lower() in ["completed", "success"] or extra.get("finished"):
-            frontend_data["finished"] = True
-        elif status.lower() in ["failed", "error"] or extra.get("failed"):
-            frontend_data["failed"] = True
-            
-        log.info(f"[{current_task.request.id}] Publishing to Redis channel {channel}: {frontend_data}")
-        redis_client.publish(channel, json.dumps(frontend_data))
-        
-        # Clear old progress updates when job is finished
-        if frontend_data.get("finished") or frontend_data.get("failed"):
-            log.info(f"[{current_task.request.id}] Job finished, no more progress updates will be sent")
-    except Exception as e:
-        log.error(f"Failed to publish progress: {e}")
+            meta["progress"] = progress
+        # Progress record for status polls and real-time update, in the emitter's pipeline;
+        # the result backend only gets the task's final result
+        progress_store(pipe, task_id, meta, reset=fresh, final=status in ("completed", "failed"))
+        fresh = False
+        pipe.publish(f"tasks:{task_id}", json.dumps(_frontend_data(task_id, status, meta), default=str))
+        if terminal:
+            _emitters.pop(task_id, None)
 
-@celery_app.task(bind=True)
+    # "retrying" ends this delivery; the next one gets a fresh emitter
+    emitter = ProgressEmitter(task_id, sink, terminal_states=("completed", "failed", "retrying"))
+    _emitters[task_id] = emitter
+    return emitter
+
+@task_postrun.connect
+def _drop_emitter(task_id=None, **_):
+    """A task that ended without a terminal update (time limit, crash) leaves no emitter behind."""
+    _emitters.pop(task_id, None)
+
+def update_task_progress(status: str, progress: float = None, **extra):
+    """Report progress of the current Celery task (coalesced, see app.services.progress)"""
+    if not current_task:
+        return
+    task_progress(current_task).emit(status, progress, **extra)
+
+def _retry_or_fail(task, payload: Dict[str, Any], exc: Exception) -> None:
+    """
+    Reschedule the task for a transient error (raises celery Retry, the worker
+    slot is freed at once); otherwise release its in-flight slot and report
+    the failure. The in-flight slot and any checkpoint survive a retry.
+    """
+    rule = retry_policy.classify(exc)
+    attempt = task.request.retries
+    if rule.retry and attempt < task.max_retries:
+        countdown = retry_policy.backoff(attempt, rule)
+        retry_policy.record(task.request.id, attempt + 1, task.max_retries, countdown, rule, exc)
+        log.warning(f"[{task.request.id}] {rule.kind} error, retry {attempt + 1}/{task.max_retries} in {countdown:.1f}s: {exc}")
+        update_task_progress("retrying", message=f"{rule.kind}: retrying in {countdown:.0f}s",
+                             error_class=rule.kind, retry_in=round(countdown, 1))
+        # Upstream refused the signed URLs: the next attempt extracts fresh ones instead of
+        # reusing the cached extraction, which still looks valid by its expiry
+        payload["refresh_urls"] = rule.kind == "expired_url"
+        raise task.retry(args=[payload], exc=exc, countdown=countdown)
+    inflight.finish(payload.get("inflight_slot"), task.request.id)
+    update_task_progress("failed", message=str(exc), failed=True, error_class=rule.kind)
+
+
+@celery_app.task(bind=True, max_retries=get_settings().TASK_MAX_RETRIES)
 def stream_download(self, payload: Dict[str, Any]) -> Dict[str, Any]:
     """
     Stream download for progressive formats - faster and more reliable
@@ -95,29 +135,21 @@ def stream_download(self, payload: Dict[str, Any]) -> Dict[str, Any]:
     title = payload.get("title", "download").strip() or "download"
     
     safe_title = "".join(c if c.isalnum() or c in " ._-" else "_" for c in title)
-    uid = uuid.uuid4().hex[:8]
+    uid = checkpoints.stable_uid(self.request.id)  # same temp files when the task is redelivered
     
-    log.info(f"[{self.request.id}] Starting stream download: {url}")
-    update_task_progress("starting", 0.0, message="Extracting stream info...")
+    media_key = payload.get("media_key") or cache_key(url)
     
-    # Check if httpx is available
-    if httpx is None:
-        raise Exception("httpx is not installed. Please run: pip install httpx")
+    log.info(f"[{self.request.id}] Starting stream download: {media_key} ({url})")
+    update_task_progress("starting", 0.0, message="Extracting stream info...")
     
     try:
-        # Extract info to get direct URL
-        info = extract_info(url)
+        # Reuse the /info extraction via its cache handle; only re-extracts if URLs expired
+        _, snaps = resolve_formats(url, [format_id], media_key, refresh=payload.get("refresh_urls", False))
         
-        # Find the target format
-        target_format = None
-        for fmt in info.get("formats", []):
-            if str(fmt.get("format_id")) == str(format_id):
-                # Ensure it's progressive (has both video and audio)
-                vcodec = str(fmt.get("vcodec", "none"))
-                acodec = str(fmt.get("acodec", "none"))
-                if vcodec != "none" and acodec != "none":
-                    target_format = fmt
-                    break
+        # Find the target format, ensuring it's progressive (has both video and audio)
+        target_format = snaps.get(str(format_id))
+        if target_format and (target_format["vcodec"] == "none" or target_format["acodec"] == "none"):
+            target_format = None
         
         if not target_format:
             raise Exception(f"Progressive format {format_id} not found")
@@ -127,8 +159,8 @@ def stream_download(self, payload: Dict[str, Any]) -> Dict[str, Any]:
             raise Exception("No direct URL available")
         
         # Get file info
-        ext = target_format.get("ext", "mp4")
-        filesize = target_format.get("filesize") or target_format.get("filesize_approx", 0)
+        ext = target_format.get("ext") or "mp4"
+        filesize = target_format.get("filesize") or 0
         
         update_task_progress("downloading", 0.1, 
                            message="Starting download...", 
@@ -137,45 +169,31 @@ def stream_download(self, payload: Dict[str, Any]) -> Dict[str, Any]:
         # Stream download with progress
         output_path = tmp_path(f"{safe_title}-{uid}.{ext}")
         
-        downloaded_bytes = 0
-        chunk_size = 1024 * 1024  # 1MB chunks
         start_time = time.time()
-        last_update_time = start_time
         
-        with httpx.stream("GET", direct_url, timeout=60.0) as response:
-            response.raise_for_status()
-            
-            # Get actual content length if not provided
-            if not filesize:
-                filesize = int(response.headers.get("content-length", 0))
-                update_task_progress("downloading", 0.1, total_bytes=filesize)
-            
-            with open(output_path, "wb") as f:
-                for chunk in response.iter_bytes(chunk_size=chunk_size):
-                    f.write(chunk)
-                    downloaded_bytes += len(chunk)
-                    
-                    # Only update progress every 2 seconds or every 5% to avoid spam
-                    current_time = time.time()
-                    if filesize > 0:
-                        progress = 0.1 + 0.8 * (downloaded_bytes / filesize)
-                        
-                        # Update every 2 seconds or every 5% progress
-                        if (current_time - last_update_time >= 2.0) or (progress >= 0.95):
-                            elapsed_time = max(1, current_time - start_time)
-                            speed_mbps = (downloaded_bytes / (1024*1024)) / elapsed_time
-                            
-                            update_task_progress("downloading", progress,
-                                               downloaded_bytes=downloaded_bytes,
-                                               total_bytes=filesize,
-                                               speed_mbps=round(speed_mbps, 2))
-                            last_update_time = current_time
+        def on_progress(downloaded_bytes: int, total: Optional[int]):
+            nonlocal filesize
+            if not filesize and total:
+                filesize = total
+            if filesize > 0:
+                # Called per chunk; the task's emitter coalesces these
+                elapsed_time = max(1, time.time() - start_time)
+                update_task_progress("downloading", 0.1 + 0.8 * (downloaded_bytes / filesize),
+                                   downloaded_bytes=downloaded_bytes,
+                                   total_bytes=filesize,
+                                   speed_mbps=round((downloaded_bytes / (1024*1024)) / elapsed_time, 2))
+        
+        # Several ranged connections written in place; falls back to one GET if ranges are refused
+        checkpoint = checkpoints.Checkpoint(self.request.id)
+        download_to_file(direct_url, target_format["http_headers"], output_path, on_progress,
+                         checkpoint=checkpoint)
         
         # Move to storage
         update_task_progress("finalizing", 0.95, message="Moving to storage...")
         final_name = f"{safe_title}.{ext}"
         final_path = move_into_storage(output_path, final_name)
         final_size = os.path.getsize(final_path)
+        checkpoint.clear()
         
         mime_type = {
             "mp4": "video/mp4",
@@ -193,6 +211,9 @@ def stream_download(self, payload: Dict[str, Any]) -> Dict[str, Any]:
             "method": "stream"
         }
         
+        artifact_index.record(media_key, str(format_id), result)
+        inflight.finish(payload.get("inflight_slot"), self.request.id)
+        
         update_task_progress("completed", 1.0, 
                            message="Download completed",
                            finished=True,
@@ -203,10 +224,25 @@ def stream_download(self, payload: Dict[str, Any]) -> Dict[str, Any]:
         
     except Exception as e:
         log.error(f"[{self.request.id}] Stream download failed: {e}")
-        update_task_progress("failed", message=str(e), failed=True)
+        _retry_or_fail(self, payload, e)
         raise
 
-@celery_app.task(bind=True)
+def _merge_leg(name: str, url: str, format_id: str, snap: Optional[Dict[str, Any]],
+               base_filename: str, info: Dict[str, Any], checkpoint: checkpoints.Checkpoint) -> merge_legs.Leg:
+    """One leg of a merge: ranged engine for plain HTTP formats, yt-dlp for fragmented ones."""
+    from ..services.ytdlp_optimized import download_format
+
+    def run(report, connections: int) -> str:
+        if is_plain_http(snap):
+            path = tmp_path(f"{base_filename}.{snap.get('ext') or 'bin'}")
+            download_to_file(snap["url"], snap["http_headers"], path, report, connections=connections,
+                             checkpoint=checkpoint)
+            return path
+        return download_format(url, format_id, base_filename, info=info, on_bytes=report, connections=connections)
+
+    return merge_legs.Leg(name, run, (snap or {}).get("filesize"))
+
+@celery_app.task(bind=True, max_retries=get_settings().TASK_MAX_RETRIES)
 def download_and_merge(self, payload: Dict[str, Any]) -> Dict[str, Any]:
     """
     Download and merge for formats requiring muxing - simplified and reliable
@@ -216,9 +252,11 @@ def download_and_merge(self, payload: Dict[str, Any]) -> Dict[str, Any]:
     title = payload.get("title", "download").strip() or "download"
     
     safe_title = "".join(c if c.isalnum() or c in " ._-" else "_" for c in title)
-    uid = uuid.uuid4().hex[:8]
+    uid = checkpoints.stable_uid(self.request.id)  # same temp files when the task is redelivered
     
-    log.info(f"[{self.request.id}] Starting merge download: {url}")
+    media_key = payload.get("media_key") or cache_key(url)
+    
+    log.info(f"[{self.request.id}] Starting merge download: {media_key} ({url})")
     update_task_progress("starting", 0.0, message="Extracting info...")
     
     try:
@@ -227,30 +265,56 @@ def download_and_merge(self, payload: Dict[str, Any]) -> Dict[str, Any]:
         
         video_id, audio_id = format_spec.split("+", 1)
         
-        # Use optimized yt-dlp download with better settings
-        from ..services.ytdlp_optimized import download_format
-        
-        # Download video (0-40%)
-        update_task_progress("downloading", 0.0, message="Downloading video...")
-        video_path = download_format(url, video_id, f"{safe_title}-{uid}-video",
-                                   progress_callback=lambda p: update_task_progress("downloading", p * 0.4, part="video"))
-        
-        # Download audio (40-80%)
-        update_task_progress("downloading", 0.4, message="Downloading audio...")
-        audio_path = download_format(url, audio_id, f"{safe_title}-{uid}-audio",
-                                   progress_callback=lambda p: update_task_progress("downloading", 0.4 + p * 0.4, part="audio"))
+        # One extraction (normally the cached /info one) feeds both downloads
+        info, snaps = resolve_formats(url, [video_id, audio_id], media_key,
+                                      refresh=payload.get("refresh_urls", False))
         
-        # Merge (80-100%)
-        update_task_progress("merging", 0.8, message="Merging files...")
-        
-        # Determine best output format
-        container = "mkv"  # Use MKV as default for reliability
+        container = artifact_index.MERGE_CONTAINER  # Use MKV as default for reliability
         output_path = tmp_path(f"{safe_title}-{uid}-final.{container}")
-        
-        merge_simple_reliable(
-            video_path, audio_path, output_path,
-            progress_callback=lambda p: update_task_progress("merging", 0.8 + p * 0.2)
-        )
+        video_path = audio_path = None
+        leg_checkpoints = []
+        method = "merge"
+        
+        # Pipe both formats straight into ffmpeg: only the muxed output touches disk.
+        # A piped merge keeps no checkpoint (ffmpeg cannot resume a half-read pipe), so
+        # retries take the temp-file path, whose legs resume; a crash redelivery starts over
+        if (get_settings().MERGE_MODE == "stream" and stream_merge.supported() and self.request.retries == 0
+                and video_id in snaps and audio_id in snaps):
+            update_task_progress("downloading", 0.0, message="Downloading and merging...")
+            progress = task_progress(self)  # the callback runs on a feeder thread
+            try:
+                stream_merge.merge_streaming(
+                    snaps[video_id], snaps[audio_id], output_path,
+                    progress_callback=lambda p: progress.emit("downloading", p * 0.95, part="merge"),
+                )
+                method = "stream_merge"
+            except stream_merge.StreamMergeError as e:
+                log.warning(f"[{self.request.id}] Streaming merge failed, falling back to temp files: {e}")
+                # The fallback fetches both formats again from byte 0: say so rather than let the bar jump back
+                update_task_progress("fallback", 0.0, message="Streaming merge failed, retrying with temp files",
+                                     downloaded_bytes=0)
+        
+        if method == "merge":
+            # Both legs at once (0-80%), progress weighted by bytes
+            update_task_progress("downloading", 0.0, message="Downloading video and audio...")
+            leg_checkpoints = [checkpoints.Checkpoint(self.request.id, "video"),
+                               checkpoints.Checkpoint(self.request.id, "audio")]
+            paths = merge_legs.download_legs(
+                [_merge_leg("video", url, video_id, snaps.get(video_id), f"{safe_title}-{uid}-video", info,
+                            leg_checkpoints[0]),
+                 _merge_leg("audio", url, audio_id, snaps.get(audio_id), f"{safe_title}-{uid}-audio", info,
+                            leg_checkpoints[1])],
+                on_progress=lambda p, done, total: update_task_progress(
+                    "downloading", p * 0.8, part="video+audio", downloaded_bytes=done, total_bytes=total),
+            )
+            video_path, audio_path = paths["video"], paths["audio"]
+            
+            # Merge (80-100%)
+            update_task_progress("merging", 0.8, message="Merging files...")
+            merge_simple_reliable(
+                video_path, audio_path, output_path,
+                progress_callback=lambda p: update_task_progress("merging", 0.8 + p * 0.2)
+            )
         
         # Finalize
         update_task_progress("finalizing", 0.95, message="Moving to storage...")
@@ -261,10 +325,12 @@ def download_and_merge(self, payload: Dict[str, Any]) -> Dict[str, Any]:
         # Clean up temp files
         for temp_file in [video_path, audio_path]:
             try:
-                if os.path.exists(temp_file):
+                if temp_file and os.path.exists(temp_file):
                     os.remove(temp_file)
             except Exception:
                 pass
+        for checkpoint in leg_checkpoints:
+            checkpoint.clear()
         
         mime_type = "video/x-matroska"
         
@@ -273,9 +339,12 @@ def download_and_merge(self, payload: Dict[str, Any]) -> Dict[str, Any]:
             "file_name": final_name,
             "mime": mime_type,
             "size_bytes": final_size,
-            "method": "merge"
+            "method": method
         }
         
+        artifact_index.record(media_key, format_spec, result)
+        inflight.finish(payload.get("inflight_slot"), self.request.id)
+        
         update_task_progress("completed", 1.0, 
                            message="Download and merge completed",
                            finished=True,
@@ -286,5 +355,5 @@ def download_and_merge(self, payload: Dict[str, Any]) -> Dict[str, Any]:
         
     except Exception as e:
         log.error(f"[{self.request.id}] Merge download failed: {e}")
-        update_task_progress("failed", message=str(e), failed=True)
+        _retry_or_fail(self, payload, e)
         raise
\ No newline at end of file
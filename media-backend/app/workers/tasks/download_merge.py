@@ -1,14 +1,17 @@
 ﻿# app/workers/tasks/download_merge.py
 
-import os, uuid, time
-from typing import Dict, Any, Optional
+import json, os, uuid
+from typing import Callable, Dict, Any, Optional
 from rq import get_current_job
 import yt_dlp
 
 from ...core.logging import get_logger
 from ...services.storage_local import tmp_path, move_into_storage
 from ...services.ffmpeg_service import merge_with_progress_copy, ffprobe_basic
-from ...services.redis_conn import get_redis  # if you use pubsub in _publish
+from ...services.ytdlp_cache import apply_cache_opts
+from ...services import merge_legs, retry_policy
+from ...services.checkpoints import stable_uid
+from ...services.progress import ProgressEmitter
 
 log = get_logger(__name__)
 
@@ -26,6 +29,27 @@ def _guess_mime_from_ext(ext: str) -> str:
     }.get(ext, "application/octet-stream")
 
 
+# Emitters of the jobs running in this process, by job id
+_emitters: Dict[str, ProgressEmitter] = {}
+
+
+def _job_emitter(job) -> ProgressEmitter:
+    emitter = _emitters.get(job.id)
+    if emitter is not None and not emitter.closed:
+        return emitter
+
+    def sink(pipe, status, progress, fields, terminal):
+        # Same write as job.save_meta(), queued with the pubsub update (WebSocket clients)
+        pipe.hset(job.key, "meta", job.serializer.dumps(job.meta))
+        pipe.publish(f"jobs:{job.id}", json.dumps({"id": job.id, **job.meta}, default=str))
+        if terminal:
+            _emitters.pop(job.id, None)
+
+    emitter = ProgressEmitter(job.id, sink, terminal_states=("finished", "failed"))
+    _emitters[job.id] = emitter
+    return emitter
+
+
 def _set_meta(*, status: Optional[str] = None, progress01: Optional[float] = None,
               message: Optional[str] = None, **extras):
     job = get_current_job()
@@ -39,22 +63,19 @@ def _set_meta(*, status: Optional[str] = None, progress01: Optional[float] = Non
     m["finished"] = (m.get("status") == "finished")
     m["failed"]   = (m.get("status") == "failed")
     job.meta = m
-    job.save_meta()
-    
-    # Publish to Redis pubsub for WebSocket updates
-    try:
-        import json
-        redis_client = get_redis()
-        channel = f"jobs:{job.id}"
-        payload = {"id": job.id, **m}
-        redis_client.publish(channel, json.dumps(payload))
-    except Exception as e:
-        log.warning(f"Failed to publish progress to Redis: {e}")
+    # job.meta always holds the latest values; the emitter decides when they are written
+    _job_emitter(job).emit(m.get("status") or "queued", m.get("progress01"))
 
 
-def _ydl_download(url: str, fmt: str, outpath_noext: str, part: str, base: float, span: float) -> str:
+def _ydl_download(url: str, fmt: str, outpath_noext: str, part: str, base: float = 0.0, span: float = 1.0,
+                  on_bytes: Optional[Callable[[int, Optional[int]], None]] = None,
+                  connections: Optional[int] = None) -> str:
     def progress_hook(d):
-        if d.get("status") == "downloading":
+        if d.get("status") == "downloading" and on_bytes:
+            # concurrent leg: the caller aggregates progress (and may abort us by raising)
+            total = d.get("total_bytes") or d.get("total_bytes_estimate")
+            on_bytes(int(d.get("downloaded_bytes") or 0), int(total) if total else None)
+        elif d.get("status") == "downloading":
             try:
                 downloaded = int(d.get("downloaded_bytes") or 0)
                 total      = int(d.get("total_bytes") or d.get("total_bytes_estimate") or 0)
@@ -91,7 +112,7 @@ def _ydl_download(url: str, fmt: str, outpath_noext: str, part: str, base: float
         
         # HTTP configurations for better reliability
         "http_chunk_size": 10485760,  # 10MB chunks
-        "concurrent_fragment_downloads": 1,  # Conservative for stability
+        "concurrent_fragment_downloads": connections or 1,  # Conservative for stability
         
         # Additional reliability options
         "continue_dl": True,  # Resume partial downloads
@@ -111,41 +132,12 @@ def _ydl_download(url: str, fmt: str, outpath_noext: str, part: str, base: float
             "Upgrade-Insecure-Requests": "1",
         }
     }
-    # Implement exponential backoff retry logic
-    max_retries = 3
-    base_delay = 2  # seconds
+    apply_cache_opts(ydl_opts)
     
-    for attempt in range(max_retries):
-        try:
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=True)
-                return ydl.prepare_filename(info)
-        except Exception as e:
-            error_msg = str(e).lower()
-            
-            # Check if this is a timeout or network-related error
-            if any(keyword in error_msg for keyword in [
-                'timeout', 'timed out', 'connection', 'network', 
-                'temporary failure', 'read operation', 'socket'
-            ]):
-                if attempt < max_retries - 1:  # Not the last attempt
-                    delay = base_delay * (2 ** attempt)  # Exponential backoff
-                    log.warning(f"Network error on attempt {attempt + 1}/{max_retries}: {e}. Retrying in {delay}s...")
-                    _set_meta(
-                        status="retrying", 
-                        message=f"Network error, retrying in {delay}s... (attempt {attempt + 1}/{max_retries})",
-                        retryAttempt=attempt + 1,
-                        maxRetries=max_retries
-                    )
-                    time.sleep(delay)
-                    continue
-                else:
-                    log.error(f"All retry attempts failed. Final error: {e}")
-                    raise
-            else:
-                # Non-network error, don't retry
-                log.error(f"Non-recoverable error: {e}")
-                raise
+    # One attempt: RQ jobs are enqueued without a Retry, so a failure here fails the job
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        info = ydl.extract_info(url, download=True)
+        return ydl.prepare_filename(info)
 
 
 def download_and_merge(payload: Dict[str, Any]) -> Dict[str, Any]:
@@ -162,10 +154,11 @@ def download_and_merge(payload: Dict[str, Any]) -> Dict[str, Any]:
     hint_ext: Optional[str] = payload.get("ext")
 
     safe_title = "".join(c if c.isalnum() or c in " ._-" else "_" for c in title)
-    uid = uuid.uuid4().hex[:8]
 
     job = get_current_job()
     jid = job.id if job else "unknown"
+    # Stable temp names per job: a re-run lets yt-dlp continue its .part files (continue_dl)
+    uid = stable_uid(job.id) if job else uuid.uuid4().hex[:8]
     log.info("[job %s] enqueue payload url=%s fmt=%s title=%s", jid, url, fmt, title)
 
     try:
@@ -177,9 +170,18 @@ def download_and_merge(payload: Dict[str, Any]) -> Dict[str, Any]:
             v_tmp_base = tmp_path(f"{safe_title}-{uid}-v")
             a_tmp_base = tmp_path(f"{safe_title}-{uid}-a")
 
-            # video contributes 0..80%, audio 80..90%
-            v_path = _ydl_download(url, v_id, v_tmp_base, part="video", base=0.00, span=0.80)
-            a_path = _ydl_download(url, a_id, a_tmp_base, part="audio", base=0.80, span=0.10)
+            # both legs download together and contribute 0..90%, weighted by bytes
+            def leg(fmt_id: str, base_path: str, part: str) -> merge_legs.Leg:
+                return merge_legs.Leg(part, lambda report, conns: _ydl_download(
+                    url, fmt_id, base_path, part=part, on_bytes=report, connections=conns))
+
+            def on_legs_progress(p01: float, done: int, total: int):
+                _set_meta(status="downloading", progress01=0.90 * p01, part="video+audio",
+                          downloadedBytes=done, totalBytes=(total or None))
+
+            paths = merge_legs.download_legs([leg(v_id, v_tmp_base, "video"), leg(a_id, a_tmp_base, "audio")],
+                                             on_progress=on_legs_progress)
+            v_path, a_path = paths["video"], paths["audio"]
 
             # Probe the video to decide the safest target container
             vprobe = ffprobe_basic(v_path)
@@ -270,5 +272,8 @@ def download_and_merge(payload: Dict[str, Any]) -> Dict[str, Any]:
 
     except Exception as e:
         log.exception("[job %s] download_and_merge failed: %s", jid, e)
-        _set_meta(status="failed", message=str(e))
+        _set_meta(status="failed", message=str(e), errorClass=retry_policy.classify(e).kind)
         raise
+    finally:
+        # a job cut short (JobTimeoutException, crash) never sent its terminal update
+        _emitters.pop(jid, None)
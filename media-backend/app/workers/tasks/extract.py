@@ -1,8 +1,31 @@
-﻿# placeholder for extract task
-# def extract_info_task(url: str): ...
+# app/workers/tasks/extract.py
 from typing import Dict, Any
+from ...core.celery_app import celery_app
+from ...core.logging import get_logger
+from ...services import info_cache
+from ...services.extract_guard import ExtractionBlocked
+from ...services.url_canon import cache_key
 from ...services.ytdlp_service import extract_info
 
-def extract_metadata(url: str) -> Dict[str, Any]:
-    """Simple wrapper so you can enqueue if needed."""
-    return extract_info(url)
+log = get_logger(__name__)
+
+
+@celery_app.task(bind=True)
+def extract_metadata(self, url: str) -> Dict[str, Any]:
+    """
+    Run (or join) the extraction for a URL on the dedicated "extract" queue.
+    The info dict travels through the shared metadata cache, not the result
+    backend; it is only inlined when it is too short-lived to be cached.
+    A refused extraction comes back as {"blocked": ...} rather than an
+    exception, whose fields the JSON result backend would drop.
+    """
+    key = cache_key(url)
+    try:
+        info = extract_info(url)
+    except ExtractionBlocked as e:
+        log.info(f"[{self.request.id}] extraction of {key} blocked: {e.kind}")
+        return {"key": key, "blocked": e.as_dict()}
+    log.info(f"[{self.request.id}] extracted {key}")
+    if info_cache.ttl_for(info) > 0:
+        return {"key": key}
+    return {"key": key, "info": info}
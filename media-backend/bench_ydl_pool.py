@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark: per-call YoutubeDL setup cost, fresh instance vs pooled.
+No network access; measures only construction / checkout overhead.
+Run with: python bench_ydl_pool.py [iterations]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+# Add current directory to Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import yt_dlp
+from app.services.ytdlp_service import _INFO_OPTS, pooled_ydl
+from app.services.ytdlp_cache import apply_cache_opts
+
+
+def bench(label, fn, n):
+    fn()  # first call pays imports / pool fill
+    t0 = time.perf_counter()
+    for _ in range(n):
+        fn()
+    per_call = (time.perf_counter() - t0) / n * 1000.0
+    print(f"{label:<28} {per_call:8.3f} ms/call")
+    return per_call
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    # Work on a copy: YoutubeDL.close() writes the cookie jar back
+    tmpdir = tempfile.mkdtemp()
+    cookiefile = os.path.join(tmpdir, "youtube.txt")
+    shutil.copy(os.path.join(os.path.dirname(os.path.abspath(__file__)), "cookies", "youtube.txt"), cookiefile)
+
+    def fresh():
+        opts = apply_cache_opts(dict(_INFO_OPTS, cookiefile=cookiefile))
+        with yt_dlp.YoutubeDL(opts) as ydl:
+            ydl.cookiejar  # cookies are parsed on first use
+
+    def pooled():
+        with pooled_ydl("info", _INFO_OPTS, cookiefile) as ydl:
+            ydl.cookiejar
+
+    try:
+        before = bench("fresh YoutubeDL per call", fresh, n)
+        after = bench("pooled checkout/return", pooled, n)
+        print(f"speedup: {before / after:.0f}x")
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
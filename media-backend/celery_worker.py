@@ -2,6 +2,7 @@
 """
 Celery Worker Entry Point
 Run with: celery -A celery_worker worker --loglevel=info --queues=downloads,streams
+Extraction: celery -A celery_worker worker --loglevel=info --queues=extract -n extract@%h --concurrency=4
 """
 import os
 import sys
@@ -22,4 +22,5 @@ echo "   ./start_development.sh"
 echo
 echo "Or manually:"
 echo "   python start_server.py              # In one terminal"
-echo "   celery -A celery_worker worker --loglevel=info --queues=downloads,streams  # In another terminal"
\ No newline at end of file
+echo "   celery -A celery_worker worker --loglevel=info --queues=downloads,streams  # In another terminal"
+echo "   celery -A celery_worker worker --loglevel=info --queues=extract -n extract@%h  # Extraction workers"
@@ -15,6 +15,10 @@ echo.
 echo Starting Celery Worker...
 start "Celery Worker" cmd /k "celery -A celery_worker worker --loglevel=info --queues=downloads,streams --pool=solo"
 
+echo Starting Celery extract worker...
+if not defined EXTRACT_CONCURRENCY set EXTRACT_CONCURRENCY=4
+start "Celery Extract Worker" cmd /k "celery -A celery_worker worker --loglevel=info --queues=extract -n extract@%%h --pool=threads --concurrency=%EXTRACT_CONCURRENCY%"
+
 echo Waiting 5 seconds for worker to start...
 timeout /t 5 /nobreak >nul
 
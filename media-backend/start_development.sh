@@ -39,6 +39,9 @@ echo
 echo "🔄 Starting Celery Worker in background..."
 celery -A celery_worker worker --loglevel=info --queues=downloads,streams --detach
 
+echo "🔎 Starting Celery extract worker in background..."
+celery -A celery_worker worker --loglevel=info --queues=extract -n extract@%h --concurrency=${EXTRACT_CONCURRENCY:-4} --detach
+
 echo "⏳ Waiting 3 seconds for worker to start..."
 sleep 3
 
@@ -68,6 +68,7 @@ if __name__ == "__main__":
         print("\n🎉 All tests passed! You can now start the server:")
         print("   python start_server.py")
         print("   celery -A celery_worker worker --loglevel=info --queues=downloads,streams")
+        print("   celery -A celery_worker worker --loglevel=info --queues=extract -n extract@%h")
     else:
         print("\n❌ Some tests failed. Check the errors above.")
         sys.exit(1)
\ No newline at end of file
@@ -0,0 +1,55 @@
+import fakeredis
+import pytest
+import redis
+
+from app.services import artifact_index, redis_conn
+
+MEDIA = "youtube:abc"
+
+
+@pytest.fixture
+def r(monkeypatch):
+    r = fakeredis.FakeRedis()
+    monkeypatch.setattr(artifact_index, "get_redis", lambda: r)
+    monkeypatch.setattr(redis_conn, "get_redis", lambda: r)  # shared metrics
+    return r
+
+
+@pytest.fixture
+def artifact(r, tmp_path):
+    path = tmp_path / "video.mkv"
+    path.write_bytes(b"x" * 1000)
+    artifact_index.record(MEDIA, "137+140", {"path": str(path), "file_name": "video.mkv",
+                                             "mime": "video/x-matroska", "method": "merge"})
+    return path
+
+
+def test_hit_returns_the_recorded_artifact(r, artifact):
+    r.expire(artifact_index._key(MEDIA, "137+140"), 10)
+    hit = artifact_index.lookup(MEDIA, "137+140")
+    assert hit == {"path": str(artifact), "file_name": "video.mkv", "mime": "video/x-matroska",
+                   "size_bytes": 1000, "method": "merge"}
+    # A hit refreshes the entry's TTL
+    assert r.ttl(artifact_index._key(MEDIA, "137+140")) > 10
+    assert artifact_index.lookup(MEDIA, "137") is None
+
+
+def test_entry_whose_file_is_gone_is_dropped(r, artifact):
+    artifact.unlink()
+    assert artifact_index.lookup(MEDIA, "137+140") is None
+    assert not r.exists(artifact_index._key(MEDIA, "137+140"))
+
+
+def test_redis_failures_are_a_miss(r, artifact, monkeypatch):
+    def down(*args, **kwargs):
+        raise redis.ConnectionError("Connection refused")
+
+    # Connection lost after the entry was read
+    monkeypatch.setattr(r, "expire", down)
+    assert artifact_index.lookup(MEDIA, "137+140") is None
+    artifact.unlink()
+    monkeypatch.setattr(r, "delete", down)
+    assert artifact_index.lookup(MEDIA, "137+140") is None
+    # Redis down altogether
+    monkeypatch.setattr(artifact_index, "get_redis", down)
+    assert artifact_index.lookup(MEDIA, "137+140") is None
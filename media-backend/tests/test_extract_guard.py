@@ -0,0 +1,106 @@
+import fakeredis
+import pytest
+
+from app.services import extract_guard, redis_conn
+from app.services.extract_guard import ExtractionBlocked
+
+URL = "https://www.youtube.com/watch?v=dQw4w9WgXcQ"
+OTHER = "https://www.youtube.com/watch?v=9bZkp7q19f0"
+
+
+@pytest.fixture
+def r(monkeypatch):
+    r = fakeredis.FakeRedis()
+    monkeypatch.setattr(extract_guard, "get_redis", lambda: r)
+    monkeypatch.setattr(redis_conn, "get_redis", lambda: r)  # shared metrics
+    settings = extract_guard.get_settings()
+    monkeypatch.setattr(settings, "BREAKER_MIN_REQUESTS", 4)
+    monkeypatch.setattr(settings, "BREAKER_ERROR_RATE", 0.5)
+    monkeypatch.setattr(settings, "BREAKER_COOLDOWN", 60)
+    return r
+
+
+def _blocked(url, probe=True):
+    with pytest.raises(ExtractionBlocked) as e:
+        extract_guard.check(url, probe=probe)
+    return e.value
+
+
+def _end_cooldown(r):
+    # Stands in for the open marker's TTL running out
+    r.delete(extract_guard.OPEN_PREFIX + "youtube")
+
+
+@pytest.mark.parametrize("message, kind, ttl", [
+    ("ERROR: Private video", "unavailable", 3600),
+    ("The uploader has not made this video available in your country", "geo_blocked", 3600),
+    ("Unsupported URL: https://example.com", "unsupported", 86400),
+    ("HTTP Error 429: Too Many Requests", "rate_limited", 60),
+    ("Sign in to confirm you're not a bot", "bot_check", 120),
+    ("Read timed out", "network", 15),
+    ("something odd", "error", 30),
+])
+def test_failures_are_negative_cached_per_error_class(r, message, kind, ttl):
+    assert extract_guard.record_failure(URL, RuntimeError(message)).kind == kind
+    blocked = _blocked(URL)
+    assert blocked.kind == kind and str(blocked) == message
+    assert ttl - 2 <= blocked.retry_after <= ttl
+    extract_guard.check(OTHER)  # other videos are unaffected by one negative entry
+
+
+def test_breaker_opens_after_the_threshold(r):
+    extract_guard.record_success(OTHER)
+    extract_guard.record_failure(URL, RuntimeError("HTTP Error 429"))
+    extract_guard.check(OTHER)  # 1/2 failures, below the minimum request count
+    extract_guard.record_failure(URL, RuntimeError("HTTP Error 429"))
+    extract_guard.check(OTHER)
+    # Video-level failures do not count towards the breaker
+    extract_guard.record_failure(URL, RuntimeError("Video unavailable"))
+    extract_guard.check(OTHER)
+
+    extract_guard.record_failure(URL, RuntimeError("HTTP Error 429"))  # 3/4
+    blocked = _blocked(OTHER)
+    assert blocked.kind == "circuit_open"
+    assert 55 <= blocked.retry_after <= 60
+
+
+def _open_breaker():
+    for _ in range(4):
+        extract_guard.record_failure(URL, RuntimeError("HTTP Error 429"))
+    assert _blocked(OTHER).kind == "circuit_open"
+
+
+def test_breaker_is_half_open_after_the_cooldown_and_admits_one_probe(r):
+    _open_breaker()
+    _end_cooldown(r)
+
+    extract_guard.check(OTHER, probe=False)  # only looks: the worker it hands off to probes
+    assert not r.exists(extract_guard.PROBE_PREFIX + "youtube")
+    extract_guard.check(OTHER)  # the first real caller becomes the probe
+    assert r.exists(extract_guard.PROBE_PREFIX + "youtube")
+    assert _blocked(OTHER).kind == "circuit_open"
+    assert _blocked(OTHER, probe=False).kind == "circuit_open"
+    assert _blocked("https://youtu.be/abcdefghijk").kind == "circuit_open"
+
+
+def test_successful_probe_closes_the_breaker(r):
+    _open_breaker()
+    _end_cooldown(r)
+    extract_guard.check(OTHER)
+
+    extract_guard.record_success(OTHER)
+    assert not r.exists(extract_guard.HALF_OPEN_PREFIX + "youtube")
+    extract_guard.check(OTHER)
+    extract_guard.check("https://youtu.be/abcdefghijk")
+    # The window's old failures were cleared: one more does not reopen it
+    extract_guard.record_failure(URL, RuntimeError("HTTP Error 429"))
+    extract_guard.check(OTHER)
+
+
+def test_failed_probe_reopens_the_breaker(r):
+    _open_breaker()
+    _end_cooldown(r)
+    extract_guard.check(OTHER)
+
+    extract_guard.record_failure(OTHER, RuntimeError("HTTP Error 429"))
+    assert _blocked("https://youtu.be/abcdefghijk").retry_after > 5
@@ -0,0 +1,30 @@
+import asyncio
+
+from app.services import http_pool
+
+
+async def _serve(reader, writer):
+    await reader.readuntil(b"\r\n\r\n")
+    writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\nConnection: close\r\n\r\nok")
+    await writer.drain()
+    writer.close()
+
+
+def test_new_connections_reuse_the_cached_address():
+    async def run():
+        server = await asyncio.start_server(_serve, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        client, transport = http_pool.create_client(http2=False)
+        try:
+            for _ in range(2):
+                # Connection: close, so each request opens a new connection
+                r = await client.get(f"http://localhost:{port}/")
+                assert r.text == "ok"
+        finally:
+            await client.aclose()
+            server.close()
+            await server.wait_closed()
+        return transport.dns
+
+    dns = asyncio.run(run())
+    assert (dns.misses, dns.hits) == (1, 1)
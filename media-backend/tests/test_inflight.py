@@ -0,0 +1,87 @@
+import fakeredis
+import pytest
+
+from app.services import inflight, redis_conn
+
+MEDIA, FORMAT = "youtube:abc", "137+140"
+
+
+class _Result:
+    """Stands in for celery's AsyncResult."""
+
+    def __init__(self, task_id, done=False):
+        self.id = task_id
+        self.done = done
+        self.revoked = False
+
+    def ready(self):
+        return self.done
+
+    def revoke(self, terminate=False):
+        self.revoked = True
+
+
+@pytest.fixture
+def tasks(monkeypatch):
+    r = fakeredis.FakeRedis()
+    monkeypatch.setattr(inflight, "get_redis", lambda: r)
+    monkeypatch.setattr(redis_conn, "get_redis", lambda: r)  # shared metrics
+    results = {}
+
+    def start(task_id, slot):
+        results[task_id] = _Result(task_id)
+        results[task_id].slot = slot
+        return results[task_id]
+
+    def join():
+        return inflight.join_or_start(MEDIA, FORMAT, start, lambda task_id: results[task_id])
+
+    return r, results, join
+
+
+def test_second_request_joins_the_running_task(tasks):
+    r, results, join = tasks
+    first, joined = join()
+    assert not joined and first.slot == inflight.slot_key(MEDIA, FORMAT)
+    second, joined = join()
+    assert joined and second is first and len(results) == 1
+    assert int(r.hget(inflight.TASK_PREFIX + first.id, "refs")) == 2
+
+
+def test_release_keeps_the_job_while_others_wait(tasks):
+    r, _, join = tasks
+    task, _ = join()
+    join()
+    assert inflight.release(task) == (1, False)
+    assert not task.revoked
+    assert r.get(inflight.slot_key(MEDIA, FORMAT)).decode() == task.id
+    assert r.exists(inflight.TASK_PREFIX + task.id)
+
+
+def test_last_release_revokes_and_clears_the_slot(tasks):
+    r, _, join = tasks
+    task, _ = join()
+    join()
+    inflight.release(task)
+    assert inflight.release(task) == (0, True)
+    assert task.revoked
+    assert not r.exists(inflight.slot_key(MEDIA, FORMAT), inflight.TASK_PREFIX + task.id)
+    # Already gone: nothing left to drop
+    assert inflight.release(task) == (0, False)
+
+
+def test_finished_job_clears_its_slot(tasks):
+    r, _, join = tasks
+    task, _ = join()
+    inflight.finish(task.slot, task.id)
+    assert not r.exists(inflight.slot_key(MEDIA, FORMAT), inflight.TASK_PREFIX + task.id)
+    assert join()[0] is not task
+
+
+def test_stale_slot_of_a_finished_task_is_replaced(tasks):
+    r, results, join = tasks
+    stale, _ = join()
+    stale.done = True  # ended without calling finish()
+    task, joined = join()
+    assert not joined and task is not stale and len(results) == 2
+    assert r.get(inflight.slot_key(MEDIA, FORMAT)).decode() == task.id
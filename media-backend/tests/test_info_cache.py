@@ -0,0 +1,36 @@
+import time
+from app.services import ytdlp_service
+from app.services.info_cache import url_expiry, ttl_for
+
+
+def test_url_expiry_parses_signed_urls():
+    assert url_expiry("https://r1.googlevideo.com/videoplayback?expire=1700000000&ip=1") == 1700000000
+    assert url_expiry("https://scontent.cdninstagram.com/v.mp4?oe=6523ABCD") == 0x6523ABCD
+    assert url_expiry("https://example.com/video.mp4") is None
+
+
+def test_ttl_follows_earliest_format_expiry():
+    now = time.time()
+    info = {"formats": [
+        {"url": f"https://a.googlevideo.com/x?expire={int(now + 7200)}"},
+        {"url": f"https://b.googlevideo.com/x?expire={int(now + 3600)}"},
+    ]}
+    assert 3000 < ttl_for(info) <= 3300
+    assert ttl_for({"formats": [{"url": f"https://a/x?expire={int(now + 60)}"}]}) == 0
+
+
+def test_refresh_resolves_fresh_urls_despite_a_valid_cached_extraction(monkeypatch):
+    valid = int(time.time() + 3600)
+    cached = {"formats": [{"format_id": "18", "url": f"https://a.googlevideo.com/old?expire={valid}"}]}
+    fresh = {"formats": [{"format_id": "18", "url": f"https://a.googlevideo.com/new?expire={valid}"}]}
+    calls = []
+    monkeypatch.setattr(ytdlp_service.info_cache, "get", lambda key: cached)
+    monkeypatch.setattr(ytdlp_service.info_cache, "invalidate", lambda key: calls.append(("invalidate", key)))
+    monkeypatch.setattr(ytdlp_service, "extract_info",
+                        lambda url, use_cache=True: calls.append(("extract", use_cache)) or fresh)
+
+    assert ytdlp_service.resolve_formats("u", ["18"], "k")[1]["18"]["url"].endswith("/old?expire=%d" % valid)
+    assert not calls
+    assert ytdlp_service.resolve_formats("u", ["18"], "k", refresh=True)[1]["18"]["url"].endswith(
+        "/new?expire=%d" % valid)
+    assert calls == [("invalidate", "k"), ("extract", False)]
@@ -0,0 +1,82 @@
+import asyncio
+import threading
+
+import pytest
+from celery.exceptions import TimeoutError as CeleryTimeoutError
+
+from app.services import job_queue
+from app.services.extract_guard import ExtractionBlocked
+
+INFO = {"id": "abc", "title": "t", "formats": []}
+
+
+class _Task:
+    """Stands in for the AsyncResult of an extract task."""
+
+    def __init__(self, outcome):
+        self.outcome = outcome
+        self.threads = set()
+        self.calls = []
+
+    def _on(self, name):
+        self.threads.add(threading.get_ident())
+        self.calls.append(name)
+
+    def get(self, timeout, propagate):
+        self._on("get")
+        if isinstance(self.outcome, BaseException):
+            raise self.outcome
+        return self.outcome
+
+    def revoke(self):
+        self._on("revoke")
+
+    def forget(self):
+        self._on("forget")
+
+
+@pytest.fixture
+def extract(monkeypatch):
+    cache, tasks = {}, []
+    settings = job_queue.get_settings()
+    monkeypatch.setattr(settings, "EXTRACT_MODE", "celery")
+    # a miss until the worker has run, like a cold /info
+    monkeypatch.setattr(job_queue.info_cache, "get", lambda key: cache.get(key) if tasks[-1].calls else None)
+    monkeypatch.setattr(job_queue.extract_guard, "check", lambda url, probe=True: None)
+    monkeypatch.setattr(job_queue, "extract_info", lambda url: pytest.fail("extracted in the API process"))
+
+    def run(outcome):
+        task = _Task(outcome)
+        tasks.append(task)
+        sent = []
+        monkeypatch.setattr(job_queue, "enqueue_extract", lambda url: sent.append(threading.get_ident()) or task)
+        try:
+            return asyncio.run(job_queue.fetch_info("https://www.youtube.com/watch?v=abc"))
+        finally:
+            # the result is consumed by the thread that sent the task
+            assert task.threads <= set(sent)
+
+    return run, cache, tasks
+
+
+def test_result_key_is_read_from_the_info_cache(extract):
+    run, cache, tasks = extract
+    key = job_queue.cache_key("https://www.youtube.com/watch?v=abc")
+    cache[key] = INFO
+    assert run({"key": key}) == INFO
+    assert tasks[-1].calls == ["get", "forget"]
+
+
+def test_blocked_payload_is_raised_again(extract):
+    run, _, _ = extract
+    blocked = ExtractionBlocked("breaker open", "rate_limited", 42)
+    with pytest.raises(ExtractionBlocked) as e:
+        run({"key": "youtube:abc", "blocked": blocked.as_dict()})
+    assert e.value.kind == "rate_limited" and e.value.retry_after == 42
+
+
+def test_timeout_revokes_the_task(extract):
+    run, _, tasks = extract
+    with pytest.raises(TimeoutError):
+        run(CeleryTimeoutError("no answer"))
+    assert tasks[-1].calls == ["get", "revoke"]
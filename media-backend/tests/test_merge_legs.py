@@ -0,0 +1,53 @@
+import threading
+import time
+
+import pytest
+
+from app.services import merge_legs
+from app.services.merge_legs import Leg, download_legs, split_connections
+
+
+def test_split_connections_by_size():
+    legs = [Leg("video", None, 90), Leg("audio", None, 10)]
+    assert split_connections(legs, 6) == [5, 1]
+    assert split_connections(legs, 1) == [1, 1]
+    assert sum(split_connections([Leg("a", None), Leg("b", None)], 6)) == 6
+
+
+def test_legs_run_concurrently_with_byte_weighted_progress(monkeypatch):
+    monkeypatch.setattr(merge_legs, "PROGRESS_INTERVAL", 0.01)
+    started = threading.Barrier(2, timeout=2)  # both legs must be running at once
+
+    def leg(name, size):
+        def run(report, connections):
+            started.wait()
+            for done in range(0, size + 1, size // 4):
+                report(done, size)
+                time.sleep(0.01)
+            return f"/tmp/{name}"
+        return Leg(name, run, size)
+
+    seen = []
+    paths = download_legs([leg("video", 300), leg("audio", 100)], on_progress=lambda p, d, t: seen.append((p, t)))
+    assert paths == {"video": "/tmp/video", "audio": "/tmp/audio"}
+    assert seen[-1] == (1.0, 400)
+
+
+def test_failed_leg_cancels_the_other(monkeypatch):
+    monkeypatch.setattr(merge_legs, "PROGRESS_INTERVAL", 0.01)
+    reports = []
+
+    def slow(report, connections):
+        for i in range(500):
+            report(i, 500)
+            reports.append(i)
+            time.sleep(0.01)
+        return "/tmp/slow"
+
+    def broken(report, connections):
+        time.sleep(0.05)
+        raise OSError("upstream 403")
+
+    with pytest.raises(OSError, match="403"):
+        download_legs([Leg("video", slow), Leg("audio", broken)])
+    assert len(reports) < 100
@@ -0,0 +1,95 @@
+import fakeredis
+import pytest
+
+from app.core import metrics
+from app.services import job_queue, progress
+
+
+@pytest.fixture
+def emitter(monkeypatch):
+    r = fakeredis.FakeRedis()
+    monkeypatch.setattr(progress, "get_redis", lambda: r)
+    clock = [1000.0]
+    monkeypatch.setattr(progress.time, "monotonic", lambda: clock[0])
+    writes = []
+
+    def sink(pipe, status, p, fields, terminal):
+        writes.append((status, p, fields, terminal))
+        pipe.publish("tasks:t1", status)
+
+    e = progress.ProgressEmitter("t1", sink)
+    e.min_interval, e.min_delta, e.heartbeat = 0.5, 0.01, 5.0
+    return e, writes, clock, r
+
+
+def test_updates_are_coalesced_by_time_and_delta(emitter):
+    e, writes, clock, _ = emitter
+    assert e.emit("downloading", 0.10)
+    assert not e.emit("downloading", 0.20, downloaded_bytes=20)  # too soon
+    clock[0] += 1
+    assert not e.emit("downloading", 0.105)  # moved less than the delta
+    assert e.emit("downloading", 0.30, speed_mbps=1.5)
+    # the skipped update's fields ride along with the next write
+    assert writes[-1] == ("downloading", 0.30, {"downloaded_bytes": 20, "speed_mbps": 1.5}, False)
+    clock[0] += 10
+    assert e.emit("downloading", 0.30)  # heartbeat
+    assert len(writes) == 3
+
+
+def test_status_changes_and_terminal_states_always_go_out(emitter):
+    e, writes, clock, r = emitter
+    e.emit("downloading", 0.5)
+    assert not e.emit("downloading", 0.6, total_bytes=100)
+    assert e.emit("merging", 0.8)
+    assert e.emit("completed", 1.0, finished=True)
+    assert writes[-1][3] and writes[-1][2] == {"finished": True}
+    assert e.closed and not e.emit("downloading", 0.9)
+    shared = {k.decode(): int(v) for k, v in r.hgetall(metrics.SHARED_KEY).items()}
+    assert shared == {"progress.emitted": 3, "progress.coalesced": 1}
+
+
+def test_coalesced_progress_is_flushed_on_terminal_state(emitter):
+    e, writes, clock, _ = emitter
+    e.emit("downloading", 0.1)
+    e.emit("downloading", 0.4, downloaded_bytes=40)
+    e.emit("failed", message="boom")
+    assert writes[-1] == ("failed", 0.4, {"downloaded_bytes": 40, "message": "boom"}, True)
+
+
+def test_progress_record_round_trip(monkeypatch):
+    r = fakeredis.FakeRedis()
+    monkeypatch.setattr(progress, "get_redis", lambda: r)
+    pipe = r.pipeline(transaction=False)
+    progress.store(pipe, "t2", {"status": "retrying", "retry_in": 3.5, "message": "x"})
+    progress.store(pipe, "t2", {"status": "downloading", "progress": 0.25, "total_bytes": None}, reset=True)
+    pipe.execute()
+    assert progress.read("t2") == {"status": "downloading", "progress": 0.25, "total_bytes": None}
+    assert 0 < r.ttl("progress:t2") <= progress.get_settings().PROGRESS_TTL
+    assert progress.read("missing") is None
+
+
+def test_final_record_lives_as_long_as_the_result(monkeypatch):
+    r = fakeredis.FakeRedis()
+    monkeypatch.setattr(progress, "get_redis", lambda: r)
+    pipe = r.pipeline(transaction=False)
+    progress.store(pipe, "t3", {"status": "completed", "path": "/x"}, final=True)
+    pipe.execute()
+    assert r.ttl("progress:t3") > progress.get_settings().PROGRESS_TTL
+
+
+def test_backend_fallback_reports_the_same_terminal_states(monkeypatch):
+    monkeypatch.setattr(job_queue.progress, "read", lambda task_id: None)
+    states = {"t-ok": ("SUCCESS", {"path": "/x", "file_name": "x.mkv"}), "t-err": ("FAILURE", RuntimeError("boom"))}
+
+    class Result:
+        def __init__(self, task_id, app):
+            self.status, self.info = states[task_id]
+
+        def ready(self):
+            return True
+
+    monkeypatch.setattr(job_queue, "AsyncResult", Result)
+    done = job_queue.get_task_status("t-ok")
+    assert done["status"] == "completed" and done["path"] == "/x" and done["finished"]
+    failed = job_queue.get_task_status("t-err")
+    assert failed["status"] == "failed" and failed["error"] == "boom" and failed["failed"]
@@ -0,0 +1,94 @@
+import asyncio
+import os
+
+import httpx
+
+from app.services.checkpoints import Checkpoint, compact
+from app.services.ranged_download import RangedDownload
+
+DATA = os.urandom(3 * 1024 * 1024 + 123)
+
+
+def _server(ranges: bool):
+    def handler(request: httpx.Request) -> httpx.Response:
+        rng = request.headers.get("range")
+        if not ranges or not rng:
+            return httpx.Response(200, stream=httpx.ByteStream(DATA))
+        a, b = rng.split("=")[1].split("-")
+        a, b = int(a), min(int(b), len(DATA) - 1)
+        return httpx.Response(206, stream=httpx.ByteStream(DATA[a:b + 1]), headers={
+            "Content-Range": f"bytes {a}-{b}/{len(DATA)}", "ETag": '"v1"',
+        })
+    return httpx.MockTransport(handler)
+
+
+def _download(tmp_path, ranges: bool) -> RangedDownload:
+    path = str(tmp_path / "out.bin")
+
+    async def run():
+        async with httpx.AsyncClient(transport=_server(ranges)) as client:
+            dl = RangedDownload("http://upstream/file", {}, path, client=client, connections=4)
+            await dl.run()
+            return dl
+
+    dl = asyncio.run(run())
+    with open(path, "rb") as fh:
+        assert fh.read() == DATA
+    return dl
+
+
+def test_parallel_ranges_fill_the_file(tmp_path):
+    dl = _download(tmp_path, ranges=True)
+    assert dl.ranged and dl.written == len(DATA)
+    assert sum(b - a + 1 for a, b in dl.completed) == len(DATA)
+
+
+def test_falls_back_without_range_support(tmp_path):
+    dl = _download(tmp_path, ranges=False)
+    assert not dl.ranged and dl.total == len(DATA)
+
+
+class _MemoryCheckpoint(Checkpoint):
+    def __init__(self):
+        super().__init__("test-job")
+        self.state = None
+
+    def load(self):
+        return self.state
+
+    def save(self, **fields):
+        self.state = {**fields, "completed": compact(fields["completed"])}
+
+
+def test_resumes_missing_ranges_from_checkpoint(tmp_path):
+    path = str(tmp_path / "out.bin")
+    checkpoint = _MemoryCheckpoint()
+    requested = []
+
+    def handler(request):
+        requested.append(request.headers["range"])
+        return _server(ranges=True).handler(request)
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            dl = RangedDownload("http://upstream/file", {}, path, client=client, connections=2, checkpoint=checkpoint)
+            return dl, await dl.run()
+
+    dl, _ = asyncio.run(run())
+    assert not dl.resumed and checkpoint.state["completed"] == [(0, len(DATA) - 1)]
+
+    # Pretend the previous delivery died with only the first MiB on disk
+    checkpoint.state["completed"] = [(0, 1024 * 1024 - 1)]
+    with open(path, "r+b") as fh:
+        fh.seek(1024 * 1024)
+        fh.write(b"\0" * (len(DATA) - 1024 * 1024))
+    requested.clear()
+    dl, size = asyncio.run(run())
+    assert dl.resumed and size == len(DATA)
+    assert requested[0].startswith(f"bytes={1024 * 1024}-")
+    with open(path, "rb") as fh:
+        assert fh.read() == DATA
+
+
+def test_compact_merges_adjacent_ranges():
+    assert compact([(10, 19), (0, 9), (30, 39), (35, 50)]) == [(0, 19), (30, 50)]
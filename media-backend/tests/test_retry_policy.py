@@ -0,0 +1,38 @@
+import httpx
+
+from app.services import retry_policy
+from app.services.extract_guard import ExtractionBlocked
+from app.services.segmented_fetch import SegmentError
+
+
+def test_classification_table():
+    assert retry_policy.classify(httpx.ReadTimeout("slow")).kind == "network"
+    assert retry_policy.classify(SegmentError("segment 0-9: upstream returned 503")).kind == "upstream"
+    assert retry_policy.classify(Exception("ERROR: HTTP Error 429: Too Many Requests")).kind == "rate_limited"
+    assert retry_policy.classify(Exception("ERROR: HTTP Error 403: Forbidden")).retry
+    assert not retry_policy.classify(Exception("ERROR: [youtube] abc: Private video")).retry
+    assert not retry_policy.classify(Exception("Progressive format 22 not found")).retry
+    assert not retry_policy.classify(ValueError("bug")).retry
+
+
+def test_network_rule_matches_transport_failures_only():
+    for msg in ("[Errno 104] Connection reset by peer", "<urlopen error [Errno 111] Connection refused>",
+                "The read operation timed out", "peer closed connection without sending complete message body",
+                "IncompleteRead(1024 bytes read, 2048 more expected)", "got 100 of 4096 bytes"):
+        assert retry_policy.classify(Exception(msg)) is retry_policy.NETWORK_RULE, msg
+    for msg in ("Invalid connection string for storage", "socket module has no attribute AF_UNIX",
+                "Social network login required"):
+        assert not retry_policy.classify(Exception(msg)).retry, msg
+
+
+def test_blocked_extraction_retries_after_the_block():
+    rule = retry_policy.classify(ExtractionBlocked("breaker open", "rate_limited", 42))
+    assert rule.retry and rule.base_delay == 42
+    assert not retry_policy.classify(ExtractionBlocked("cached", "unavailable", 3600)).retry
+
+
+def test_backoff_is_jittered_exponential_and_capped():
+    rule = retry_policy.NETWORK_RULE
+    for attempt in range(12):
+        cap = min(retry_policy.get_settings().RETRY_BACKOFF_MAX, rule.base_delay * 2 ** attempt)
+        assert cap / 2 <= retry_policy.backoff(attempt, rule) <= cap
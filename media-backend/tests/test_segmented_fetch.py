@@ -0,0 +1,131 @@
+import asyncio
+import os
+
+import httpx
+import pytest
+
+from app.services.segmented_fetch import EntityChanged, SegmentedFetch
+from app.services.stream_budget import ByteBudget
+
+DATA = os.urandom(5 * 1024 * 1024 + 77)
+MiB = 1024 * 1024
+
+
+def _range(request: httpx.Request):
+    a, b = request.headers["range"].split("=")[1].split("-")
+    return int(a), (int(b) if b else None)
+
+
+async def _ranged(request: httpx.Request) -> httpx.Response:
+    a, b = _range(request)
+    b = len(DATA) - 1 if b is None else min(b, len(DATA) - 1)
+    if a > 0:
+        # Earlier segments answer last, so they complete out of order
+        await asyncio.sleep(0.05 * (len(DATA) - a) / len(DATA))
+    return httpx.Response(206, stream=httpx.ByteStream(DATA[a:b + 1]),
+                          headers={"Content-Range": f"bytes {a}-{b}/{len(DATA)}"})
+
+
+def _read(handler, budget=None, stop_after=None, **kwargs):
+    budget = budget or ByteBudget(64 * MiB)
+
+    async def run():
+        out = bytearray()
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            fetch = SegmentedFetch("http://upstream/file", {}, client=client, connections=4,
+                                   use_host_slots=False, budget=budget, **kwargs)
+            try:
+                await fetch.open()
+                async for chunk in fetch.iter_bytes():
+                    out += chunk
+                    if stop_after is not None and len(out) >= stop_after:
+                        break
+            finally:
+                await fetch.aclose()
+        return fetch, bytes(out)
+
+    return asyncio.run(run())
+
+
+def test_segments_are_yielded_in_order():
+    fetch, body = _read(_ranged)
+    assert fetch.ranged and fetch.total == len(DATA)
+    assert body == DATA
+
+
+def test_failed_segment_is_retried():
+    failed = set()
+
+    async def handler(request):
+        a, _ = _range(request)
+        if a > 0 and a not in failed:
+            failed.add(a)
+            return httpx.Response(503)
+        return await _ranged(request)
+
+    _, body = _read(handler)
+    assert body == DATA and failed
+
+
+def test_unknown_total_reads_on_until_upstream_runs_dry():
+    requested = []
+
+    def handler(request):
+        a, b = _range(request)
+        requested.append((a, b))
+        if a >= len(DATA):
+            return httpx.Response(416, headers={"Content-Range": "bytes */*"})
+        # Upstream never tells the size and caps every response at 2 MiB
+        b = min(len(DATA) - 1, a + 2 * MiB - 1 if b is None else b)
+        return httpx.Response(206, stream=httpx.ByteStream(DATA[a:b + 1]),
+                              headers={"Content-Range": f"bytes {a}-{b}/*"})
+
+    fetch, body = _read(handler)
+    assert fetch.sequential and fetch.content_length is None
+    assert body == DATA
+    assert requested[-1] == (len(DATA), None)
+
+
+def test_every_segment_carries_the_first_validator():
+    validators = []
+
+    async def handler(request):
+        validators.append(request.headers.get("if-range"))
+        r = await _ranged(request)
+        r.headers["ETag"] = '"v1"'
+        return r
+
+    _, body = _read(handler)
+    assert body == DATA
+    assert validators[0] is None and len(validators) > 1
+    assert all(v == '"v1"' for v in validators[1:])
+
+
+@pytest.mark.parametrize("changed", ["full", "total"])
+def test_changed_entity_aborts_instead_of_splicing(changed):
+    requests = []
+
+    async def handler(request):
+        a, b = _range(request)
+        requests.append(a)
+        if a == 0:
+            return await _ranged(request)
+        if changed == "full":
+            # If-Range no longer matches: the whole new entity comes back
+            return httpx.Response(200, stream=httpx.ByteStream(DATA[::-1]))
+        return httpx.Response(206, stream=httpx.ByteStream(DATA[a:b + 1]),
+                              headers={"Content-Range": f"bytes {a}-{b}/{len(DATA) + 1}"})
+
+    with pytest.raises(EntityChanged):
+        _read(handler)
+    # Not retried: one request per segment at most
+    assert len(requests) == len(set(requests))
+
+
+def test_budget_is_released_after_early_close():
+    budget = ByteBudget(64 * MiB)
+    _, body = _read(_ranged, budget=budget)
+    assert body == DATA and budget.used == 0
+
+    _, body = _read(_ranged, budget=budget, stop_after=2 * MiB)
+    assert DATA.startswith(body) and budget.used == 0
@@ -0,0 +1,100 @@
+import threading
+import time
+
+import fakeredis
+import pytest
+
+from app.services import singleflight
+
+KEY = "youtube:abc"
+
+
+@pytest.fixture
+def r(monkeypatch):
+    r = fakeredis.FakeRedis()
+    monkeypatch.setattr(singleflight, "get_redis", lambda: r)
+    settings = singleflight.get_settings()
+    monkeypatch.setattr(settings, "SINGLEFLIGHT_POLL_INTERVAL", 0.01)
+    monkeypatch.setattr(settings, "SINGLEFLIGHT_WAIT_TIMEOUT", 5)
+    return r
+
+
+def _spawn(fn, load=lambda: None):
+    """Run do_shared on a thread; returns (thread, outcome)."""
+    outcome = {}
+
+    def run():
+        try:
+            outcome["result"] = singleflight.do_shared(KEY, fn, load)
+        except Exception as e:
+            outcome["error"] = e
+
+    t = threading.Thread(target=run)
+    t.start()
+    return t, outcome
+
+
+def _follow(r, fn):
+    """Like _spawn, once the leader holds the lock."""
+    while not r.exists(singleflight.LOCK_PREFIX + KEY):
+        time.sleep(0.005)
+    return _spawn(fn)
+
+
+def test_leader_and_follower_share_one_computation(r):
+    calls = []
+    release = threading.Event()
+
+    def compute():
+        calls.append(1)
+        release.wait(5)
+        return {"title": "shared"}
+
+    t, leader = _spawn(compute)
+    follower, outcome = _follow(r, compute)
+    time.sleep(0.05)  # the follower is polling by now
+    release.set()
+    t.join(5)
+    follower.join(5)
+
+    assert leader["result"] == outcome["result"] == {"title": "shared"}
+    assert len(calls) == 1
+    assert not r.exists(singleflight.LOCK_PREFIX + KEY)
+
+
+def test_follower_receives_the_leaders_error(r):
+    release = threading.Event()
+    follower_calls = []
+
+    def fail():
+        release.wait(5)
+        raise RuntimeError("Video unavailable")
+
+    t, leader = _spawn(fail)
+    follower, outcome = _follow(r, lambda: follower_calls.append(1))
+    time.sleep(0.05)
+    release.set()
+    t.join(5)
+    follower.join(5)
+
+    assert str(leader["error"]) == "Video unavailable"
+    assert isinstance(outcome["error"], singleflight.SingleFlightError)
+    assert "Video unavailable" in str(outcome["error"])
+    assert not follower_calls
+
+
+def test_expired_lock_lets_a_new_leader_take_over(r):
+    lock_key = singleflight.LOCK_PREFIX + KEY
+    # A leader that crashed without releasing: its lock only goes away by TTL
+    r.set(lock_key, "crashed-leader", px=150)
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return {"title": "recovered"}
+
+    started = time.monotonic()
+    assert singleflight.do_shared(KEY, compute, lambda: None) == {"title": "recovered"}
+    assert time.monotonic() - started >= 0.1
+    assert calls == [1]
+    assert not r.exists(lock_key)
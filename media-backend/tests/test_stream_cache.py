@@ -0,0 +1,86 @@
+import asyncio
+import os
+
+import fakeredis
+import pytest
+
+from app.services import stream_cache
+
+DATA = os.urandom(256 * 1024)
+
+
+@pytest.fixture
+def cache(monkeypatch, tmp_path):
+    r = fakeredis.FakeRedis()
+    monkeypatch.setattr(stream_cache, "get_redis", lambda: r)
+    settings = stream_cache.get_settings()
+    monkeypatch.setattr(settings, "STORAGE_DIR", str(tmp_path))
+    monkeypatch.setattr(settings, "STREAM_CACHE_FILL_TTL", 1)
+    return stream_cache.entry_for("youtube:abc", "18", "mp4"), r
+
+
+async def _fill(entry, data, token, commit=True):
+    tee = await stream_cache.TeeWriter.open(entry, len(DATA), token)
+    for i in range(0, len(data), 64 * 1024):
+        await tee.write(data[i:i + 64 * 1024])
+    return tee, (await tee.commit() if commit else None)
+
+
+def test_complete_fill_is_published(cache):
+    entry, r = cache
+    token = stream_cache.claim_fill(entry, len(DATA), {"last_modified": None})
+    assert token and stream_cache.claim_fill(entry, len(DATA), {}) is None
+
+    async def run():
+        tee, _ = await _fill(entry, DATA[:100], token, commit=False)
+        assert stream_cache.filling(entry)["total"] == len(DATA)
+        await tee.write(DATA[100:])
+        return await tee.commit()
+
+    committed = asyncio.run(run())
+    assert committed and stream_cache.lookup(entry)["total"] == len(DATA)
+    assert open(entry.path, "rb").read() == DATA
+    assert not r.exists(stream_cache.FILL_PREFIX + entry.sha)
+    assert sorted(os.listdir(stream_cache.cache_root())) == [entry.sha + ".json", entry.sha + ".mp4"]
+
+
+def test_lease_is_kept_by_an_idle_writer(cache):
+    entry, r = cache
+    token = stream_cache.claim_fill(entry, len(DATA), {})
+
+    async def run():
+        tee = await stream_cache.TeeWriter.open(entry, len(DATA), token)
+        await asyncio.sleep(1.5)  # longer than STREAM_CACHE_FILL_TTL, without writing
+        assert r.get(stream_cache.FILL_PREFIX + entry.sha) == token.encode()
+        await tee.abort()
+
+    asyncio.run(run())
+    assert not r.exists(stream_cache.FILL_PREFIX + entry.sha)
+    assert os.listdir(stream_cache.cache_root()) == []
+
+
+def test_writer_that_lost_its_lease_does_not_publish(cache):
+    entry, r = cache
+
+    async def run():
+        stalled = stream_cache.claim_fill(entry, len(DATA), {})
+        first, _ = await _fill(entry, DATA[:100], stalled, commit=False)
+        # The lease expires while the first writer stalls; a second request takes over
+        r.delete(stream_cache.FILL_PREFIX + entry.sha)
+        token = stream_cache.claim_fill(entry, len(DATA), {})
+        assert token and token != stalled
+        second, _ = await _fill(entry, DATA[:50], token, commit=False)
+        assert stream_cache.filling(entry)["part"] == second.part != first.part
+
+        # The stalled writer finishes with a full byte count but must not publish
+        await first.write(DATA[100:])
+        assert not await first.commit()
+        assert not os.path.exists(entry.path)
+        assert r.get(stream_cache.FILL_PREFIX + entry.sha) == token.encode()
+
+        await second.write(DATA[50:])
+        assert await second.commit()
+
+    asyncio.run(run())
+    assert open(entry.path, "rb").read() == DATA
+    assert sorted(os.listdir(stream_cache.cache_root())) == [entry.sha + ".json", entry.sha + ".mp4"]
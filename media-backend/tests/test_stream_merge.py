@@ -0,0 +1,237 @@
+import asyncio
+import os
+import stat
+import sys
+
+import httpx
+import pytest
+
+from app.api.routes import media
+from app.services import stream_merge
+from app.services.extract_guard import ExtractionBlocked
+from app.services.segmented_fetch import SegmentedFetch
+from app.workers import celery_tasks
+
+VIDEO = os.urandom(300 * 1024)
+AUDIO = os.urandom(70 * 1024)
+BODIES = {"/video": VIDEO, "/audio": AUDIO}
+
+# Stands in for ffmpeg: concatenates its pipe inputs into the output (a file
+# or stdout), or reads a little and fails like it does on an unseekable mp4
+FAKE_FFMPEG = f"""#!{sys.executable}
+import os, sys, threading
+args = sys.argv[1:]
+fds = [int(a.split(":")[1]) for a in args if a.startswith("pipe:")]
+if os.environ.get("FAKE_FFMPEG_FAIL"):
+    os.read(fds[0], 10)
+    sys.stderr.write("moov atom not found\\n")
+    sys.exit(1)
+data = [b""] * len(fds)
+def read(i, fd):
+    chunks = []
+    while True:
+        b = os.read(fd, 65536)
+        if not b:
+            break
+        chunks.append(b)
+    data[i] = b"".join(chunks)
+threads = [threading.Thread(target=read, args=(i, fd)) for i, fd in enumerate(fds)]
+[t.start() for t in threads]
+[t.join() for t in threads]
+if args[-1] == "pipe:1":
+    sys.stdout.buffer.write(b"".join(data))
+else:
+    open(args[-1], "wb").write(b"".join(data))
+"""
+
+
+def _upstream(request: httpx.Request) -> httpx.Response:
+    body = BODIES[request.url.path]
+    a, b = request.headers["range"].split("=")[1].split("-")
+    a, b = int(a), min(int(b) if b else len(body) - 1, len(body) - 1)
+    return httpx.Response(206, stream=httpx.ByteStream(body[a:b + 1]),
+                          headers={"Content-Range": f"bytes {a}-{b}/{len(body)}"})
+
+
+@pytest.fixture
+def upstream(monkeypatch, tmp_path):
+    ffmpeg = tmp_path / "bin" / "ffmpeg"
+    ffmpeg.parent.mkdir()
+    ffmpeg.write_text(FAKE_FFMPEG)
+    ffmpeg.chmod(ffmpeg.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setenv("PATH", f"{ffmpeg.parent}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setattr(stream_merge.http_pool, "create_client",
+                        lambda http2=None: (httpx.AsyncClient(transport=httpx.MockTransport(_upstream)), None))
+    client = httpx.AsyncClient(transport=httpx.MockTransport(_upstream))
+    monkeypatch.setattr(stream_merge, "SegmentedFetch",
+                        lambda url, headers, **kw: SegmentedFetch(url, headers, **{"client": client,
+                                                                                   "use_host_slots": False, **kw}))
+    monkeypatch.setattr(stream_merge, "_live_slots", None)
+    monkeypatch.setattr(stream_merge, "_live_writers", None)
+    return {
+        "video": {"format_id": "137", "url": "http://upstream/video", "ext": "mp4", "filesize": len(VIDEO)},
+        "audio": {"format_id": "140", "url": "http://upstream/audio", "ext": "m4a", "filesize": len(AUDIO)},
+    }
+
+
+pytestmark = pytest.mark.skipif(not stream_merge.supported(), reason="piped merge needs POSIX")
+
+
+def test_inputs_are_piped_into_ffmpeg(upstream, tmp_path):
+    out = tmp_path / "out.mkv"
+    reported = []
+    fed = stream_merge.merge_streaming(upstream["video"], upstream["audio"], str(out), reported.append)
+    assert fed == len(VIDEO) + len(AUDIO)
+    assert out.read_bytes() == VIDEO + AUDIO
+    assert reported[-1] == 1.0
+
+
+def test_failed_merge_removes_the_output(upstream, tmp_path, monkeypatch):
+    monkeypatch.setenv("FAKE_FFMPEG_FAIL", "1")
+    out = tmp_path / "out.mkv"
+    with pytest.raises(stream_merge.StreamMergeError, match="moov atom not found"):
+        stream_merge.merge_streaming(upstream["video"], upstream["audio"], str(out))
+    assert not out.exists()
+
+
+@pytest.fixture
+def merge_task(upstream, tmp_path, monkeypatch):
+    """Run download_and_merge in-process: piped merge for real, temp-file path mocked."""
+    monkeypatch.setattr(celery_tasks, "get_settings", lambda: type("S", (), {"MERGE_MODE": "stream"})())
+    monkeypatch.setattr(celery_tasks, "resolve_formats",
+                        lambda url, ids, key, refresh: ({}, {"137": upstream["video"], "140": upstream["audio"]}))
+    monkeypatch.setattr(celery_tasks, "tmp_path", lambda name: str(tmp_path / name))
+    monkeypatch.setattr(celery_tasks, "move_into_storage", lambda path, name: path)
+    monkeypatch.setattr(celery_tasks.artifact_index, "record", lambda *a: None)
+    monkeypatch.setattr(celery_tasks.inflight, "finish", lambda *a: None)
+    monkeypatch.setattr(celery_tasks.checkpoints.Checkpoint, "clear", lambda self: None)
+
+    def download_legs(legs, on_progress):
+        paths = {}
+        for leg in legs:
+            paths[leg.name] = str(tmp_path / leg.name)
+            with open(paths[leg.name], "wb") as fh:
+                fh.write(BODIES["/" + leg.name])
+        return paths
+
+    def merge(video_path, audio_path, output_path, progress_callback):
+        with open(output_path, "wb") as fh:
+            fh.write(open(video_path, "rb").read() + open(audio_path, "rb").read())
+
+    monkeypatch.setattr(celery_tasks.merge_legs, "download_legs", download_legs)
+    monkeypatch.setattr(celery_tasks, "merge_simple_reliable", merge)
+    updates = []
+    monkeypatch.setattr(celery_tasks, "update_task_progress",
+                        lambda status, progress=None, **extra: updates.append((status, progress, extra)))
+    emitter = type("Emitter", (), {"emit": lambda self, status, progress=None, **extra: updates.append(
+        (status, progress, extra))})()
+    monkeypatch.setattr(celery_tasks, "task_progress", lambda task: emitter)
+
+    def run(retries=0):
+        task = celery_tasks.download_and_merge
+        task.push_request(id="task-1", retries=retries)
+        try:
+            return task.run({"url": "http://site/watch", "format": "137+140", "media_key": "site:1"})
+        finally:
+            task.pop_request()
+
+    return run, updates
+
+
+def test_task_merges_through_pipes(merge_task):
+    run, _ = merge_task
+    result = run()
+    assert result["method"] == "stream_merge"
+    assert open(result["path"], "rb").read() == VIDEO + AUDIO
+
+
+def test_task_falls_back_to_temp_files_and_says_so(merge_task, monkeypatch):
+    monkeypatch.setenv("FAKE_FFMPEG_FAIL", "1")
+    run, updates = merge_task
+    result = run()
+    assert result["method"] == "merge"
+    assert open(result["path"], "rb").read() == VIDEO + AUDIO
+    statuses = [status for status, _, _ in updates]
+    fallback = statuses.index("fallback")
+    assert updates[fallback][1] == 0.0 and "temp files" in updates[fallback][2]["message"]
+    assert statuses[fallback + 1:][:1] == ["downloading"]
+    assert statuses[-1] == "completed"
+
+
+def test_retried_task_uses_resumable_temp_files(merge_task, monkeypatch):
+    monkeypatch.setattr(celery_tasks.stream_merge, "merge_streaming", None)  # must not be called
+    run, _ = merge_task
+    assert run(retries=1)["method"] == "merge"
+
+
+def _live(upstream, read_all=True):
+    async def run():
+        merge = stream_merge.LiveMerge(upstream["video"], upstream["audio"])
+        out = bytearray()
+        try:
+            await merge.start()
+            async for chunk in merge.iter_bytes():
+                out += chunk
+                if not read_all:
+                    break
+        finally:
+            await merge.aclose()
+            await merge.aclose()  # idempotent
+        return merge, bytes(out)
+
+    return asyncio.run(run())
+
+
+def test_live_merge_streams_the_muxed_output(upstream):
+    merge, body = _live(upstream)
+    assert merge.container == stream_merge.FRAGMENTED_MP4
+    assert body == VIDEO + AUDIO and merge.bytes_out == len(body)
+    assert stream_merge._live_slots._value == stream_merge.get_settings().LIVE_MERGE_MAX
+
+
+def test_live_merge_closed_early_stops_ffmpeg(upstream):
+    merge, body = _live(upstream, read_all=False)
+    assert body and merge._proc.returncode is not None
+    assert all(task.done() for task in merge._feeders)
+    assert stream_merge._live_slots._value == stream_merge.get_settings().LIVE_MERGE_MAX
+
+
+def test_live_merge_failure_is_raised_before_any_output(upstream, monkeypatch):
+    monkeypatch.setenv("FAKE_FFMPEG_FAIL", "1")
+    with pytest.raises(stream_merge.StreamMergeError, match="moov atom not found"):
+        _live(upstream)
+    assert stream_merge._live_slots._value == stream_merge.get_settings().LIVE_MERGE_MAX
+
+
+def test_live_merges_beyond_the_limit_are_refused(upstream, monkeypatch):
+    monkeypatch.setattr(stream_merge.get_settings(), "LIVE_MERGE_MAX", 1)
+
+    async def run():
+        first = stream_merge.LiveMerge(upstream["video"], upstream["audio"])
+        await first.start()
+        second = stream_merge.LiveMerge(upstream["video"], upstream["audio"])
+        try:
+            with pytest.raises(stream_merge.StreamMergeError, match="already running"):
+                await second.start()
+        finally:
+            await second.aclose()
+            await first.aclose()
+        third = stream_merge.LiveMerge(upstream["video"], upstream["audio"])
+        await third.start()  # the slot is free again
+        await third.aclose()
+
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize("error", [RuntimeError("format 137 missing"), ExtractionBlocked("blocked", "geo", 60)])
+def test_live_merge_falls_back_when_formats_cannot_be_resolved(monkeypatch, error):
+    def resolve(*args):
+        raise error
+
+    monkeypatch.setattr(media.artifact_index, "lookup", lambda *args: None)
+    monkeypatch.setattr(media, "resolve_formats", resolve)
+    if isinstance(error, ExtractionBlocked):
+        with pytest.raises(ExtractionBlocked):
+            asyncio.run(media._live_merge("137+140", "https://site/watch?v=1"))
+    else:
+        assert asyncio.run(media._live_merge("137+140", "https://site/watch?v=1")) is None
@@ -0,0 +1,36 @@
+from starlette.requests import Request
+
+from app.api.routes.media import _etag_for, _parse_range, _range_headers
+from app.services.ytdlp_service import snapshot_format
+
+
+def _req(**headers) -> Request:
+    raw = [(k.replace("_", "-").lower().encode(), v.encode()) for k, v in headers.items()]
+    return Request({"type": "http", "headers": raw})
+
+
+def test_parse_single_ranges():
+    assert _parse_range("bytes=100-") == (100, None)
+    assert _parse_range("bytes=0-499") == (0, 499)
+    assert _parse_range("bytes=-500") == (None, 500)
+    assert _parse_range("bytes=0-1,5-9") is None
+    assert _parse_range("bytes=9-5") is None
+    assert _parse_range("items=0-1") is None
+
+
+def test_if_range_with_stale_etag_drops_range():
+    etag = '"abc"'
+    assert _range_headers(_req(range="bytes=10-"), etag) == {"Range": "bytes=10-"}
+    assert _range_headers(_req(range="bytes=10-", if_range='"abc"'), etag) == {"Range": "bytes=10-"}
+    assert _range_headers(_req(range="bytes=10-", if_range='"old"'), etag) == {}
+    date = "Wed, 21 Oct 2015 07:28:00 GMT"
+    assert _range_headers(_req(range="bytes=10-", if_range=date), etag) == {"Range": "bytes=10-", "If-Range": date}
+
+
+def test_etag_comes_from_the_normalized_snapshot():
+    # Only an approximate size: the cache and proxy paths must still agree on the ETag
+    info = {"formats": [{"format_id": "18", "url": "https://a/v.mp4", "filesize_approx": 12345}]}
+    snap = snapshot_format(info, "18")
+    assert snap["filesize"] == 12345
+    assert _etag_for("site:1", snap) != _etag_for("site:1", info["formats"][0])
+    assert _etag_for("site:1", snap) == _etag_for("site:1", snapshot_format(info, "18"))
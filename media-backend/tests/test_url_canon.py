@@ -0,0 +1,26 @@
+from app.services.url_canon import MediaKey, canonicalize, cache_key, extraction_url, platform_for
+
+
+def test_youtube_share_variants_collapse_to_one_key():
+    urls = [
+        "https://youtu.be/dQw4w9WgXcQ?si=abc123",
+        "https://www.youtube.com/watch?v=dQw4w9WgXcQ&si=xyz&feature=share",
+        "https://m.youtube.com/watch?list=PL1&v=dQw4w9WgXcQ",
+        "https://youtube.com/shorts/dQw4w9WgXcQ?feature=share",
+        "music.youtube.com/watch?v=dQw4w9WgXcQ",
+    ]
+    assert {canonicalize(u) for u in urls} == {MediaKey("youtube", "dQw4w9WgXcQ")}
+    assert extraction_url(urls[2]) == "https://www.youtube.com/watch?v=dQw4w9WgXcQ"
+
+
+def test_twitter_and_x_share_a_key():
+    assert cache_key("https://x.com/user/status/1234567890?s=20") == "twitter:1234567890"
+    assert cache_key("https://mobile.twitter.com/user/status/1234567890") == "twitter:1234567890"
+    assert platform_for("https://x.com/foo") == "twitter"
+
+
+def test_unknown_hosts_ignore_tracking_params():
+    a = canonicalize("https://example.com/v/1?utm_source=app&b=2&a=1#t")
+    b = canonicalize("https://www.example.com/v/1/?a=1&b=2")
+    assert a == b and a.platform == "url"
+    assert platform_for("https://example.com/") is None
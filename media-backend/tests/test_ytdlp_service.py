@@ -0,0 +1,47 @@
+import http.cookiejar
+import os
+
+import pytest
+
+from app.services import ytdlp_service
+
+COOKIES = """# Netscape HTTP Cookie File
+.youtube.com\tTRUE\t/\tTRUE\t2000000000\tSID\told
+"""
+
+
+@pytest.fixture
+def cookiefile(tmp_path, monkeypatch):
+    monkeypatch.setattr(ytdlp_service, "_pool", {})
+    path = tmp_path / "youtube.txt"
+    path.write_text(COOKIES)
+    os.utime(path, (1_000_000, 1_000_000))
+    return str(path)
+
+
+def _rotate(ydl, value):
+    ydl.cookiejar.set_cookie(http.cookiejar.Cookie(
+        0, "SID", value, None, False, ".youtube.com", True, True, "/", True, True, 2000000000,
+        False, None, None, {}))
+
+
+def test_unchanged_jar_is_not_written_back(cookiefile):
+    with ytdlp_service.pooled_ydl("info", {"quiet": True}, cookiefile) as first:
+        pass
+    assert os.path.getmtime(cookiefile) == 1_000_000
+    with ytdlp_service.pooled_ydl("info", {"quiet": True}, cookiefile) as again:
+        assert again is first
+    assert ytdlp_service.pool_stats() == {"info": 1}
+
+
+def test_rotated_cookies_are_saved_and_the_instance_stays_pooled(cookiefile):
+    with ytdlp_service.pooled_ydl("info", {"quiet": True}, cookiefile) as first:
+        with ytdlp_service.pooled_ydl("info", {"quiet": True}, cookiefile) as other:
+            pass  # idle with the old cookies once `first` saves
+        _rotate(first, "new")
+    assert "\tSID\tnew" in open(cookiefile).read()
+    assert os.path.getmtime(cookiefile) != 1_000_000
+
+    with ytdlp_service.pooled_ydl("info", {"quiet": True}, cookiefile) as again:
+        assert again is first  # re-keyed under the new mtime
+    assert other not in sum(ytdlp_service._pool.values(), [])